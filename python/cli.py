@@ -107,6 +107,18 @@ def editor_command_print_next_line(toolapiob, arg_string):
     toolapiob.editor_state.set_line_number(line_number)
     print_line(toolapiob, line_number)
 
+def editor_command_stats(toolapiob, arg_string):
+    "Stats - Show the analysis counters and load phase timings"
+    result = toolapiob.get_analysis_stats()
+    if type(result) in types.StringTypes:
+        print "ERROR: unable to get statistics -", result
+        return
+    counters, phase_times = result
+    for stat_name, value in counters:
+        print "%-30s %d" % (stat_name, value)
+    for phase_name, seconds in phase_times:
+        print "%-30s %0.3fs" % (phase_name, seconds)
+
 def print_line(toolapiob, line_number):
     row = toolapiob.editor_state.get_row_for_line_number(line_number)
     row_widths = [ 10, 10, 10, 10, 25 ]
@@ -133,6 +145,7 @@ def create_command_mapping(toolapiob):
         d["<number>"] = editor_command_go_to_line
         d["p"] = editor_command_print_current_line
         d[""] = editor_command_print_next_line
+        d["stats"] = editor_command_stats
     else:
         d["<number>"] = default_command_no_file_loaded
         d["p"] = default_command_no_file_loaded
@@ -18,9 +18,15 @@
 
 DEBUG_ANNOTATE_DISASSEMBLY = True
 
+import array
 import bisect
+import hashlib
 import logging
+import multiprocessing
 import os
+import re
+import tempfile
+import time
 
 #from disassembly_data import *
 import loaderlib
@@ -56,12 +62,105 @@ display_configuration = DisplayConfiguration()
 
 ## disassembly_data.SegmentBlock flag helpers
 
+INSTRUCTION_CACHE_SIZE = 20000
+
+ANALYSIS_STAT_NAMES = (
+    "instructions_decoded",
+    "instruction_cache_hits",
+    "instruction_cache_misses",
+    "split_block_calls",
+    "split_block_errors",
+    "line_index_recalculations",
+    "blocks_created",
+    "xrefs_inserted",
+)
+
+def get_analysis_stats(program_data):
+    """ Returns the analysis counters and the load phase durations, each as a list of (name, value). """
+    counters = [ (stat_name, program_data.stats[stat_name]) for stat_name in ANALYSIS_STAT_NAMES ]
+    return counters, program_data.phase_times.items()
+
+def _record_phase_time(program_data, phase_name, start_time):
+    program_data.phase_times[phase_name] = program_data.phase_times.get(phase_name, 0.0) + time.time() - start_time
+
 def realise_instruction_entry(program_data, block, block_offset):
-    data = loaderlib.get_segment_data(program_data.loader_segments, block.segment_id)
-    data_offset_start = block.segment_offset + block_offset
-    match, data_offset_end = program_data.dis_disassemble_one_line_func(data, data_offset_start, block.address + block_offset)
+    """ Instructions are decoded when needed, with the most recently used kept in a bounded cache. """
+    address = block.address + block_offset
+    cache = program_data.instruction_cache
+    match = cache.pop(address, None)
+    if match is None:
+        program_data.stats["instruction_cache_misses"] += 1
+        program_data.stats["instructions_decoded"] += 1
+        data = loaderlib.get_segment_data(program_data.loader_segments, block.segment_id)
+        data_offset_start = block.segment_offset + block_offset
+        match, data_offset_end = program_data.dis_disassemble_one_line_func(data, data_offset_start, address)
+        if match is None:
+            return match
+        if len(cache) >= INSTRUCTION_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        program_data.stats["instruction_cache_hits"] += 1
+    cache[address] = match
     return match
 
+def cache_instruction_entry(program_data, match):
+    cache = program_data.instruction_cache
+    if len(cache) >= INSTRUCTION_CACHE_SIZE:
+        cache.popitem(last=False)
+    cache[match.pc-2] = match
+
+def get_instruction_flags(program_data, match):
+    """ Classify the instruction, for the purposes of laying out the lines without decoding it again. """
+    flags = 0
+    if match.specification.key == "TRAP":
+        flags |= disassembly_data.CLF_TRAP
+    elif match.specification.key in ("Bcc", "DBcc",):
+        flags |= disassembly_data.CLF_BRANCH
+    if program_data.dis_is_final_instruction_func(match):
+        flags |= disassembly_data.CLF_FINAL
+    return flags
+
+def _realise_code_line_data(program_data, block):
+    """ Line data loaded from older project files, only has the block offsets of the instructions. """
+    while block is not None:
+        line_data = block.line_data
+        lengths = line_data.lengths
+        for i, type_id in enumerate(line_data.type_ids):
+            if type_id == disassembly_data.SLD_INSTRUCTION and lengths[i] == 0:
+                match = realise_instruction_entry(program_data, block, line_data.offsets[i])
+                # The saved bytes may no longer decode, if the decoder has changed since.
+                if match is None:
+                    block = _split_off_undecodable_instruction(program_data, block, i)
+                    break
+                line_data.lengths[i] = match.num_bytes
+                line_data.flags[i] = get_instruction_flags(program_data, match)
+        else:
+            block = None
+
+def _split_off_undecodable_instruction(program_data, block, idx):
+    """ The bytes up to the next saved instruction become a data block.  Returns the block of the instructions after them, if any. """
+    line_data = block.line_data
+    block_offset0 = line_data.offsets[idx]
+    block_offsetN = block.length
+    for i in xrange(idx+1, len(line_data)):
+        if line_data.type_ids[i] == disassembly_data.SLD_INSTRUCTION:
+            block_offsetN = line_data.offsets[i]
+            break
+    address = block.address + block_offset0
+    logger.error("Unable to decode saved instruction at $%06X, its %d bytes are now data", address, block_offsetN - block_offset0)
+
+    # Splitting a code block relies on the lengths of the instructions before the split.
+    line_data.lengths[idx] = block_offsetN - block_offset0
+    trailing_block = None
+    if block_offsetN < block.length:
+        trailing_block, trailing_block_idx = split_block(program_data, block.address + block_offsetN)
+    if block_offset0 > 0:
+        block, block_idx = split_block(program_data, address)
+    else:
+        block_idx = None
+    set_block_data_type(program_data, disassembly_data.DATA_TYPE_LONGWORD, block, block_idx=block_idx)
+    return trailing_block
+
 
 SEGMENT_HEADER_LINE_COUNT = 2
 
@@ -71,34 +170,35 @@ def get_block_header_line_count(program_data, block):
     return 0
 
 
-def get_instruction_line_count(program_data, match):
+def get_instruction_line_count(program_data, flags):
     line_count = 1
-    if display_configuration.trailing_line_trap and match.specification.key == "TRAP":
+    if display_configuration.trailing_line_trap and flags & disassembly_data.CLF_TRAP:
         line_count += 1
-    elif display_configuration.trailing_line_branch and match.specification.key in ("Bcc", "DBcc",):
+    elif display_configuration.trailing_line_branch and flags & disassembly_data.CLF_BRANCH:
         line_count += 1
     return line_count
 
 
-def get_block_line_count(program_data, block):
+def get_block_line_count(program_data, block, data_type=None, line_data=None):
+    """ The data type and line data can be given, to get the line count the block would have with them. """
     # Overwrite the old line count, it's OK, we've notified any removal if necessary.
     line_count = get_block_header_line_count(program_data, block)
 
-    data_type = disassembly_data.get_block_data_type(block)
+    if data_type is None:
+        data_type = disassembly_data.get_block_data_type(block)
+        line_data = block.line_data
     if data_type == disassembly_data.DATA_TYPE_CODE:
-        for type_id, entry in block.line_data:
+        for i, type_id in enumerate(line_data.type_ids):
             if type_id == disassembly_data.SLD_INSTRUCTION:
-                if type(entry) is int:
-                    entry = realise_instruction_entry(program_data, block, entry)
-                line_count += get_instruction_line_count(program_data, entry)
+                line_count += get_instruction_line_count(program_data, line_data.flags[i])
             elif type_id in (disassembly_data.SLD_COMMENT_FULL_LINE, disassembly_data.SLD_EQU_LOCATION_RELATIVE):
                 line_count += 1
     elif data_type in disassembly_data.NUMERIC_DATA_TYPES:
-        sizes = get_data_type_sizes(block)
+        sizes = get_data_type_sizes(block, data_type)
         for size_char, num_bytes, size_count, size_lines in sizes:
             line_count += size_lines
     elif data_type == disassembly_data.DATA_TYPE_ASCII:
-        line_count = len(block.line_data)
+        line_count = len(line_data)
     else:
         # This will cause an error, but if it is happening, there are larger problems.
         return
@@ -111,41 +211,42 @@ def get_block_line_count(program_data, block):
             line_count += len(addresses)
 
     discard, block_idx = lookup_block_by_address(program_data, block.address)
-    line_count += get_block_footer_line_count(program_data, block, block_idx)
+    line_count += get_block_footer_line_count(program_data, block, block_idx, data_type, line_data)
 
     return line_count
 
 def get_code_block_info_for_address(program_data, address):
     block, block_idx = lookup_block_by_address(program_data, address)
     base_address = program_data.block_addresses[block_idx]
+    line_data = block.line_data
 
     bytes_used = 0
     line_number = get_block_line_number(program_data, block_idx) + get_block_header_line_count(program_data, block)
     previous_result = None
-    for type_id, entry in block.line_data:
+    for i, type_id in enumerate(line_data.type_ids):
         if type_id == disassembly_data.SLD_INSTRUCTION:
             # Within but not at the start of the previous instruction.
             if address < base_address + bytes_used:
-                return previous_result
+                break
 
-            if type(entry) is int:
-                entry = realise_instruction_entry(program_data, block, block.segment_offset + entry)
-            current_result = line_number, entry
+            previous_result = line_number, line_data.offsets[i]
 
             # Exactly this instruction.
             if address == base_address + bytes_used:
-                return current_result
+                break
 
-            previous_result = current_result
-            bytes_used += entry.num_bytes
-            line_number += get_instruction_line_count(program_data, entry)
+            bytes_used += line_data.lengths[i]
+            line_number += get_instruction_line_count(program_data, line_data.flags[i])
         elif type_id in (disassembly_data.SLD_COMMENT_FULL_LINE, disassembly_data.SLD_EQU_LOCATION_RELATIVE):
             line_number += 1
+    else:
+        # Not within the last instruction.
+        if address >= base_address + bytes_used:
+            return None
 
-    # Within but not at the start of the previous instruction.
-    if address < base_address + bytes_used:
-        return previous_result
-    # return None, previous_result
+    if previous_result is not None:
+        line_number, block_offset = previous_result
+        return line_number, realise_instruction_entry(program_data, block, block_offset)
 
 
 def get_code_block_info_for_line_number(program_data, line_number):
@@ -153,41 +254,43 @@ def get_code_block_info_for_line_number(program_data, line_number):
     if disassembly_data.get_block_data_type(block) != disassembly_data.DATA_TYPE_CODE:
         return
     base_address = program_data.block_addresses[block_idx]
+    line_data = block.line_data
 
     bytes_used = 0
     line_count = get_block_line_number(program_data, block_idx) + get_block_header_line_count(program_data, block)
     previous_result = None
-    for type_id, entry in block.line_data:
+    for i, type_id in enumerate(line_data.type_ids):
         if type_id == disassembly_data.SLD_INSTRUCTION:
             # Within but not at the start of the previous instruction.
             if line_number < line_count:
                 logger.debug("get_code_block_info_for_line_number.1: %d, %d = %s", line_number, line_count, None if previous_result is None else hex(previous_result[0]))
-                return previous_result
+                break
 
-            if type(entry) is int:
-                entry = realise_instruction_entry(program_data, block, entry)
-            current_result = base_address + bytes_used, entry
+            previous_result = base_address + bytes_used, line_data.offsets[i]
 
             # Exactly this instruction.
             if line_number == line_count:
-                logger.debug("get_code_block_info_for_line_number.1: %d, %d = %s (code)", line_number, line_count, hex(current_result[0]))
-                return current_result
+                logger.debug("get_code_block_info_for_line_number.1: %d, %d = %s (code)", line_number, line_count, hex(previous_result[0]))
+                break
 
-            previous_result = current_result
-            bytes_used += entry.num_bytes
-            line_count += get_instruction_line_count(program_data, entry)
+            bytes_used += line_data.lengths[i]
+            line_count += get_instruction_line_count(program_data, line_data.flags[i])
         elif type_id in (disassembly_data.SLD_COMMENT_FULL_LINE, disassembly_data.SLD_EQU_LOCATION_RELATIVE):
             if line_number == line_count:
+                entry = line_data[i][1]
                 logger.debug("get_code_block_info_for_line_number.1: %d, %d = %s (comment/location-relative)", line_number, line_count, hex(base_address + entry))
-                return base_address + entry, previous_result[1]
+                return base_address + entry, realise_instruction_entry(program_data, block, previous_result[1])
             line_count += 1
-    # Within but not at the start of the previous instruction.
-    if line_number < line_count:
+    else:
+        # Not within the last instruction.
+        if line_number >= line_count:
+            logger.debug("get_code_block_info_for_line_number.3: %d, %d", line_number, line_count)
+            return None
         logger.debug("get_code_block_info_for_line_number.2: %d, %d = %s", line_number, line_count, hex(previous_result[0]))
-        return previous_result
 
-    logger.debug("get_code_block_info_for_line_number.3: %d, %d", line_number, line_count)
-    # return None, previous_result
+    if previous_result is not None:
+        address, block_offset = previous_result
+        return address, realise_instruction_entry(program_data, block, block_offset)
 
 def get_data_type_for_address(program_data, address):
     block, block_idx = lookup_block_by_address(program_data, address)
@@ -211,16 +314,10 @@ def get_line_number_for_address(program_data, address):
             if address_block_offset >= block_offset0 and address_block_offset < block_offsetN:
                 return block_line0 + (address_block_offset - block_offset0) / num_bytes
     elif data_type == disassembly_data.DATA_TYPE_ASCII:
-        block_lineN = get_block_line_number(program_data, block_idx) + get_block_header_line_count(program_data, block)
-        block_offsetN = 0
         address_block_offset = address - block.address
-        for byte_offset, byte_length in block.line_data:
-            block_offset0 = block_offsetN
-            block_offsetN += byte_length
-            block_line0 = block_lineN
-            block_lineN += 1
-            if address_block_offset >= block_offset0 and address_block_offset < block_offsetN:
-                return block_line0
+        if 0 <= address_block_offset < block.length:
+            block_line0 = get_block_line_number(program_data, block_idx) + get_block_header_line_count(program_data, block)
+            return block_line0 + bisect.bisect_right(block.line_data, address_block_offset) - 1
     return None
 
 
@@ -248,15 +345,8 @@ def get_address_for_line_number(program_data, line_number):
                 return block.address + block_offset0 + (line_number - block_line0) * num_bytes
     elif data_type == disassembly_data.DATA_TYPE_ASCII:
         base_line_count = get_block_line_number(program_data, block_idx) + get_block_header_line_count(program_data, block)
-        block_lineN = base_line_count
-        block_offsetN = 0
-        for byte_offset, byte_length in block.line_data:
-            block_offset0 = block_offsetN
-            block_offsetN += byte_length
-            block_line0 = block_lineN
-            block_lineN += 1
-            if line_number >= block_line0 and line_number < block_lineN:
-                return block.address + block_offset0
+        if base_line_count <= line_number < base_line_count + len(block.line_data):
+            return block.address + block.line_data[line_number - base_line_count]
 
     return None
 
@@ -285,8 +375,9 @@ def get_all_references(program_data):
                     line_number, match = get_code_block_info_for_address(program_data, source_address)
 """
 
-def get_data_type_sizes(block):
-    data_type = disassembly_data.get_block_data_type(block)
+def get_data_type_sizes(block, data_type=None):
+    if data_type is None:
+        data_type = disassembly_data.get_block_data_type(block)
     if data_type == disassembly_data.DATA_TYPE_LONGWORD:
         size_types = [ ("L", 4), ("W", 2), ("B", 1) ]
     elif data_type == disassembly_data.DATA_TYPE_WORD:
@@ -308,21 +399,19 @@ def get_data_type_sizes(block):
         unconsumed_byte_count -= size_count * num_bytes
     return sizes
 
-def get_block_footer_line_count(program_data, block, block_idx):
-    """ We may be working with a temporary block copy, so the block inde
-        should only be used for the purpose of comparing neighbouring
-        blocks. """
+def get_block_footer_line_count(program_data, block, block_idx, data_type=None, line_data=None):
+    """ The data type and line data can be given, to get the line count the block would have with them. """
+    if data_type is None:
+        data_type = disassembly_data.get_block_data_type(block)
+        line_data = block.line_data
     line_count = 0
     segments = program_data.loader_segments
     if block.segment_offset + block.length == loaderlib.get_segment_length(segments, block.segment_id):
         if block.segment_id < len(segments)-1:
             line_count += 1 # SEGMENT FOOTER (blank line)
-    elif disassembly_data.get_block_data_type(block) == disassembly_data.DATA_TYPE_CODE:
-        entry_type_id, entry = block.line_data[-1]
-        if entry_type_id == disassembly_data.SLD_INSTRUCTION:
-            if type(entry) is int:
-                entry = realise_instruction_entry(program_data, block, entry)
-            if display_configuration.trailing_line_exit and program_data.dis_is_final_instruction_func(entry):
+    elif data_type == disassembly_data.DATA_TYPE_CODE:
+        if line_data.type_ids[-1] == disassembly_data.SLD_INSTRUCTION:
+            if display_configuration.trailing_line_exit and line_data.flags[-1] & disassembly_data.CLF_FINAL:
                 line_count += 1
 
         if False:
@@ -447,18 +536,20 @@ def get_file_line(program_data, line_idx, column_idx): # Zero-based
         line_type_id = None
         line_match = None
         line_num_bytes = None
-        for type_id, entry in block.line_data:
+        line_data = block.line_data
+        for i, type_id in enumerate(line_data.type_ids):
             if type_id == disassembly_data.SLD_INSTRUCTION:
-                if type(entry) is int:
-                    entry = realise_instruction_entry(program_data, block, entry)
-                block_offsetN += entry.num_bytes
+                block_offsetN += line_data.lengths[i]
             if line_count == line_idx:
                 line_type_id = type_id
-                line_match = entry
+                if type_id == disassembly_data.SLD_INSTRUCTION:
+                    line_match = realise_instruction_entry(program_data, block, line_data.offsets[i])
+                else:
+                    line_match = line_data[i][1]
                 break
             if type_id == disassembly_data.SLD_INSTRUCTION:
                 block_offset0 = block_offsetN
-                line_count += get_instruction_line_count(program_data, entry)
+                line_count += get_instruction_line_count(program_data, line_data.flags[i])
             elif type_id in (disassembly_data.SLD_COMMENT_FULL_LINE, disassembly_data.SLD_EQU_LOCATION_RELATIVE):
                 line_count += 1
         else:
@@ -562,57 +653,51 @@ def get_file_line(program_data, line_idx, column_idx): # Zero-based
                 elif DEBUG_ANNOTATE_DISASSEMBLY and column_idx == LI_ANNOTATIONS:
                     return "-"
     elif data_type == disassembly_data.DATA_TYPE_ASCII:
-        block_lineN = block_line_count0 + leading_line_count
-        block_offsetN = block.segment_offset
-        for i, (byte_offset, byte_length) in enumerate(block.line_data):
-            block_offset0 = block_offsetN
-            block_offsetN += byte_length
-            block_line0 = block_lineN
-            block_lineN += 1
-
-            if line_idx >= block_line0 and line_idx < block_lineN:
-                data_idx = block_offset0
-                if column_idx == LI_OFFSET:
-                    return "%08X" % (loaderlib.get_segment_address(segments, block.segment_id) + data_idx)
-                elif column_idx == LI_BYTES:
-                    data = loaderlib.get_segment_data(segments, block.segment_id)
-                    return "".join([ "%02X" % c for c in data[data_idx:data_idx+byte_length] ])
-                elif column_idx == LI_LABEL:
-                    label = get_symbol_for_address(program_data, loaderlib.get_segment_address(segments, block.segment_id) + data_idx)
-                    if label is None:
-                        return ""
-                    return label
-                elif column_idx == LI_INSTRUCTION:
-                    name = loaderlib.get_data_instruction_string(program_data.loader_system_name, segments, block.segment_id, True)
-                    return name +".B"
-                elif column_idx == LI_OPERANDS:
-                    string = ""
-                    last_value = None
-                    data = loaderlib.get_segment_data(segments, block.segment_id)
-                    for byte in data[data_idx:data_idx+byte_length]:
-                        if byte >= 32 and byte < 127:
-                            # Sequential displayable characters get collected into a contiguous string.
-                            value = chr(byte)
-                            if type(last_value) is not str:
-                                if last_value is not None:
-                                    string += ","
-                                string += "'"
-                            string += value
-                        else:
-                            # Non-displayable characters are appended as separate pieces of data.
-                            value = byte
+        block_line0 = block_line_count0 + leading_line_count
+        if line_idx >= block_line0 and line_idx < block_line0 + len(block.line_data):
+            byte_offset, byte_length = _get_ascii_line_range(block, line_idx - block_line0)
+            data_idx = block.segment_offset + byte_offset
+            if column_idx == LI_OFFSET:
+                return "%08X" % (loaderlib.get_segment_address(segments, block.segment_id) + data_idx)
+            elif column_idx == LI_BYTES:
+                data = loaderlib.get_segment_data(segments, block.segment_id)
+                return "".join([ "%02X" % c for c in data[data_idx:data_idx+byte_length] ])
+            elif column_idx == LI_LABEL:
+                label = get_symbol_for_address(program_data, loaderlib.get_segment_address(segments, block.segment_id) + data_idx)
+                if label is None:
+                    return ""
+                return label
+            elif column_idx == LI_INSTRUCTION:
+                name = loaderlib.get_data_instruction_string(program_data.loader_system_name, segments, block.segment_id, True)
+                return name +".B"
+            elif column_idx == LI_OPERANDS:
+                string = ""
+                last_value = None
+                data = loaderlib.get_segment_data(segments, block.segment_id)
+                for byte in data[data_idx:data_idx+byte_length]:
+                    if byte >= 32 and byte < 127:
+                        # Sequential displayable characters get collected into a contiguous string.
+                        value = chr(byte)
+                        if type(last_value) is not str:
                             if last_value is not None:
-                                if type(last_value) is str:
-                                    string += "'"
                                 string += ","
-                            string += _get_byte_representation(byte)
-                        last_value = value
-                    if last_value is not None:
-                        if type(last_value) is str:
                             string += "'"
-                    return string
-                elif DEBUG_ANNOTATE_DISASSEMBLY and column_idx == LI_ANNOTATIONS:
-                    return "-"
+                        string += value
+                    else:
+                        # Non-displayable characters are appended as separate pieces of data.
+                        value = byte
+                        if last_value is not None:
+                            if type(last_value) is str:
+                                string += "'"
+                            string += ","
+                        string += _get_byte_representation(byte)
+                    last_value = value
+                if last_value is not None:
+                    if type(last_value) is str:
+                        string += "'"
+                return string
+            elif DEBUG_ANNOTATE_DISASSEMBLY and column_idx == LI_ANNOTATIONS:
+                return "-"
 
 
 def check_known_address(program_data, address):
@@ -648,6 +733,8 @@ def insert_branch_address(program_data, address, src_abs_idx, pending_symbol_add
     # These get split as their turn to be disassembled comes up.
     referring_addresses = program_data.branch_addresses.setdefault(address, set())
     referring_addresses.add(src_abs_idx)
+    program_data.unsaved_branch_addresses.add(address)
+    program_data.stats["xrefs_inserted"] += 1
     #program_data.branch_addresses[address] = referring_addresses
     pending_symbol_addresses.add(address)
     return True
@@ -657,6 +744,8 @@ def insert_reference_address(program_data, address, src_abs_idx, pending_symbol_
         return False
     referring_addresses = program_data.reference_addresses.setdefault(address, set())
     referring_addresses.add(src_abs_idx)
+    program_data.unsaved_reference_addresses.add(address)
+    program_data.stats["xrefs_inserted"] += 1
     #program_data.reference_addresses[address] = referring_addresses
     pending_symbol_addresses.add(address)
     return True
@@ -683,6 +772,7 @@ def insert_symbol(program_data, address, name):
     if not check_known_address(program_data, address):
         return
     program_data.symbols_by_address[address] = name
+    program_data.unsaved_symbol_addresses.add(address)
     if program_data.symbol_insert_func: program_data.symbol_insert_func(address, name)
 
 def get_symbol_for_address(program_data, address, absolute_info=None):
@@ -710,6 +800,9 @@ def get_symbol_for_address(program_data, address, absolute_info=None):
 
 def set_symbol_for_address(program_data, address, symbol):
     program_data.symbols_by_address[address] = symbol
+    program_data.unsaved_symbol_addresses.add(address)
+    # Edits made while the analysis is still in progress, are not for the analysis cache.
+    program_data.analysis_cache_entry = None
 
 def _recalculate_line_count_index(program_data, dirtyidx=None):
     if dirtyidx is None:
@@ -719,6 +812,7 @@ def _recalculate_line_count_index(program_data, dirtyidx=None):
 
     if dirtyidx is not None:
         # logger.debug("Recalculated line counts, from idx %d", dirtyidx)
+        program_data.stats["line_index_recalculations"] += 1
         line_count_start = 0
         if dirtyidx > 0:
             line_count_start = program_data.block_line0s[dirtyidx-1] + get_block_line_count_cached(program_data, program_data.blocks[dirtyidx-1])
@@ -762,8 +856,10 @@ def get_next_data_line_number(program_data, line_idx, dir=1):
 
 def insert_block(program_data, insert_idx, block):
     program_data.block_addresses.insert(insert_idx, block.address)
-    program_data.block_line0s.insert(insert_idx, None)
+    program_data.block_line0s.insert(insert_idx, 0)
     program_data.blocks.insert(insert_idx, block)
+    program_data.stats["blocks_created"] += 1
+    _clear_uncertain_reference_counts(program_data, insert_idx)
     # Update how much of the sorted line number index needs to be recalculated.
     if program_data.block_line0s_dirtyidx is None or insert_idx < program_data.block_line0s_dirtyidx:
         program_data.block_line0s_dirtyidx = insert_idx
@@ -776,8 +872,10 @@ def IS_SPLIT_ERR(value): return value < 0
 
 def split_block(program_data, address, own_midinstruction=False):
     """ This function should preserve line count. """
+    program_data.stats["split_block_calls"] += 1
     block, block_idx = lookup_block_by_address(program_data, address)
     if block.address == address:
+        program_data.stats["split_block_errors"] += 1
         return block, ERR_SPLIT_EXISTING
 
     segments = program_data.loader_segments
@@ -787,6 +885,7 @@ def split_block(program_data, address, own_midinstruction=False):
         logger.error("Tried to split at out of bounds address: %06X not within %06X-%06X", address, segment_address, segment_address+segment_length-1)
         #import traceback
         #traceback.print_stack()
+        program_data.stats["split_block_errors"] += 1
         return block, ERR_SPLIT_BOUNDS
 
     block_data_type = disassembly_data.get_block_data_type(block)
@@ -799,23 +898,22 @@ def split_block(program_data, address, own_midinstruction=False):
     # Do some pre-split code block validation.
     if block_data_type == disassembly_data.DATA_TYPE_CODE:
         offsetN = 0
-        for i, (type_id, entry) in enumerate(block.line_data):
+        for i, type_id in enumerate(block.line_data.type_ids):
             # Comments are assumed to be related to succeeding instruction lines, so are grouped for purposes of splitting.
             if type_id in (disassembly_data.SLD_INSTRUCTION, disassembly_data.SLD_COMMENT_FULL_LINE):
                 if block_length_reduced == offsetN:
                     break
 
             if type_id == disassembly_data.SLD_INSTRUCTION:
-                if type(entry) is int:
-                    entry = realise_instruction_entry(program_data, block, entry)
-                offsetN += entry.num_bytes
+                offsetN += block.line_data.lengths[i]
                 if block_length_reduced < offsetN:
                     if own_midinstruction:
                         # Multiple consecutive entries of this type will be out of order.  Not worth bothering about.
-                        block.line_data.insert(i+1, (disassembly_data.SLD_EQU_LOCATION_RELATIVE, split_offset))
+                        block.line_data.insert(i+1, disassembly_data.SLD_EQU_LOCATION_RELATIVE, split_offset)
                         clear_block_line_count(program_data, block, block_idx)
                     else:
                         logger.debug("Attempting to split block mid-instruction (not handled here): %06X", address)
+                    program_data.stats["split_block_errors"] += 1
                     return block, ERR_SPLIT_MIDINSTRUCTION
 
         # Line data: divide between blocks at the given point.
@@ -823,23 +921,20 @@ def split_block(program_data, address, own_midinstruction=False):
         split_block_line_data = block.line_data[i:]
 
         # Line data: rebase block offsets within new block entries.
-        for i, (type_id, entry) in enumerate(split_block_line_data):
-            if type_id in (disassembly_data.SLD_EQU_LOCATION_RELATIVE, disassembly_data.SLD_INSTRUCTION) and type(entry) is int:
-                split_block_line_data[i] = (type_id, entry-split_offset)
-
-        # References: divide between blocks at the given address.
-        if block.references is not None:
-            for i, entry in enumerate(block.references):
-                if entry[0] >= address:
-                    break
-            new_block_references = block.references[i:]
-            block.references[i:] = []
-        else:
-            new_block_references = None
+        split_block_line_data.rebase(split_offset)
 
         if address & 1:
             logger.debug("Splitting code block at odd address: %06X", address)
 
+    # References: divide between blocks at the given address.
+    _clear_uncertain_reference_counts(program_data, block_idx)
+    if block.references is not None:
+        i = bisect.bisect_left(block.references, (address,))
+        new_block_references = block.references[i:]
+        block.references[i:] = []
+    else:
+        new_block_references = None
+
     # Truncate the preceding block the address is currently within.
     block.length = block_length_reduced
 
@@ -850,11 +945,11 @@ def split_block(program_data, address, own_midinstruction=False):
     new_block.address = block.address + block.length
     new_block.segment_offset = block.segment_offset + block.length
     new_block.length = excess_length
+    new_block.references = new_block_references
 
     if block_data_type == disassembly_data.DATA_TYPE_CODE:
         block.line_data = block_line_data
         new_block.line_data = split_block_line_data
-        new_block.references = new_block_references
     elif block_data_type == disassembly_data.DATA_TYPE_ASCII:
         _process_block_as_ascii(program_data, block)
         _process_block_as_ascii(program_data, new_block)
@@ -870,67 +965,127 @@ def _locate_uncertain_data_references(program_data, address, block=None):
     if block is None:
         block, block_idx = lookup_block_by_address(program_data, address)
     data = loaderlib.get_segment_data(program_data.loader_segments, block.segment_id)
+    if data is None:
+        return []
     data_idx_start = block.segment_offset + (address - block.address)
     data_idx_end = block.segment_offset + block.length
-    address_offset = 0
+    if data_idx_start + 4 > data_idx_end:
+        return []
+
+    # Read all the 16 bit aligned longwords in two passes, those at 32 bit aligned offsets and those between them.
+    value_count = (data_idx_end - data_idx_start - 4) / 2 + 1
+    f = program_data.loader_data_types.uint32_value_array
+    values_by_offset = (
+        (0, f(data, data_idx_start, (value_count + 1) / 2)),
+        (2, f(data, data_idx_start + 2, value_count / 2)),
+    )
+
+    # Discard the values that cannot be known addresses, before the more precise checking.
+    address_min = min(entry[0] for entry in program_data.address_ranges)
+    address_max = max(entry[1] for entry in program_data.address_ranges) + 1
     matches = []
-    f = program_data.loader_data_types.uint32_value
-    while data_idx_start + address_offset + 4 <= data_idx_end:
-        value = f(data, data_idx_start + address_offset)
-        if check_known_address(program_data, value):
-            line_idx = get_line_number_for_address(program_data, address + address_offset)
-            code_string = get_file_line(program_data, line_idx, LI_INSTRUCTION)
-            operands_text = get_file_line(program_data, line_idx, LI_OPERANDS)
-            if len(operands_text):
-                code_string += " "+ operands_text
-            matches.append((address + address_offset, value, code_string))
-        address_offset += 2
+    for address_offset, values in values_by_offset:
+        for i in [ i for i, value in enumerate(values) if address_min <= value <= address_max ]:
+            value = values[i]
+            if check_known_address(program_data, value):
+                matches.append((address + address_offset + i * 4, value))
+    matches.sort()
     return matches
 
-def get_uncertain_data_references(program_data):
-    results = []
-    for block in program_data.blocks:
-        data_type = disassembly_data.get_block_data_type(block)
-        if data_type != disassembly_data.DATA_TYPE_CODE and block.references:
-            results.extend(block.references)
-    return results
-
 def _locate_uncertain_code_references(program_data, address, block=None):
     """ Check for candidate operand values in instructions within the data block from address onwards. """
     if block is None:
         block, block_idx = lookup_block_by_address(program_data, address)
     matches = []
+    line_data = block.line_data
     addressN = block.address
-    for i, (type_id, entry) in enumerate(block.line_data):
+    for i, type_id in enumerate(line_data.type_ids):
         if type_id == disassembly_data.SLD_INSTRUCTION:
-            if type(entry) is int:
-                entry = realise_instruction_entry(program_data, block, entry)
             address0 = addressN
-            addressN += entry.num_bytes
+            addressN += line_data.lengths[i]
             if addressN >= address:
+                entry = realise_instruction_entry(program_data, block, line_data.offsets[i])
                 # Is this statement suitable?  Need an 
                 for value, flags in program_data.dis_get_match_addresses_func(entry).iteritems():
                     if flags & 2: # MAF_ABSOLUTE
-                        line_idx = get_line_number_for_address(program_data, address0)
-                        code_string = get_file_line(program_data, line_idx, LI_INSTRUCTION)
-                        operands_text = get_file_line(program_data, line_idx, LI_OPERANDS)
-                        if len(operands_text):
-                            code_string += " "+ operands_text
-                        matches.append((address0, value, code_string))
+                        matches.append((address0, value))
     return matches
 
-def get_uncertain_code_references(program_data):
+def _get_block_uncertain_references(program_data, block):
+    """ The uncertain references for a block are located the first time they are needed. """
+    if block.references is None:
+        if disassembly_data.get_block_data_type(block) == disassembly_data.DATA_TYPE_CODE:
+            block.references = _locate_uncertain_code_references(program_data, block.address, block)
+        else:
+            block.references = _locate_uncertain_data_references(program_data, block.address, block)
+    return block.references
+
+def _clear_uncertain_reference_counts(program_data, block_idx):
+    """ The blocks from the given one on have changed, and need their references counted again. """
+    for counts in program_data.uncertain_reference_counts.itervalues():
+        del counts[block_idx:]
+
+def _get_uncertain_reference_counts(program_data, is_code, reference_count=None):
+    """
+    The blocks are in address order, so the references of the matching blocks taken in turn are the
+    address ordered index.  The cumulative counts are extended a block at a time, locating its references,
+    until they cover the given number of references, or all the blocks if that is not given.
+    """
+    counts = program_data.uncertain_reference_counts[is_code]
+    blocks = program_data.blocks
+    total = counts[-1] if len(counts) else 0
+    while len(counts) < len(blocks) and (reference_count is None or total < reference_count):
+        block = blocks[len(counts)]
+        if (disassembly_data.get_block_data_type(block) == disassembly_data.DATA_TYPE_CODE) == is_code:
+            total += len(_get_block_uncertain_references(program_data, block))
+        counts.append(total)
+    return counts
+
+def _get_uncertain_references(program_data, is_code, offset, limit):
+    """ Only the blocks up to the end of the requested page get their references located. """
     results = []
-    for block in program_data.blocks:
-        data_type = disassembly_data.get_block_data_type(block)
-        if data_type == disassembly_data.DATA_TYPE_CODE and block.references:
-            results.extend(block.references)
+    if program_data.flags & disassembly_data.PDF_BINARY_FILE != disassembly_data.PDF_BINARY_FILE:
+        return results
+    counts = _get_uncertain_reference_counts(program_data, is_code, None if limit is None else offset + limit)
+    # The first block with references past the offset, which can only be a block of the matching kind.
+    block_idx = bisect.bisect_right(counts, offset)
+    skip_count = offset - (counts[block_idx-1] if block_idx > 0 else 0)
+    for block_idx in xrange(block_idx, len(counts)):
+        if limit is not None and len(results) >= limit:
+            break
+        block = program_data.blocks[block_idx]
+        if (disassembly_data.get_block_data_type(block) == disassembly_data.DATA_TYPE_CODE) == is_code:
+            results.extend(block.references[skip_count:])
+            skip_count = 0
+    if limit is not None:
+        del results[limit:]
     return results
 
+def _get_uncertain_reference_count(program_data, is_code):
+    """ The first count locates the references of every block, later counts only those of blocks changed since. """
+    if program_data.flags & disassembly_data.PDF_BINARY_FILE != disassembly_data.PDF_BINARY_FILE:
+        return 0
+    counts = _get_uncertain_reference_counts(program_data, is_code)
+    return counts[-1] if len(counts) else 0
+
+def get_uncertain_code_references(program_data, offset=0, limit=None):
+    return _get_uncertain_references(program_data, True, offset, limit)
+
+def get_uncertain_code_reference_count(program_data):
+    return _get_uncertain_reference_count(program_data, True)
+
+def get_uncertain_data_references(program_data, offset=0, limit=None):
+    return _get_uncertain_references(program_data, False, offset, limit)
+
+def get_uncertain_data_reference_count(program_data):
+    return _get_uncertain_reference_count(program_data, False)
+
 def get_uncertain_references_by_address(program_data, address):
     # That the block is a data block is known.
     block, block_idx = lookup_block_by_address(program_data, address)
-    return block.references
+    if program_data.flags & disassembly_data.PDF_BINARY_FILE != disassembly_data.PDF_BINARY_FILE:
+        return []
+    return _get_block_uncertain_references(program_data, block)
 
 def set_uncertain_reference_modification_func(program_data, f):
     program_data.uncertain_reference_modification_func = f
@@ -938,6 +1093,7 @@ def set_uncertain_reference_modification_func(program_data, f):
 def set_data_type_at_address(program_data, address, data_type, work_state=None):
     block, block_idx = lookup_block_by_address(program_data, address)
     set_block_data_type(program_data, data_type, block, block_idx=block_idx, work_state=work_state)
+    program_data.analysis_cache_entry = None
 
 def set_block_data_type(program_data, data_type, block, block_idx=None, work_state=None):
     address = block.address
@@ -951,6 +1107,7 @@ def set_block_data_type(program_data, data_type, block, block_idx=None, work_sta
     original_block_address = block.address
     original_block_length = block.length
     original_block_idx = block_idx
+    _clear_uncertain_reference_counts(program_data, block_idx)
 
     result = split_block(program_data, address)
     # If the address was within the address range of another block, split off a block at the given address and use that.
@@ -982,19 +1139,15 @@ def set_block_data_type(program_data, data_type, block, block_idx=None, work_sta
         line0 = get_block_line_number(program_data, block_idx)
         old_line_count = get_block_line_count_cached(program_data, block)
 
-        # 2. Apply the change to a temporary block.
-        temp_block = disassembly_data.SegmentBlock()
-        block.copy_to(temp_block)
-        disassembly_data.set_block_data_type(temp_block, data_type)
+        # 2. Calculate the line count the block will have after the change.
         if data_type == disassembly_data.DATA_TYPE_ASCII:
-            _process_block_as_ascii(program_data, temp_block)
+            new_line_data = _get_block_ascii_line_data(program_data, block)
         else:
-            temp_block.line_data = None
-        temp_block.flags &= ~disassembly_data.BLOCK_FLAG_PROCESSED
-        temp_block.line_count = get_block_line_count(program_data, temp_block)
+            new_line_data = None
+        new_line_count = get_block_line_count(program_data, block, data_type, new_line_data)
 
         # 3. Notify listeners the change is about to happen (with metadata).
-        line_count_delta = temp_block.line_count - old_line_count
+        line_count_delta = new_line_count - old_line_count
         if line_count_delta != 0:
             if program_data.pre_line_change_func:
                 if line_count_delta > 0:
@@ -1003,7 +1156,10 @@ def set_block_data_type(program_data, data_type, block, block_idx=None, work_sta
                     program_data.pre_line_change_func(line0 + old_line_count + line_count_delta, line_count_delta)
 
         # 4. Make the change.
-        temp_block.copy_to(block)
+        disassembly_data.set_block_data_type(block, data_type)
+        block.line_data = new_line_data
+        block.flags &= ~disassembly_data.BLOCK_FLAG_PROCESSED
+        block.line_count = new_line_count
         if line_count_delta != 0:
             # We changed the line count, we need to flag a block line numbering recalculation.
             if program_data.block_line0s_dirtyidx is None or program_data.block_line0s_dirtyidx > block_idx+1:
@@ -1018,7 +1174,10 @@ def set_block_data_type(program_data, data_type, block, block_idx=None, work_sta
 
     for affected_block in affected_blocks:
         old_references = affected_block.references
-        data_type_old = affected_block._old_data_type
+        # Blocks which have not had their references located yet, will get them when they are needed.
+        if old_references is None:
+            continue
+        data_type_old = block_data_type
         data_type_new = disassembly_data.get_block_data_type(affected_block)
         if data_type_new == disassembly_data.DATA_TYPE_CODE:
             new_references = _locate_uncertain_code_references(program_data, affected_block.address, affected_block)
@@ -1033,57 +1192,235 @@ def set_block_data_type(program_data, data_type, block, block_idx=None, work_sta
 
 
 def _process_block_as_ascii(program_data, block):
+    block.line_data = _get_block_ascii_line_data(program_data, block)
+
+def _get_block_ascii_line_data(program_data, block):
     """
-    Ensure that the block line data contans metadata suitable for rendering the lines,
-    and counting how many there are for the given data.
+    Calculate the block line data suitable for rendering the lines as ASCII data,
+    and counting how many there are for the given data.  The line data is the block offset
+    each line starts at, with the line extending to the start of the next or the block end.
+
+    Displayable characters are collected into quoted strings, and other bytes are separate
+    pieces of data.  A line ends with a null byte, or with the byte that makes it too long.
     """
     data = loaderlib.get_segment_data(program_data.loader_segments, block.segment_id)
     data_offset_start = block.segment_offset
-    bytes_consumed = 0
-    bytes_consumed0 = bytes_consumed
-    block_line_data = []
+    block_line_data = array.array("i")
+    line_offset0 = 0
     line_width = 0
     line_width_max = 40
-    last_value = None
-    while bytes_consumed < block.length:
-        byte = data[data_offset_start+bytes_consumed]
-        comma_separated = False
-        char_line_width = 0
-        if byte >= 32 and byte < 127:
-            # Sequential displayable characters get collected into a contiguous string.
-            value = chr(byte)
-            if type(last_value) is not str:
-                comma_separated = True
-                char_line_width += 2 # start and end quoting characters for this character and all appended to it.
-            char_line_width += 1 # char
+    last_kind = None
+    for match in RE_ASCII_RUN.finditer(data, data_offset_start, data_offset_start + block.length):
+        offset = match.start() - data_offset_start
+        offsetN = match.end() - data_offset_start
+        if match.lastindex == 1:
+            while offset < offsetN:
+                if last_kind is ASCII_KIND_STRING:
+                    # Append what fits on the current line to the existing quoted string.
+                    fit_length = line_width_max - line_width
+                    if offsetN - offset <= fit_length:
+                        line_width += offsetN - offset
+                        break
+                    offset += fit_length
+                    char_line_width = 1
+                else:
+                    # A new quoted string with its quoting characters and separating comma.
+                    char_line_width = 4
+                    if line_width + char_line_width <= line_width_max:
+                        line_width += char_line_width
+                        last_kind = ASCII_KIND_STRING
+                        offset += 1
+                        continue
+                # The character does not fit, and ends the current line.
+                offset += 1
+                block_line_data.append(line_offset0)
+                line_offset0 = offset
+                line_width = char_line_width
+                last_kind = None
         else:
-            # Non-displayable characters are appended as separate pieces of data.
-            value = byte
-            comma_separated = last_value is not None
-            byte_string = _get_byte_representation(byte)
-            char_line_width += len(byte_string)
-        if comma_separated:
-            char_line_width += 1
-        bytes_consumed += 1
-
-        # Append to current line or start a new one?
-        force_new_line = False
-        # Trailing null bytes indicate the end of each string in the block.
-        if last_value != 0 and value == 0:
-            force_new_line = True
-        if line_width + char_line_width > line_width_max or force_new_line:
-            # Would make the current line too long, store the current one and make a new one.
-            block_line_data.append((bytes_consumed0, bytes_consumed-bytes_consumed0))
-            bytes_consumed0 = bytes_consumed
-            line_width = char_line_width
-            last_value = None
+            for byte in data[match.start():match.end()]:
+                char_line_width = BYTE_REPRESENTATION_WIDTHS[byte]
+                if last_kind is not None:
+                    char_line_width += 1
+                offset += 1
+                # Null bytes indicate the end of each string in the block.
+                if byte == 0 or line_width + char_line_width > line_width_max:
+                    block_line_data.append(line_offset0)
+                    line_offset0 = offset
+                    line_width = char_line_width
+                    last_kind = None
+                else:
+                    line_width += char_line_width
+                    last_kind = ASCII_KIND_BYTE
+    if line_offset0 != block.length:
+        block_line_data.append(line_offset0)
+    return block_line_data
+
+def find_ascii_strings(program_data, segment_id=None, min_length=6):
+    """
+    Locate null terminated strings of displayable characters within the non-code blocks, that
+    are not already typed as ASCII.  Those which overlap relocated longwords are not strings.
+    Returns a list of (address, length) for each string including its terminating null bytes.
+    """
+    regex = re.compile("[\x20-\x7E\t\n\r]{%d,}\x00+" % min_length)
+    segments = program_data.loader_segments
+    results = []
+    for block in program_data.blocks:
+        if segment_id is not None and block.segment_id != segment_id:
+            continue
+        if disassembly_data.get_block_data_type(block) in (disassembly_data.DATA_TYPE_CODE, disassembly_data.DATA_TYPE_ASCII):
+            continue
+        data = loaderlib.get_segment_data(segments, block.segment_id)
+        if data is None:
+            continue
+        block_data = data[block.segment_offset:block.segment_offset + block.length]
+        for match in regex.finditer(block_data):
+            address = block.address + match.start()
+            length = match.end() - match.start()
+            for relocatable_address in xrange(address - 3, address + length):
+                if relocatable_address in program_data.loader_relocatable_addresses:
+                    break
+            else:
+                results.append((address, length))
+    return results
+
+def set_data_type_ascii_for_strings(program_data, strings, work_state=None):
+    """ Apply the ASCII data type to each (address, length) located by find_ascii_strings. """
+    for i, (address, length) in enumerate(strings):
+        if work_state is not None and work_state.check_exit_update(i / float(len(strings)), "TEXT_GENERIC_PROCESSING"):
+            return
+        block, block_idx = lookup_block_by_address(program_data, address)
+        if disassembly_data.get_block_data_type(block) in (disassembly_data.DATA_TYPE_CODE, disassembly_data.DATA_TYPE_ASCII):
+            continue
+        if address + length < block.address + block.length:
+            split_block(program_data, address + length)
+        set_data_type_at_address(program_data, address, disassembly_data.DATA_TYPE_ASCII)
+
+CODE_CANDIDATE_MODEL_SIZE = 5000
+
+def _get_instruction_key_frequencies(program_data):
+    """ How common each instruction is within the known code, relative to the most common one. """
+    counts = {}
+    instruction_count = 0
+    for block in program_data.blocks:
+        if disassembly_data.get_block_data_type(block) != disassembly_data.DATA_TYPE_CODE:
+            continue
+        line_data = block.line_data
+        for i, type_id in enumerate(line_data.type_ids):
+            if type_id == disassembly_data.SLD_INSTRUCTION:
+                match = realise_instruction_entry(program_data, block, line_data.offsets[i])
+                if match is None:
+                    continue
+                counts[match.specification.key] = counts.get(match.specification.key, 0) + 1
+                instruction_count += 1
+        if instruction_count >= CODE_CANDIDATE_MODEL_SIZE:
+            break
+    if not len(counts):
+        return counts
+    highest_count = float(max(counts.itervalues()))
+    return dict((key, count / highest_count) for (key, count) in counts.iteritems())
+
+def _scan_block_for_code_candidates(program_data, segment_id, segment_offset, address, length, key_frequencies, min_instructions):
+    """
+    Returns (address, length, score) for each run of instructions within the block.  A run scores
+    for its length, for how it ends, for branches within it landing on its instructions, and for
+    how common its instructions are in the known code.
+    """
+    data = loaderlib.get_segment_data(program_data.loader_segments, segment_id)
+    candidates = []
+    # Instructions are word aligned.
+    block_offset = address & 1
+    while block_offset < length:
+        run_offset = block_offset
+        instruction_offsets = set()
+        branch_addresses = []
+        key_score = 0.0
+        while block_offset < length:
+            match, data_offset_end = program_data.dis_disassemble_one_line_func(data, segment_offset + block_offset, address + block_offset)
+            if match is None or data_offset_end - segment_offset > length:
+                ending_score = 0.0
+                break
+            instruction_offsets.add(block_offset)
+            key_score += key_frequencies.get(match.specification.key, 0.0)
+            for match_address, flags in program_data.dis_get_match_addresses_func(match).iteritems():
+                if flags & 1: # MAF_CODE
+                    branch_addresses.append(match_address)
+            block_offset = data_offset_end - segment_offset
+            if program_data.dis_is_final_instruction_func(match):
+                ending_score = 1.0
+                break
         else:
-            # Still room in this line, add it on.
-            line_width += char_line_width
-            last_value = value
-    if bytes_consumed != bytes_consumed0:
-        block_line_data.append((bytes_consumed0, bytes_consumed-bytes_consumed0))
-    block.line_data = block_line_data
+            # The run continues into whatever follows the block.
+            ending_score = 0.5
+
+        instruction_count = len(instruction_offsets)
+        if instruction_count == 0:
+            block_offset += 2
+            continue
+        if instruction_count < min_instructions:
+            continue
+
+        internal_offsets = [ branch_address - address for branch_address in branch_addresses if address + run_offset <= branch_address < address + block_offset ]
+        branch_score = 0.0
+        if len(internal_offsets):
+            hit_count = sum(1 for offset in internal_offsets if offset in instruction_offsets)
+            branch_score = (2 * hit_count - len(internal_offsets)) / float(len(internal_offsets))
+        score = min(instruction_count, 32) / 32.0 + ending_score + branch_score + key_score / instruction_count
+        candidates.append((address + run_offset, block_offset - run_offset, score))
+    return candidates
+
+def _scan_code_candidates_shard(shard):
+    return _scan_block_for_code_candidates(_shard_program_data, *shard)
+
+def find_code_candidates(program_data, process_count=1, min_instructions=4, min_score=1.0):
+    """
+    Scan the unprocessed data blocks for runs of plausible code, optionally spread over a pool of
+    worker processes.  Returns a list of (address, length, score), best scoring first.
+    """
+    key_frequencies = _get_instruction_key_frequencies(program_data)
+    shards = []
+    for block in program_data.blocks:
+        if disassembly_data.get_block_data_type(block) in (disassembly_data.DATA_TYPE_CODE, disassembly_data.DATA_TYPE_ASCII):
+            continue
+        if block.flags & (disassembly_data.BLOCK_FLAG_ALLOC | disassembly_data.BLOCK_FLAG_PROCESSED):
+            continue
+        if loaderlib.get_segment_data(program_data.loader_segments, block.segment_id) is None:
+            continue
+        shards.append((block.segment_id, block.segment_offset, block.address, block.length, key_frequencies, min_instructions))
+
+    candidates = []
+    if process_count > 1 and len(shards) > 1:
+        pool = multiprocessing.Pool(min(process_count, len(shards)), _init_code_shard_worker, (program_data.dis_name, program_data.loader_segments))
+        try:
+            for shard_candidates in pool.map(_scan_code_candidates_shard, shards):
+                candidates.extend(candidate for candidate in shard_candidates if candidate[2] >= min_score)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for shard in shards:
+            candidates.extend(candidate for candidate in _scan_block_for_code_candidates(program_data, *shard) if candidate[2] >= min_score)
+    candidates.sort(key=lambda candidate: (-candidate[2], candidate[0]))
+    return candidates
+
+def set_data_type_code_for_candidates(program_data, candidates, work_state=None):
+    """ Process each (address, length, score) located by find_code_candidates as code, in the given order. """
+    for i, candidate in enumerate(candidates):
+        if work_state is not None and work_state.check_exit_update(i / float(len(candidates)), "TEXT_GENERIC_PROCESSING"):
+            return
+        address = candidate[0]
+        block, block_idx = lookup_block_by_address(program_data, address)
+        # Processing of an earlier candidate may have reached this one.
+        if disassembly_data.get_block_data_type(block) == disassembly_data.DATA_TYPE_CODE:
+            continue
+        set_data_type_at_address(program_data, address, disassembly_data.DATA_TYPE_CODE)
+
+def _get_ascii_line_range(block, line_idx):
+    """ Return the block offset and length of the given line of an ASCII block. """
+    byte_offset = block.line_data[line_idx]
+    if line_idx + 1 < len(block.line_data):
+        return byte_offset, block.line_data[line_idx+1] - byte_offset
+    return byte_offset, block.length - byte_offset
 
 def _get_byte_representation(byte):
     if byte < 16:
@@ -1091,175 +1428,321 @@ def _get_byte_representation(byte):
     else:
         return "$%X" % byte
 
-def _process_address_as_code(program_data, address, pending_symbol_addresses, work_state=None):
-    debug_offsets = set()
-    disassembly_offsets = set([ address ])
+RE_ASCII_RUN = re.compile("([\x20-\x7E]+)|([^\x20-\x7E]+)")
+ASCII_KIND_STRING = 1
+ASCII_KIND_BYTE = 2
+BYTE_REPRESENTATION_WIDTHS = [ len(_get_byte_representation(byte)) for byte in range(256) ]
+
+def _decode_code_line(program_data, data, data_offset, address):
+    """ Returns the length, layout flags and referenced addresses of the instruction, or None if there is not one. """
+    program_data.stats["instructions_decoded"] += 1
+    match, data_offset_end = program_data.dis_disassemble_one_line_func(data, data_offset, address)
+    if match is None:
+        return None
+    cache_instruction_entry(program_data, match)
+    return match.num_bytes, get_instruction_flags(program_data, match), program_data.dis_get_match_addresses_func(match)
+
+_shard_program_data = None
+
+def _init_code_shard_worker(dis_name, segments, exploration_data=None):
+    global _shard_program_data
+    program_data = _shard_program_data = disassembly_data.ProgramData()
+    program_data.dis_name = dis_name
+    program_data.loader_segments = segments
+    if exploration_data is not None:
+        program_data.loader_system_name, program_data.loader_relocated_addresses, program_data.loader_relocatable_addresses, program_data.symbols_by_address, program_data.address_ranges = exploration_data
+    onload_set_disassemblylib_functions(program_data)
+
+def _explore_code_shard(shard):
+    """ Follow the code from the given addresses, within the blocks of the one segment. """
+    segment_id, blocks, disassembly_offsets, post_segment_addresses = shard
+    program_data = _shard_program_data
+    program_data.blocks = blocks
+    program_data.block_addresses = array.array("l", [ block.address for block in blocks ])
+    program_data.block_line0s = array.array("l", [ 0 ]) * len(blocks)
+    program_data.block_line0s_dirtyidx = 0
+    program_data.post_segment_addresses = post_segment_addresses
+    program_data.branch_addresses = {}
+    program_data.reference_addresses = {}
+    program_data.stats.clear()
+    program_data.uncertain_reference_counts = { True: array.array("l"), False: array.array("l") }
+
+    analysis = disassembly_data.CodeAnalysisState()
+    analysis.disassembly_offsets = disassembly_offsets
+    # Code in other segments is left for their shards to follow.
+    other_offsets = set()
+    while len(disassembly_offsets):
+        address = disassembly_offsets.pop()
+        if _get_segment_id_for_address(program_data.loader_segments, address) in (segment_id, None):
+            _process_code_analysis_address(program_data, analysis, address, None)
+        else:
+            other_offsets.add(address)
+    return blocks, program_data.branch_addresses, program_data.reference_addresses, program_data.post_segment_addresses, analysis.pending_symbol_addresses, analysis.debug_offsets, other_offsets, program_data.stats
+
+def _get_segment_id_for_address(segments, address):
+    for segment_id in range(len(segments)):
+        address0 = loaderlib.get_segment_address(segments, segment_id)
+        if address0 <= address < address0 + loaderlib.get_segment_length(segments, segment_id):
+            return segment_id
+
+def _get_segment_block_range(program_data, segment_id):
+    segments = program_data.loader_segments
+    address0 = loaderlib.get_segment_address(segments, segment_id)
+    addressN = address0 + loaderlib.get_segment_length(segments, segment_id)
+    return bisect.bisect_left(program_data.block_addresses, address0), bisect.bisect_left(program_data.block_addresses, addressN)
+
+def _queue_code_shard_address(program_data, offsets_by_segment_id, address):
+    # Addresses outside the segments go to the shard with the block the serial analysis would look up.
+    block, block_idx = lookup_block_by_address(program_data, address)
+    offsets_by_segment_id.setdefault(block.segment_id, set()).add(address)
+
+def _merge_code_shard(program_data, analysis, segment_id, result):
+    blocks, branch_addresses, reference_addresses, post_segment_addresses, pending_symbol_addresses, debug_offsets, other_offsets, stats = result
+    block_idx0, block_idxN = _get_segment_block_range(program_data, segment_id)
+    program_data.blocks[block_idx0:block_idxN] = blocks
+    program_data.block_addresses[block_idx0:block_idxN] = array.array("l", [ block.address for block in blocks ])
+    program_data.block_line0s[block_idx0:block_idxN] = array.array("l", [ 0 ]) * len(blocks)
+    _clear_uncertain_reference_counts(program_data, block_idx0)
+    # The line counts were cached without the cross segment addresses found by the other shards.
+    for block in blocks:
+        block.line_count = 0
+    if program_data.block_line0s_dirtyidx is None or block_idx0 < program_data.block_line0s_dirtyidx:
+        program_data.block_line0s_dirtyidx = block_idx0
+
+    for xref_addresses, shard_xref_addresses in ((program_data.branch_addresses, branch_addresses), (program_data.reference_addresses, reference_addresses)):
+        for address, referring_addresses in shard_xref_addresses.iteritems():
+            xref_addresses.setdefault(address, set()).update(referring_addresses)
+    program_data.unsaved_branch_addresses.update(branch_addresses)
+    program_data.unsaved_reference_addresses.update(reference_addresses)
+    for pre_segment_id, addresses in post_segment_addresses.iteritems():
+        program_data.post_segment_addresses[pre_segment_id] = sorted(set(program_data.post_segment_addresses.get(pre_segment_id, [])) | set(addresses))
+    analysis.pending_symbol_addresses |= pending_symbol_addresses
+    analysis.debug_offsets |= debug_offsets
+    program_data.stats.update(stats)
+    return other_offsets
+
+def _explore_code_in_parallel(program_data, analysis, process_count, work_state=None):
+    """
+    Follow the code from the addresses queued in the analysis, in rounds.  Each segment with addresses
+    to follow is explored by a worker, and the code it reaches in other segments is followed in the
+    next round.  The shards are merged in segment order, so the result does not depend on which worker
+    finishes first.  Returns False if cancelled, with what is left to follow queued in the analysis.
+    """
+    segments = program_data.loader_segments
+    offsets_by_segment_id = {}
+    for address in analysis.disassembly_offsets:
+        _queue_code_shard_address(program_data, offsets_by_segment_id, address)
+    analysis.disassembly_offsets.clear()
+
+    exploration_data = program_data.loader_system_name, program_data.loader_relocated_addresses, program_data.loader_relocatable_addresses, program_data.symbols_by_address, program_data.address_ranges
+    pool = multiprocessing.Pool(min(process_count, len(segments)), _init_code_shard_worker, (program_data.dis_name, segments, exploration_data))
+    try:
+        while len(offsets_by_segment_id):
+            if work_state is not None:
+                extra_fraction = sum(block.length for block in program_data.blocks if disassembly_data.get_block_data_type(block) == disassembly_data.DATA_TYPE_CODE) / float(program_data.file_size) * 0.6
+                if work_state.check_exit_update(0.2 + extra_fraction, "TEXT_LOAD_DISASSEMBLY_PASS"):
+                    for disassembly_offsets in offsets_by_segment_id.itervalues():
+                        analysis.disassembly_offsets.update(disassembly_offsets)
+                    return False
+            shards = []
+            for segment_id in sorted(offsets_by_segment_id):
+                block_idx0, block_idxN = _get_segment_block_range(program_data, segment_id)
+                shards.append((segment_id, program_data.blocks[block_idx0:block_idxN], offsets_by_segment_id[segment_id], program_data.post_segment_addresses))
+            results = pool.map(_explore_code_shard, shards)
+            offsets_by_segment_id = {}
+            for shard, result in zip(shards, results):
+                for address in _merge_code_shard(program_data, analysis, shard[0], result):
+                    _queue_code_shard_address(program_data, offsets_by_segment_id, address)
+    finally:
+        pool.terminate()
+        pool.join()
+    return True
+
+def _step_code_analysis(program_data, analysis, budget_ms=None, work_state=None):
+    """
+    Follow the code from the addresses queued in the analysis, until the budget (in milliseconds)
+    is spent.  The program data is left consistent, so the analysis can be resumed later.  Returns
+    True when the analysis is complete.
+    """
+    disassembly_offsets = analysis.disassembly_offsets
+    if budget_ms is not None:
+        end_time = time.time() + budget_ms / 1000.0
     while len(disassembly_offsets):
         if work_state is not None:
             extra_fraction = sum(block.length for block in program_data.blocks if disassembly_data.get_block_data_type(block) == disassembly_data.DATA_TYPE_CODE) / float(program_data.file_size) * 0.6
             if work_state.check_exit_update(0.2 + extra_fraction, "TEXT_LOAD_DISASSEMBLY_PASS"):
-                return
-
-        address = disassembly_offsets.pop()
-        block, block_idx = lookup_block_by_address(program_data, address)
-        block_data_type = disassembly_data.get_block_data_type(block)
-        # When the address is mid-block, split the associated portion of the block off.
-        if address - block.address > 0:
-            result = split_block(program_data, address)
-            if IS_SPLIT_ERR(result[1]):
-                logger.debug("_process_address_as_code/focus: At $%06X unexpected splitting error #%d", address, result[1])
-                continue
-            block, block_idx = result
-            # address = block.address Superfluous due to it being the split address.
-
-        if block_data_type == disassembly_data.DATA_TYPE_CODE or (block.flags & disassembly_data.BLOCK_FLAG_PROCESSED) == disassembly_data.BLOCK_FLAG_PROCESSED:
-            # logger.debug("_process_address_as_code[%X]: skipping because it is code (%s) or already processed (%s), data type (%d)", block.address, block_data_type == disassembly_data.DATA_TYPE_CODE, (block.flags & disassembly_data.BLOCK_FLAG_PROCESSED) == disassembly_data.BLOCK_FLAG_PROCESSED, disassembly_data.get_block_data_type(block))
-            continue
+                return False
+        _process_code_analysis_address(program_data, analysis, disassembly_offsets.pop(), work_state)
+        if budget_ms is not None and time.time() >= end_time:
+            return False
 
-        # Disassemble as much of the block's data as possible.
-        bytes_consumed = 0
-        data_bytes_to_skip = 0
-        line_data = []
-        found_terminating_instruction = False
-        # logger.debug("disassembling block: address=$%X length=%d", address, block.length)
-        while bytes_consumed < block.length:
-            data = loaderlib.get_segment_data(program_data.loader_segments, block.segment_id)
-            data_offset_start = block.segment_offset + bytes_consumed
-            match_address = address + bytes_consumed
-            match, data_offset_end = program_data.dis_disassemble_one_line_func(data, data_offset_start, match_address)
-            if match is None:
-                data_bytes_to_skip = program_data.dis_disassemble_as_data_func(data, data_offset_start)
-                if data_bytes_to_skip == 0:
-                    logger.error("unable to disassemble data at %X (started at %X)", match_address, address)
-                break
-            bytes_matched = data_offset_end - data_offset_start
-            if bytes_consumed + bytes_matched > block.length:
-                logger.error("unable to disassemble due to a block length overrun at %X (started at %X)", match_address, address)
-                break
-            line_data.append((disassembly_data.SLD_INSTRUCTION, match))
-            for label_offset in range(1, bytes_matched):
-                label_address = match_address + label_offset
-                label = program_data.symbols_by_address.get(label_address)
-                if label is not None:
-                    line_data.append((disassembly_data.SLD_EQU_LOCATION_RELATIVE, label_address - address))
-                    #logger.debug("%06X: mid-instruction label = '%s' %d", match_address, label, label_address-match_address)
-            bytes_consumed += bytes_matched
-            found_terminating_instruction = program_data.dis_is_final_instruction_func(match)
-            if found_terminating_instruction:
-                break
+    _complete_code_analysis(program_data, analysis)
+    return True
 
-        # Discard any unprocessed block / jump over isolatible unprocessed instructions.
-        if bytes_consumed < block.length:
-            new_code_address = None
-            if bytes_consumed == 0:
-                # If we encountered an unknown instruction at the start of a block.
-                if data_bytes_to_skip:
-                    # We'll split at this address, leaving the current block as a processed longword block.
-                    new_code_address = address + data_bytes_to_skip
-                else:
-                    logger.error("Skipping block at %X with no code (length: %X)", data_offset_start, block.length)
-            else:
-                # Handle the case where we have one instruction and it's a final one.
-                if match_address == block.address:
-                    match_address += bytes_consumed
-                result = split_block(program_data, match_address)
-                if IS_SPLIT_ERR(result[1]):
-                    logger.error("_process_address_as_code/unrecognised-code: At $%06X unexpected splitting error %d, block address %X, bytes consumed %d, found terminating instruction %s", match_address, result[1], block.address, bytes_consumed, found_terminating_instruction)
-                    block.flags |= disassembly_data.BLOCK_FLAG_PROCESSED
-                    continue
+def _process_code_analysis_address(program_data, analysis, address, work_state):
+    disassembly_offsets = analysis.disassembly_offsets
+    pending_symbol_addresses, debug_offsets = analysis.pending_symbol_addresses, analysis.debug_offsets
+    block, block_idx = lookup_block_by_address(program_data, address)
+    block_data_type = disassembly_data.get_block_data_type(block)
+    # When the address is mid-block, split the associated portion of the block off.
+    if address - block.address > 0:
+        result = split_block(program_data, address)
+        if IS_SPLIT_ERR(result[1]):
+            logger.debug("_process_address_as_code/focus: At $%06X unexpected splitting error #%d", address, result[1])
+            return
+        block, block_idx = result
+        # address = block.address Superfluous due to it being the split address.
 
-                trailing_block, trailing_block_idx = result
-                set_block_data_type(program_data, disassembly_data.DATA_TYPE_LONGWORD, trailing_block, block_idx=trailing_block_idx, work_state=work_state)
+    if block_data_type == disassembly_data.DATA_TYPE_CODE or (block.flags & disassembly_data.BLOCK_FLAG_PROCESSED) == disassembly_data.BLOCK_FLAG_PROCESSED:
+        # logger.debug("_process_address_as_code[%X]: skipping because it is code (%s) or already processed (%s), data type (%d)", block.address, block_data_type == disassembly_data.DATA_TYPE_CODE, (block.flags & disassembly_data.BLOCK_FLAG_PROCESSED) == disassembly_data.BLOCK_FLAG_PROCESSED, disassembly_data.get_block_data_type(block))
+        return
 
-                # If an unknown instruction was encountered.
-                if not found_terminating_instruction:
-                    # We are marking the code past any bytes to skip as processed here, so we need to mark that as unprocessed again when we split it off brlow.
-                    trailing_block.flags |= disassembly_data.BLOCK_FLAG_PROCESSED
-                    # If code resumes after analysis determines we can skip the unknown instruction as data.
-                    if data_bytes_to_skip:
-                        new_code_address = match_address + data_bytes_to_skip
-                else:
-                    trailing_block.flags &= ~disassembly_data.BLOCK_FLAG_PROCESSED
+    # Disassemble as much of the block's data as possible.
+    bytes_consumed = 0
+    data_bytes_to_skip = 0
+    line_data = disassembly_data.CodeLineData()
+    decoded_matches = []
+    found_terminating_instruction = False
+    # logger.debug("disassembling block: address=$%X length=%d", address, block.length)
+    while bytes_consumed < block.length:
+        data = loaderlib.get_segment_data(program_data.loader_segments, block.segment_id)
+        data_offset_start = block.segment_offset + bytes_consumed
+        match_address = address + bytes_consumed
+        decoded_line = _decode_code_line(program_data, data, data_offset_start, match_address)
+        if decoded_line is None:
+            data_bytes_to_skip = program_data.dis_disassemble_as_data_func(data, data_offset_start)
+            if data_bytes_to_skip == 0:
+                logger.error("unable to disassemble data at %X (started at %X)", match_address, address)
+            break
+        bytes_matched, instruction_flags, match_addresses = decoded_line
+        if bytes_consumed + bytes_matched > block.length:
+            logger.error("unable to disassemble due to a block length overrun at %X (started at %X)", match_address, address)
+            break
+        # Only the block offsets of the instructions are kept, they get decoded again as needed.
+        line_data.append(disassembly_data.SLD_INSTRUCTION, bytes_consumed, bytes_matched, instruction_flags)
+        decoded_matches.append((match_address, bytes_matched, match_addresses))
+        for label_offset in range(1, bytes_matched):
+            label_address = match_address + label_offset
+            label = program_data.symbols_by_address.get(label_address)
+            if label is not None:
+                line_data.append(disassembly_data.SLD_EQU_LOCATION_RELATIVE, label_address - address)
+                #logger.debug("%06X: mid-instruction label = '%s' %d", match_address, label, label_address-match_address)
+        bytes_consumed += bytes_matched
+        found_terminating_instruction = instruction_flags & disassembly_data.CLF_FINAL == disassembly_data.CLF_FINAL
+        if found_terminating_instruction:
+            break
 
-            if new_code_address is not None:
-                # TODO: Verify that the split "trailing" block was within the original block.
-                result = split_block(program_data, new_code_address)
-                if IS_SPLIT_ERR(result[1]):
-                    if result[1] == ERR_SPLIT_EXISTING:
-                        # We've skipped into an existing block, only continue disassembling if it is unprocessed.
-                        trailing_block, trailing_block_idx = lookup_block_by_address(program_data, new_code_address)
-                        if not trailing_block.flags & disassembly_data.BLOCK_FLAG_PROCESSED:
-                            disassembly_offsets.add(new_code_address)
-                    else:
-                        logger.error("_process_address_as_code/skipped-data: At $%06X unexpected splitting error #%d", new_code_address, result[1])
-                        block.flags |= disassembly_data.BLOCK_FLAG_PROCESSED
-                        continue
-                else:
-                    # We've split off a new block and will continue disassembling here.
-                    trailing_block, trailing_block_idx = result
-                    trailing_block.flags &= ~disassembly_data.BLOCK_FLAG_PROCESSED
-                    set_block_data_type(program_data, disassembly_data.DATA_TYPE_LONGWORD, trailing_block, block_idx=trailing_block_idx, work_state=work_state)
-                    disassembly_offsets.add(new_code_address)
-
-        # If there were no code statements identified, this will just be processed data.
-        block.flags |= disassembly_data.BLOCK_FLAG_PROCESSED
-        if len(line_data) == 0:
-            continue
+    # Discard any unprocessed block / jump over isolatible unprocessed instructions.
+    if bytes_consumed < block.length:
+        new_code_address = None
+        if bytes_consumed == 0:
+            # If we encountered an unknown instruction at the start of a block.
+            if data_bytes_to_skip:
+                # We'll split at this address, leaving the current block as a processed longword block.
+                new_code_address = address + data_bytes_to_skip
+            else:
+                logger.error("Skipping block at %X with no code (length: %X)", data_offset_start, block.length)
+        else:
+            # Handle the case where we have one instruction and it's a final one.
+            if match_address == block.address:
+                match_address += bytes_consumed
+            result = split_block(program_data, match_address)
+            if IS_SPLIT_ERR(result[1]):
+                logger.error("_process_address_as_code/unrecognised-code: At $%06X unexpected splitting error %d, block address %X, bytes consumed %d, found terminating instruction %s", match_address, result[1], block.address, bytes_consumed, found_terminating_instruction)
+                block.flags |= disassembly_data.BLOCK_FLAG_PROCESSED
+                return
 
-        # 1. Get the pre-change data.
-        line0 = get_block_line_number(program_data, block_idx)
-        old_line_count = get_block_line_count_cached(program_data, block)
+            trailing_block, trailing_block_idx = result
+            set_block_data_type(program_data, disassembly_data.DATA_TYPE_LONGWORD, trailing_block, block_idx=trailing_block_idx, work_state=work_state)
 
-        # 2. Apply the change to a temporary block.
-        temp_block = disassembly_data.SegmentBlock()
-        block.copy_to(temp_block)
-        disassembly_data.set_block_data_type(temp_block, disassembly_data.DATA_TYPE_CODE)
-        temp_block.line_data = line_data
-        temp_block.line_count = get_block_line_count(program_data, temp_block)
-        #print "NEW CODE BLOCK", hex(temp_block.address),"->",hex(temp_block.address+temp_block.length), "LC", temp_block.line_count
+            # If an unknown instruction was encountered.
+            if not found_terminating_instruction:
+                # We are marking the code past any bytes to skip as processed here, so we need to mark that as unprocessed again when we split it off brlow.
+                trailing_block.flags |= disassembly_data.BLOCK_FLAG_PROCESSED
+                # If code resumes after analysis determines we can skip the unknown instruction as data.
+                if data_bytes_to_skip:
+                    new_code_address = match_address + data_bytes_to_skip
+            else:
+                trailing_block.flags &= ~disassembly_data.BLOCK_FLAG_PROCESSED
 
-        # 3. Notify listeners the change is about to happen (with metadata).
-        line_count_delta = temp_block.line_count - old_line_count
-        if line_count_delta != 0:
-            if program_data.pre_line_change_func:
-                if line_count_delta > 0:
-                    program_data.pre_line_change_func(line0 + old_line_count, line_count_delta)
+        if new_code_address is not None:
+            # TODO: Verify that the split "trailing" block was within the original block.
+            result = split_block(program_data, new_code_address)
+            if IS_SPLIT_ERR(result[1]):
+                if result[1] == ERR_SPLIT_EXISTING:
+                    # We've skipped into an existing block, only continue disassembling if it is unprocessed.
+                    trailing_block, trailing_block_idx = lookup_block_by_address(program_data, new_code_address)
+                    if not trailing_block.flags & disassembly_data.BLOCK_FLAG_PROCESSED:
+                        disassembly_offsets.add(new_code_address)
                 else:
-                    program_data.pre_line_change_func(line0 + old_line_count + line_count_delta, line_count_delta)
+                    logger.error("_process_address_as_code/skipped-data: At $%06X unexpected splitting error #%d", new_code_address, result[1])
+                    block.flags |= disassembly_data.BLOCK_FLAG_PROCESSED
+                    return
+            else:
+                # We've split off a new block and will continue disassembling here.
+                trailing_block, trailing_block_idx = result
+                trailing_block.flags &= ~disassembly_data.BLOCK_FLAG_PROCESSED
+                set_block_data_type(program_data, disassembly_data.DATA_TYPE_LONGWORD, trailing_block, block_idx=trailing_block_idx, work_state=work_state)
+                disassembly_offsets.add(new_code_address)
 
-        # 4. Make the change.
-        temp_block.copy_to(block)
-        if line_count_delta != 0:
-            # We changed the line count, we need to flag a block line numbering recalculation.
-            if program_data.block_line0s_dirtyidx is None or program_data.block_line0s_dirtyidx > block_idx+1:
-                program_data.block_line0s_dirtyidx = block_idx+1
+    # If there were no code statements identified, this will just be processed data.
+    block.flags |= disassembly_data.BLOCK_FLAG_PROCESSED
+    if len(line_data) == 0:
+        return
 
-            if program_data.post_line_change_func:
-                program_data.post_line_change_func(None, line_count_delta)
+    # 1. Get the pre-change data.
+    line0 = get_block_line_number(program_data, block_idx)
+    old_line_count = get_block_line_count_cached(program_data, block)
 
-        # Extract any addresses which are referred to, for later use.
-        for type_id, entry in line_data:
-            if type_id == disassembly_data.SLD_INSTRUCTION:
-                for match_address, flags in program_data.dis_get_match_addresses_func(entry).iteritems():
-                    if flags & 1: # MAF_CODE
-                        disassembly_offsets.add(match_address)
-                        insert_branch_address(program_data, match_address, entry.pc-2, pending_symbol_addresses)
-                    elif flags & 2: # MAF_ABSOLUTE
-                        if match_address in program_data.loader_relocated_addresses:
-                            search_address = match_address
-                            while search_address < match_address + entry.num_bytes:
-                                if search_address in program_data.loader_relocatable_addresses:
-                                    insert_reference_address(program_data, match_address, entry.pc-2, pending_symbol_addresses)
-                                    # print "ABS REF LOCATION: %X FOUND Imm ADDRESS %X INS %s" % (entry.pc, match_address, entry.specification.key)
-                                    break
-                                search_address += 1
-                    elif flags & 4 != 4: # !MAF_UNCERTAIN
-                        insert_reference_address(program_data, match_address, entry.pc-2, pending_symbol_addresses)
-
-        # DEBUG BLOCK SPILLING BASED ON LOGICAL ASSUMPTION OF MORE CODE.
-        if bytes_consumed == block.length and not found_terminating_instruction and not data_bytes_to_skip:
-            debug_offsets.add(block.address+block.length)
+    # 2. Calculate the line count the block will have after the change.
+    new_line_count = get_block_line_count(program_data, block, disassembly_data.DATA_TYPE_CODE, line_data)
 
+    # 3. Notify listeners the change is about to happen (with metadata).
+    line_count_delta = new_line_count - old_line_count
+    if line_count_delta != 0:
+        if program_data.pre_line_change_func:
+            if line_count_delta > 0:
+                program_data.pre_line_change_func(line0 + old_line_count, line_count_delta)
+            else:
+                program_data.pre_line_change_func(line0 + old_line_count + line_count_delta, line_count_delta)
+
+    # 4. Make the change.
+    disassembly_data.set_block_data_type(block, disassembly_data.DATA_TYPE_CODE)
+    _clear_uncertain_reference_counts(program_data, block_idx)
+    block.line_data = line_data
+    block.line_count = new_line_count
+    if line_count_delta != 0:
+        # We changed the line count, we need to flag a block line numbering recalculation.
+        if program_data.block_line0s_dirtyidx is None or program_data.block_line0s_dirtyidx > block_idx+1:
+            program_data.block_line0s_dirtyidx = block_idx+1
+
+        if program_data.post_line_change_func:
+            program_data.post_line_change_func(None, line_count_delta)
+
+    # Extract any addresses which are referred to, for later use.
+    for instruction_address, num_bytes, match_addresses in decoded_matches:
+        for match_address, flags in match_addresses.iteritems():
+            if flags & 1: # MAF_CODE
+                disassembly_offsets.add(match_address)
+                insert_branch_address(program_data, match_address, instruction_address, pending_symbol_addresses)
+            elif flags & 2: # MAF_ABSOLUTE
+                if match_address in program_data.loader_relocated_addresses:
+                    search_address = match_address
+                    while search_address < match_address + num_bytes:
+                        if search_address in program_data.loader_relocatable_addresses:
+                            insert_reference_address(program_data, match_address, instruction_address, pending_symbol_addresses)
+                            # print "ABS REF LOCATION: %X FOUND Imm ADDRESS %X INS %s" % (instruction_address+2, match_address, entry.specification.key)
+                            break
+                        search_address += 1
+            elif flags & 4 != 4: # !MAF_UNCERTAIN
+                insert_reference_address(program_data, match_address, instruction_address, pending_symbol_addresses)
+
+    # DEBUG BLOCK SPILLING BASED ON LOGICAL ASSUMPTION OF MORE CODE.
+    if bytes_consumed == block.length and not found_terminating_instruction and not data_bytes_to_skip:
+        debug_offsets.add(block.address+block.length)
+
+def _complete_code_analysis(program_data, analysis):
+    pending_symbol_addresses, debug_offsets = analysis.pending_symbol_addresses, analysis.debug_offsets
     # Add in all the detected new addresses with default labeling, and split accordingly.
     for address in pending_symbol_addresses:
         if address not in program_data.symbols_by_address:
@@ -1286,6 +1769,21 @@ def _process_address_as_code(program_data, address, pending_symbol_addresses, wo
             continue
         logger.debug("%06X (%06X): Found end of block boundary with processed code and no end instruction (data type: %d, processed: %d)", address, block.address, disassembly_data.get_block_data_type(block), block.flags & disassembly_data.BLOCK_FLAG_PROCESSED)
 
+    # Split the blocks for existing symbols (so their label appears).
+    for address in analysis.symbol_addresses:
+        result = split_block(program_data, address)
+        if IS_SPLIT_ERR(result[1]):
+            if result[1] in (ERR_SPLIT_EXISTING, ERR_SPLIT_MIDINSTRUCTION):
+                continue
+            logger.error("_complete_code_analysis: At $%06X unexpected splitting error #%d", address, result[1])
+
+def _process_address_as_code(program_data, address, pending_symbol_addresses, work_state=None):
+    analysis = disassembly_data.CodeAnalysisState()
+    analysis.disassembly_offsets.add(address)
+    analysis.pending_symbol_addresses = pending_symbol_addresses
+    with util.trace_span("code_analysis_step", address=address):
+        _step_code_analysis(program_data, analysis, work_state=work_state)
+
 def get_new_project_options(program_data):
     return disassembly_data.NewProjectOptions()
 
@@ -1304,21 +1802,104 @@ def get_project_save_count(program_data):
 ## Project loading and saving.
 
 def save_project_file(save_file, program_data, save_options):
+    read_deferred_project_data(program_data)
     return disassembly_persistence.save_project(save_file, program_data, save_options)
 
+def save_project_file_incrementally(save_file, program_data):
+    """ Appends what changed since the project file was last saved or loaded.  Returns False if it needs a full save instead. """
+    if program_data.saved_blocks is None or program_data.code_analysis is not None:
+        return False
+    return disassembly_persistence.save_project_journal(save_file, program_data)
+
+def snapshot_project_data(program_data):
+    """
+    A copy of the persisted state, which later changes to the program data do not affect, to save on
+    another thread.  Line data is copied, and state still in the project file is left to be read from it.
+    The record of unsaved changes moves to the snapshot, until finish_project_snapshot is called.
+    """
+    snapshot = disassembly_data.ProgramData()
+    snapshot.__dict__.update(program_data.__dict__)
+    snapshot.deferred_attributes = dict(program_data.deferred_attributes)
+    if "symbols_by_address" not in snapshot.deferred_attributes:
+        snapshot.symbols_by_address = program_data.symbols_by_address.copy()
+    for attr_name in ("branch_addresses", "reference_addresses"):
+        if attr_name not in snapshot.deferred_attributes:
+            setattr(snapshot, attr_name, dict((address, set(addresses)) for (address, addresses) in getattr(program_data, attr_name).iteritems()))
+    snapshot.post_segment_addresses = dict((segment_id, list(addresses)) for (segment_id, addresses) in program_data.post_segment_addresses.iteritems())
+    snapshot.blocks = [ _snapshot_block(block) for block in program_data.blocks ]
+    if program_data.code_analysis is not None:
+        analysis = snapshot.code_analysis = disassembly_data.CodeAnalysisState()
+        analysis.disassembly_offsets = program_data.code_analysis.disassembly_offsets.copy()
+        analysis.pending_symbol_addresses = program_data.code_analysis.pending_symbol_addresses.copy()
+        analysis.debug_offsets = program_data.code_analysis.debug_offsets.copy()
+        analysis.symbol_addresses = list(program_data.code_analysis.symbol_addresses)
+    program_data.unsaved_symbol_addresses = set()
+    program_data.unsaved_branch_addresses = set()
+    program_data.unsaved_reference_addresses = set()
+    return snapshot
+
+def _snapshot_block(block):
+    snapshot_block = disassembly_data.SegmentBlock()
+    snapshot_block.segment_id = block.segment_id
+    snapshot_block.segment_offset = block.segment_offset
+    snapshot_block.address = block.address
+    snapshot_block.length = block.length
+    snapshot_block.flags = block.flags
+    snapshot_block.line_count = block.line_count
+    if block.deferred_line_data is not None:
+        del snapshot_block.line_data
+        snapshot_block.deferred_line_data = block.deferred_line_data
+    elif block.line_data is not None:
+        snapshot_block.line_data = block.line_data[:]
+    return snapshot_block
+
+def save_project_snapshot(save_file_path, snapshot, save_options, work_state=None):
+    """
+    The snapshot is saved to a temporary file, which replaces the project file when complete.  Returns
+    False if the save was cancelled.
+    """
+    dir_path, file_name = os.path.split(os.path.abspath(save_file_path))
+    fd, temp_file_path = tempfile.mkstemp(prefix=file_name +".", suffix=".tmp", dir=dir_path)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            completed = disassembly_persistence.save_project(f, snapshot, save_options, work_state=work_state)
+        if completed:
+            util.replace_file(temp_file_path, save_file_path)
+        return completed
+    finally:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+def finish_project_snapshot(program_data, snapshot, saved):
+    """ If the snapshot was not saved, the changes it would have saved are still unsaved along with any made since. """
+    if saved:
+        program_data.save_count = snapshot.save_count
+        program_data.input_file_cached = snapshot.input_file_cached
+        program_data.saved_blocks = snapshot.saved_blocks
+        program_data.journal_length = 0
+    else:
+        program_data.unsaved_symbol_addresses |= snapshot.unsaved_symbol_addresses
+        program_data.unsaved_branch_addresses |= snapshot.unsaved_branch_addresses
+        program_data.unsaved_reference_addresses |= snapshot.unsaved_reference_addresses
+
+def read_deferred_project_data(program_data):
+    """ Needs to be done before the project file it was loaded from is overwritten. """
+    disassembly_persistence.read_deferred_data(program_data)
+
 
 def load_project_file(save_file, file_name, work_state=None):
+    project_start_time = time.time()
     program_data = disassembly_persistence.load_project(save_file, work_state=work_state)
     if program_data is None:
         return None, 0
+    _record_phase_time(program_data, "project", project_start_time)
 
     program_data.file_name = file_name
-
-    for block in program_data.blocks:
-        if disassembly_data.get_block_data_type(block) == disassembly_data.DATA_TYPE_ASCII:
-            _process_block_as_ascii(program_data, block)
+    program_data.deferred_line_data_func = onload_process_deferred_line_data
 
     onload_set_disassemblylib_functions(program_data)
+    if is_segment_data_cached(program_data):
+        onload_process_block_line_data(program_data)
     onload_make_address_ranges(program_data)
     onload_cache_uncertain_references(program_data)
 
@@ -1338,7 +1919,22 @@ def load_file(input_file, new_options, file_name, work_state=None):
     if work_state is not None and work_state.check_exit_update(0.1, "TEXT_LOAD_ANALYSING_FILE"):
         return None
 
-    result = loaderlib.load_file(input_file, loader_options)
+    loader_start_time = time.time()
+    # The input file is read once, and everything that needs to read it reads that.
+    with util.trace_span("loaderlib.ingest_file"):
+        input_file = loaderlib.ingest_file(input_file)
+
+    analysis_cache_entry = None
+    if new_options.analysis_cache_path is not None:
+        cache_file_path = get_analysis_cache_file_path(new_options.analysis_cache_path, input_file, new_options)
+        with util.trace_span("load_analysis_cache_entry"):
+            result = _load_analysis_cache_entry(cache_file_path, input_file, file_name)
+        if result is not None:
+            return result
+        analysis_cache_entry = cache_file_path, new_options.analysis_cache_size
+
+    with util.trace_span("loaderlib.load_file"):
+        result = loaderlib.load_file(input_file, loader_options)
     if result is None:
         return None, 0
 
@@ -1349,19 +1945,19 @@ def load_file(input_file, new_options, file_name, work_state=None):
     if new_options.is_binary_file:
         flags |= disassembly_data.PDF_BINARY_FILE
     program_data.flags |= flags
-    program_data.block_addresses = []
-    program_data.block_line0s = []
+    program_data.block_addresses = array.array("l")
+    program_data.block_line0s = array.array("l")
     program_data.block_line0s_dirtyidx = 0
     program_data.post_segment_addresses = {}
+    _record_phase_time(program_data, "loader", loader_start_time)
 
     program_data.loader_system_name = file_info.system.system_name
     program_data.loader_relocatable_addresses = set()
     program_data.loader_relocated_addresses = set()
 
     program_data.file_name = file_name
-    input_file.seek(0, os.SEEK_END)
-    program_data.file_size = input_file.tell()
-    program_data.file_checksum = util.calculate_file_checksum(input_file)
+    program_data.file_size = input_file.size
+    program_data.file_checksum = input_file.checksum
     program_data.dis_name = file_info.system.get_arch_name()
 
     segments = program_data.loader_segments = file_info.segments
@@ -1369,15 +1965,20 @@ def load_file(input_file, new_options, file_name, work_state=None):
     # Extract useful information from file loading process.
     program_data.loader_data_types = data_types
     program_data.loader_internal_data = file_info.get_savefile_data()
+    program_data.loader_relocations = file_info.relocations_by_segment_id
 
     onload_set_disassemblylib_functions(program_data)
     onload_make_address_ranges(program_data)
 
     program_data.loader_entrypoint_segment_id = file_info.entrypoint_segment_id
     program_data.loader_entrypoint_offset = file_info.entrypoint_offset
+    relocation_start_time = time.time()
     for i in range(len(segments)):
-        loaderlib.cache_segment_data(input_file, segments, i)
-    loaderlib.relocate_segment_data(segments, data_types, file_info.relocations_by_segment_id, program_data.loader_relocatable_addresses, program_data.loader_relocated_addresses)
+        with util.trace_span("loaderlib.cache_segment_data", segment_id=i):
+            loaderlib.cache_segment_data(input_file, segments, i)
+    with util.trace_span("loaderlib.relocate_segment_data"):
+        loaderlib.relocate_segment_data(segments, data_types, file_info.relocations_by_segment_id, program_data.loader_relocatable_addresses, program_data.loader_relocated_addresses)
+    _record_phase_time(program_data, "relocation", relocation_start_time)
 
     # Start disassembling.
     entrypoint_address = loaderlib.get_segment_address(segments, program_data.loader_entrypoint_segment_id) + program_data.loader_entrypoint_offset
@@ -1400,8 +2001,9 @@ def load_file(input_file, new_options, file_name, work_state=None):
         block.address = address
         block.length = data_length
         program_data.block_addresses.append(block.address)
-        program_data.block_line0s.append(None)
+        program_data.block_line0s.append(0)
         program_data.blocks.append(block)
+        program_data.stats["blocks_created"] += 1
 
         if segment_length > data_length:
             block = disassembly_data.SegmentBlock()
@@ -1412,8 +2014,9 @@ def load_file(input_file, new_options, file_name, work_state=None):
             block.segment_offset = data_length
             block.length = segment_length - data_length
             program_data.block_addresses.append(block.address)
-            program_data.block_line0s.append(None)
+            program_data.block_line0s.append(0)
             program_data.blocks.append(block)
+            program_data.stats["blocks_created"] += 1
 
     # Pass 2: Stuff.
     # Incorporate known symbols.
@@ -1430,31 +2033,151 @@ def load_file(input_file, new_options, file_name, work_state=None):
     pending_symbol_addresses.add(entrypoint_address)
 
     # Follow the disassembly at the given address, as far as it takes us.
-    _process_address_as_code(program_data, entrypoint_address, pending_symbol_addresses, work_state=work_state)
-
-    if work_state is not None and work_state.check_exit_update(0.9, "TEXT_LOAD_POSTPROCESSING"):
-        return None
+    analysis = program_data.code_analysis = disassembly_data.CodeAnalysisState()
+    analysis.disassembly_offsets.add(entrypoint_address)
+    analysis.pending_symbol_addresses = pending_symbol_addresses
+    analysis.symbol_addresses = existing_symbol_addresses
+    program_data.analysis_cache_entry = analysis_cache_entry
+    # The caller can otherwise advance the analysis with step_code_analysis, and use what is there so far in the meantime.
+    # If it gets cancelled, what is there so far is kept, and the project can be saved with the analysis to be resumed.
+    if not new_options.analysis_in_slices:
+        if new_options.analysis_processes > 1:
+            disassembly_start_time = time.time()
+            with util.trace_span("code_analysis_parallel", processes=new_options.analysis_processes):
+                is_explored = _explore_code_in_parallel(program_data, analysis, new_options.analysis_processes, work_state)
+            _record_phase_time(program_data, "disassembly", disassembly_start_time)
+            # What was explored gets labelled serially, once no code is left to follow.
+            if is_explored:
+                step_code_analysis(program_data, work_state=work_state)
+        else:
+            step_code_analysis(program_data, work_state=work_state)
 
-    # Split the blocks for existing symbols (so their label appears).
-    for address in existing_symbol_addresses:
-        result = split_block(program_data, address)
-        if IS_SPLIT_ERR(result[1]):
-            if result[1] in (ERR_SPLIT_EXISTING, ERR_SPLIT_MIDINSTRUCTION):
-                continue
-            logger.error("load_file: At $%06X unexpected splitting error #%d", address, result[1])
+    return program_data, get_file_line_count(program_data)
 
-    ## Any analysis / post-processing that does not change line count should go below.
-    onload_cache_uncertain_references(program_data)
+def is_code_analysis_pending(program_data):
+    return program_data.code_analysis is not None
 
-    DEBUG_log_load_stats(program_data)
+def step_code_analysis(program_data, budget_ms=None, work_state=None):
+    """ Advance the analysis left in progress by load_file, or a loaded project.  Returns True when it is complete. """
+    analysis = program_data.code_analysis
+    if analysis is None:
+        return True
+    disassembly_start_time = time.time()
+    with util.trace_span("code_analysis_step", pending=len(analysis.disassembly_offsets)):
+        is_complete = _step_code_analysis(program_data, analysis, budget_ms, work_state)
+    _record_phase_time(program_data, "disassembly", disassembly_start_time)
+    if is_complete:
+        program_data.code_analysis = None
+
+        ## Any analysis / post-processing that does not change line count should go below.
+        postprocessing_start_time = time.time()
+        onload_cache_uncertain_references(program_data)
+        _record_phase_time(program_data, "postprocessing", postprocessing_start_time)
+
+        if program_data.analysis_cache_entry is not None:
+            with util.trace_span("store_analysis_cache_entry"):
+                _store_analysis_cache_entry(program_data)
+
+        DEBUG_log_load_stats(program_data)
+    return program_data.code_analysis is None
+
+## Analysis cache.
+
+"Bump when decoding or analysis changes, so that projects cached by older versions are not reused."
+ANALYSIS_CACHE_VERSION = 1
+ANALYSIS_CACHE_SUFFIX = ".psproj"
+
+def get_analysis_cache_file_path(cache_path, input_file, new_options):
+    """ The same input file loaded with the same options, by the same version, analyses to the same project. """
+    key_values = [ ANALYSIS_CACHE_VERSION, disassembly_persistence.SAVEFILE_VERSION, input_file.checksum, new_options.is_binary_file ]
+    if new_options.is_binary_file:
+        key_values.extend((new_options.dis_name, new_options.loader_load_address, new_options.loader_entrypoint_offset))
+    return os.path.join(cache_path, hashlib.md5(repr(key_values)).hexdigest() + ANALYSIS_CACHE_SUFFIX)
 
-    return program_data, get_file_line_count(program_data)
+def _load_analysis_cache_entry(cache_file_path, input_file, file_name):
+    if not os.path.isfile(cache_file_path):
+        return None
+    # What is read on first use is read from the mapped project file, which stays open without this.
+    with open(cache_file_path, "rb") as f:
+        program_data, line_count = load_project_file(f, file_name)
+    if program_data is None or program_data.file_checksum != input_file.checksum:
+        logger.error("Analysis cache entry '%s' is unusable, analysing the file instead.", cache_file_path)
+        return None
+    cache_segment_data(program_data, input_file)
+    # It is a new project as far as the user is concerned.
+    program_data.save_count = 0
+    program_data.saved_blocks = None
+    program_data.journal_length = 0
+    # Recently used entries are the last to be evicted.
+    try:
+        os.utime(cache_file_path, None)
+    except EnvironmentError:
+        pass
+    logger.info("Loaded analysed project from cache entry '%s'", cache_file_path)
+    return program_data, line_count
+
+def _store_analysis_cache_entry(program_data):
+    cache_file_path, cache_size = program_data.analysis_cache_entry
+    program_data.analysis_cache_entry = None
+    cache_path = os.path.dirname(cache_file_path)
+    # The input file is not embedded, it is what gets loaded to find the entry.
+    snapshot = snapshot_project_data(program_data)
+    try:
+        if not os.path.isdir(cache_path):
+            os.makedirs(cache_path)
+        saved = save_project_snapshot(cache_file_path, snapshot, disassembly_data.SaveProjectOptions())
+    except EnvironmentError:
+        logger.exception("Failed to store analysis cache entry '%s'", cache_file_path)
+        saved = False
+    # The user has still to save the project themselves.
+    finish_project_snapshot(program_data, snapshot, False)
+    if saved:
+        evict_analysis_cache_entries(cache_path, cache_size, cache_file_path)
+
+def evict_analysis_cache_entries(cache_path, cache_size, keep_file_path=None):
+    """ Removes the least recently used entries until those left fit within the cache size. """
+    entries = []
+    for entry_name in os.listdir(cache_path):
+        if entry_name.endswith(ANALYSIS_CACHE_SUFFIX):
+            entry_path = os.path.join(cache_path, entry_name)
+            try:
+                entry_stat = os.stat(entry_path)
+            except EnvironmentError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_path, entry_stat.st_size))
+    entries.sort()
+    total_size = sum(entry_size for (entry_mtime, entry_path, entry_size) in entries)
+    for entry_mtime, entry_path, entry_size in entries:
+        if total_size <= cache_size:
+            break
+        if entry_path == keep_file_path:
+            continue
+        try:
+            os.remove(entry_path)
+        except EnvironmentError:
+            # Windows will not remove an entry which is still mapped by a loaded project.
+            continue
+        total_size -= entry_size
 
 
 def onload_set_disassemblylib_functions(program_data):
     for func_name, func in disassemblylib.get_api(program_data.dis_name):
         setattr(program_data, "dis_"+ func_name +"_func", func)
 
+def onload_process_block_line_data(program_data):
+    """ The block line data which is not stored in project files, is calculated from the segment data. """
+    for block in program_data.blocks:
+        data_type = disassembly_data.get_block_data_type(block)
+        if data_type == disassembly_data.DATA_TYPE_ASCII:
+            _process_block_as_ascii(program_data, block)
+        elif data_type == disassembly_data.DATA_TYPE_CODE and block.deferred_line_data is None:
+            _realise_code_line_data(program_data, block)
+
+def onload_process_deferred_line_data(program_data, block):
+    """ Code blocks read from project files on first use, are processed then rather than on load. """
+    if is_segment_data_cached(program_data):
+        _realise_code_line_data(program_data, block)
+
 def onload_make_address_ranges(program_data):
     program_data.address_ranges = []
     segments = program_data.loader_segments
@@ -1474,19 +2197,44 @@ def onload_make_address_ranges(program_data):
             program_data.address_ranges.append((new_address0, new_addressN-1, set([segment_id])))
 
 def onload_cache_uncertain_references(program_data):
+    """
+    The uncertain references are located for each block when they are first needed.  But a value
+    which lies just past the end of the segment address space gets a line for its label appended
+    to the segment, so these need to be found now as the line count should not change later.
+    """
     if program_data.flags & disassembly_data.PDF_BINARY_FILE == disassembly_data.PDF_BINARY_FILE:
+        segments = program_data.loader_segments
         for block in program_data.blocks:
-            data_type = disassembly_data.get_block_data_type(block)
-            if data_type == disassembly_data.DATA_TYPE_CODE:
-                block.references = _locate_uncertain_code_references(program_data, block.address, block)
-            else:
-                block.references = _locate_uncertain_data_references(program_data, block.address, block)
+            block.references = None
+        _clear_uncertain_reference_counts(program_data, 0)
+        for address0, addressN, segment_ids in program_data.address_ranges:
+            search_bytes = str(bytearray(program_data.loader_data_types.uint32_bytes(addressN + 1)))
+            for block in program_data.blocks:
+                if disassembly_data.get_block_data_type(block) == disassembly_data.DATA_TYPE_CODE:
+                    continue
+                data = loaderlib.get_segment_data(segments, block.segment_id)
+                if data is None:
+                    continue
+                data_idx_start = block.segment_offset
+                data_idx_end = block.segment_offset + block.length
+                data_idx = data.find(search_bytes, data_idx_start, data_idx_end)
+                while data_idx != -1:
+                    if (data_idx - data_idx_start) & 1 == 0:
+                        check_known_address(program_data, addressN + 1)
+                        break
+                    data_idx = data.find(search_bytes, data_idx + 1, data_idx_end)
 
 
 def cache_segment_data(program_data, f):
     segments = program_data.loader_segments
     for i in range(len(segments)):
-        loaderlib.cache_segment_data(f, segments, i)
+        with util.trace_span("loaderlib.cache_segment_data", segment_id=i):
+            loaderlib.cache_segment_data(f, segments, i)
+    # Projects saved before relocations were persisted, are left with unrelocated segment data.
+    if program_data.loader_relocations is not None:
+        with util.trace_span("loaderlib.relocate_segment_data"):
+            loaderlib.relocate_segment_data(segments, program_data.loader_data_types, program_data.loader_relocations, None, None)
+    onload_process_block_line_data(program_data)
     # program_data.loader_file_path = file_path
     # TODO: reconcile
 
@@ -16,6 +16,9 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import array
+import collections
+
 
 ## SegmentBlock flag field related.
 
@@ -62,7 +65,6 @@ def set_block_data_type(block, data_type):
     NOTE: If this function is called after loading of an input file is complete, then it is 
           the responsibility of the caller to update the uncertain reference lists.
     """
-    block._old_data_type = get_block_data_type(block)
     block.flags &= ~(DATA_TYPE_BITMASK << DATA_TYPE_BIT0)
     block.flags |= ((data_type & DATA_TYPE_BITMASK) << DATA_TYPE_BIT0)
 
@@ -73,6 +75,79 @@ SLD_COMMENT_TRAILING = 2
 SLD_COMMENT_FULL_LINE = 3
 SLD_EQU_LOCATION_RELATIVE = 4
 
+SLD_COMMENT_TYPES = (SLD_COMMENT_TRAILING, SLD_COMMENT_FULL_LINE)
+
+## SegmentBlock code line data instruction flags.
+
+""" The instruction is a trap, which can be followed by a blank line. """
+CLF_TRAP = 1 << 0
+""" The instruction is a conditional branch, which can be followed by a blank line. """
+CLF_BRANCH = 1 << 1
+""" The instruction is one which execution does not continue past. """
+CLF_FINAL = 1 << 2
+
+class CodeLineData(object):
+    """
+    The line data of a code block, which iterates like a list of (type_id, entry) tuples.  The
+    entry for instructions and relative locations is the block offset, and for comments it is the
+    text.  The type ids, offsets, and the length and flags (CLF_*) of each instruction are stored
+    in arrays, and the rarer comment text is kept aside by line index.
+    """
+    __slots__ = ("type_ids", "offsets", "lengths", "flags", "comments")
+
+    def __init__(self):
+        self.type_ids = array.array("B")
+        self.offsets = array.array("i")
+        self.lengths = array.array("B")
+        self.flags = array.array("B")
+        self.comments = {}
+
+    def __len__(self):
+        return len(self.type_ids)
+
+    def __iter__(self):
+        for i in xrange(len(self.type_ids)):
+            yield self[i]
+
+    def __getitem__(self, idx):
+        if type(idx) is slice:
+            idx0, idxN, step = idx.indices(len(self.type_ids))
+            line_data = CodeLineData()
+            line_data.type_ids = self.type_ids[idx0:idxN]
+            line_data.offsets = self.offsets[idx0:idxN]
+            line_data.lengths = self.lengths[idx0:idxN]
+            line_data.flags = self.flags[idx0:idxN]
+            line_data.comments = dict((i-idx0, text) for (i, text) in self.comments.iteritems() if idx0 <= i < idxN)
+            return line_data
+        if idx < 0:
+            idx += len(self.type_ids)
+        type_id = self.type_ids[idx]
+        if type_id in SLD_COMMENT_TYPES:
+            return type_id, self.comments[idx]
+        return type_id, self.offsets[idx]
+
+    def append(self, type_id, entry, length=0, flags=0):
+        self.insert(len(self.type_ids), type_id, entry, length, flags)
+
+    def insert(self, idx, type_id, entry, length=0, flags=0):
+        if idx < len(self.type_ids):
+            # Only the comments of the lines after the inserted one are renumbered, highest first.
+            for i in sorted((i for i in self.comments if i >= idx), reverse=True):
+                self.comments[i+1] = self.comments.pop(i)
+        if type_id in SLD_COMMENT_TYPES:
+            self.comments[idx] = entry
+            entry = 0
+        self.type_ids.insert(idx, type_id)
+        self.offsets.insert(idx, entry)
+        self.lengths.insert(idx, length)
+        self.flags.insert(idx, flags)
+
+    def rebase(self, block_offset):
+        """ Make the block offsets relative to a new block start at the given block offset. """
+        for i, type_id in enumerate(self.type_ids):
+            if type_id in (SLD_INSTRUCTION, SLD_EQU_LOCATION_RELATIVE):
+                self.offsets[i] -= block_offset
+
 
 PDF_BINARY_FILE = 1
 
@@ -106,6 +181,8 @@ class ProgramData(object):
         self.loader_segments = []
         self.loader_relocated_addresses = None # set()
         self.loader_relocatable_addresses = None # set()
+        "Per segment, the (target segment id, local offsets) relocations to apply to its data."
+        self.loader_relocations = None # [ [ (target_segment_id, offsets), ... ], ... ]
         self.loader_entrypoint_segment_id = None
         self.loader_entrypoint_offset = None
         self.loader_internal_data = None # PERSISTED VIA LOADERLIB
@@ -115,10 +192,10 @@ class ProgramData(object):
 
         ## Non-persisted state.
         # Local:
-        "List of ascending block addresses (used by bisect for address based lookups)."
-        self.block_addresses = None # []
-        "List of ascending block first line numbers (used by bisect for line number based lookups)."
-        self.block_line0s = None # []
+        "Array of ascending block addresses (used by bisect for address based lookups)."
+        self.block_addresses = None # array.array("l")
+        "Array of ascending block first line numbers (used by bisect for line number based lookups)."
+        self.block_line0s = None # array.array("l")
         "If list of first line numbers need recalculating, this is the entry to start at."
         self.block_line0s_dirtyidx = None # 0
         "Callback application can register to be notified."
@@ -129,10 +206,36 @@ class ProgramData(object):
         self.pre_line_change_func = None
         "Callback application can register to be notified."
         self.post_line_change_func = None
+        "Called with each block whose line data has been read from the project file on first use."
+        self.deferred_line_data_func = None
+        "Analysis still in progress (CodeAnalysisState), if any."
+        self.code_analysis = None
+        "Analysis counters by name, for seeing where the work goes (not persisted)."
+        self.stats = collections.Counter()
+        "Seconds spent in each load phase, in the order they were first entered (not persisted)."
+        self.phase_times = collections.OrderedDict()
+        "Recently decoded instructions by address, oldest first."
+        self.instruction_cache = collections.OrderedDict()
+        "Per kind (True for code), the uncertain references in each block and those before it, for the blocks located so far."
+        self.uncertain_reference_counts = { True: array.array("l"), False: array.array("l") }
         "List of segment address ranges, used to validate addresses."
         self.address_ranges = None # []
         "Where the file was saved to, or loaded from."
         self.savefile_path = None
+        "Persisted state still to be read from the project file, by attribute name."
+        self.deferred_attributes = {}
+        "Addresses with symbols changed since the project file was last saved or loaded."
+        self.unsaved_symbol_addresses = set()
+        "Addresses with branch references changed since the project file was last saved or loaded."
+        self.unsaved_branch_addresses = set()
+        "Addresses with data references changed since the project file was last saved or loaded."
+        self.unsaved_reference_addresses = set()
+        "Each block as the project file last saved or loaded has it (header, line data bytes) by address, if known."
+        self.saved_blocks = None
+        "Bytes of journal appended to the project file since it was last saved in full."
+        self.journal_length = 0
+        "Where to store the project when the analysis completes, and the cache size to keep to (file path, size), if anywhere."
+        self.analysis_cache_entry = None
 
         # disassemblylib:
         self.dis_is_final_instruction_func = None
@@ -149,38 +252,64 @@ class ProgramData(object):
         """ Whether the saved project embeds the input file in it's entirety. """
         self.input_file_cached = False
 
+    def __getattr__(self, attr_name):
+        # Only reached for persisted state which has not been read from the project file yet.
+        read_func = self.__dict__.get("deferred_attributes", {}).pop(attr_name, None)
+        if read_func is None:
+            raise AttributeError(attr_name)
+        value = read_func()
+        setattr(self, attr_name, value)
+        return value
+
 
 class SegmentBlock(object):
-    """ The number of this segment in the file. """
-    segment_id = None
-    """ The offset of this block in its segment. """
-    segment_offset = None
-    """ All segments appear as one contiguous address space.  This is the offset of this block in that space. """
-    address = None
-    """ The number of bytes data that this block contains. """
-    length = None
-    """ The data type of this block (DATA_TYPE_*) and more """
-    flags = 0
-    """ DATA_TYPE_CODE: [ line0_match, ... lineN_match ]. 
-        DATA_TYPE_ASCII: [ (offset, length), ... ]. """
-    line_data = None
-    """ Calculated number of lines. """
-    line_count = 0
-    """ Cached potential address references. """
-    references = None
-    """ Cached old data type. """
-    _old_data_type = None
-
-    def copy_to(self, new_block):
-        new_block.segment_id = self.segment_id
-        new_block.segment_offset = self.segment_offset
-        new_block.address = self.address
-        new_block.length = self.length
-        new_block.flags = self.flags
-        new_block.line_data = self.line_data
-        new_block.line_count = self.line_count
-        new_block.references = self.references
-        new_block._old_data_type = self._old_data_type
+    """
+    There can be a very large number of blocks, so the attributes are slotted rather than
+    stored in a dictionary for each instance.
+    """
+    __slots__ = ("segment_id", "segment_offset", "address", "length", "flags", "line_data", "line_count", "references", "deferred_line_data")
+
+    def __init__(self):
+        """ The number of this segment in the file. """
+        self.segment_id = None
+        """ The offset of this block in its segment. """
+        self.segment_offset = None
+        """ All segments appear as one contiguous address space.  This is the offset of this block in that space. """
+        self.address = None
+        """ The number of bytes data that this block contains. """
+        self.length = None
+        """ The data type of this block (DATA_TYPE_*) and more """
+        self.flags = 0
+        """ DATA_TYPE_CODE: CodeLineData.
+            DATA_TYPE_ASCII: array of the block offset of each line. """
+        self.line_data = None
+        """ Calculated number of lines. """
+        self.line_count = 0
+        """ Cached potential address references. """
+        self.references = None
+        """ (read function, argument) to get the line data, if it is still to be read from the project file. """
+        self.deferred_line_data = None
+
+    def __getattr__(self, attr_name):
+        # Only reached for line data which has not been read from the project file yet.
+        if attr_name != "line_data" or self.deferred_line_data is None:
+            raise AttributeError(attr_name)
+        read_func, read_arg = self.deferred_line_data
+        self.deferred_line_data = None
+        self.line_data = read_func(self, read_arg)
+        return self.line_data
+
+
+class CodeAnalysisState(object):
+    def __init__(self):
+        """ Addresses still to be followed as code. """
+        self.disassembly_offsets = set()
+        """ Addresses referred to by the code, which get labelled when the analysis is complete. """
+        self.pending_symbol_addresses = set()
+        """ Addresses code ran on into without a final instruction, logged when the analysis is complete. """
+        self.debug_offsets = set()
+        """ Addresses of existing symbols, which get split at when the analysis is complete. """
+        self.symbol_addresses = []
 
 
 class NewProjectOptions:
@@ -188,6 +317,11 @@ class NewProjectOptions:
     dis_name = None
     loader_load_address = None
     loader_entrypoint_offset = None
+    # Analysis options.
+    analysis_processes = 1 # More than one explores the code of each segment in parallel.
+    analysis_in_slices = False # Leave the analysis to be advanced by the caller.
+    analysis_cache_path = None # Directory of analysed projects to reuse, keyed by input file and options.
+    analysis_cache_size = 256 * 1024 * 1024 # Least recently used projects are removed beyond this many bytes.
 
 class LoadProjectOptions:
     valid_file_size = False
@@ -196,3 +330,4 @@ class LoadProjectOptions:
 class SaveProjectOptions:
     input_file = None
     save_file_path = None
+    compress_hunks = False
@@ -16,59 +16,54 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import array
+import cStringIO
 import logging
+import mmap
 import os
 import struct
 import time
+import zlib
 
 from disassembly_data import *
 import loaderlib
 import persistence
+import util
 
 
 logger = logging.getLogger("disassembly-persistence")
 
 
 SEGMENTBLOCK_PACK_FORMAT = "<HIIIIHH"
+# The block table entries also locate the line data of each block, which follows the table.  Line counts are not limited to 16 bits.
+SEGMENTBLOCK_TABLE_PACK_FORMAT = "<HIIIIIIII"
 
 
-def write_SegmentBlock(f, block):
+def get_SegmentBlock_line_data_count(block):
     if block.line_data is None:
-        line_data_count = 0
-    else:
-        line_data_count = len(block.line_data)
+        return 0
+    return len(block.line_data)
 
+def write_SegmentBlock(f, block):
+    line_data_count = get_SegmentBlock_line_data_count(block)
     s = struct.pack(SEGMENTBLOCK_PACK_FORMAT, block.segment_id, block.segment_offset, block.address, block.length, block.flags, block.line_count, line_data_count)
     f.write(s)
 
     if line_data_count > 0:
         if get_block_data_type(block) == DATA_TYPE_CODE:
-            block_offset = 0
-            for i, (type_id, entry) in enumerate(block.line_data):
-                persistence.write_uint8(f, type_id)
-                if type_id == SLD_INSTRUCTION:
-                    if type(entry) is int:
-                        persistence.write_uint16(f, entry)
-                        # The length of this instruction is not stored, so we calculate it relative to the next one. 
-                        j = i+1
-                        while j < len(block.line_data):
-                            next_type_id, next_entry = block.line_data[j]
-                            if next_type_id == SLD_INSTRUCTION:
-                                if type(next_entry) is int:
-                                    block_offset = next_entry
-                                else:
-                                    block_offset = next_entry.pc-2
-                                break
-                            j += 1
-                    else:
-                        persistence.write_uint16(f, block_offset)
-                        block_offset += entry.num_bytes
-                elif type_id == SLD_EQU_LOCATION_RELATIVE:
-                    persistence.write_uint32(f, entry) # block offset
-                elif type_id in (SLD_COMMENT_TRAILING, SLD_COMMENT_FULL_LINE):
-                    persistence.write_string(f, entry) # string
-                else:
-                    logger.error("Trying to save a savefile, did not know how to handle entry of type_id: %d, entry value: %s", type_id, entry)
+            write_code_line_data(f, block.line_data)
+
+def write_code_line_data(f, line_data):
+    for type_id, entry in line_data:
+        persistence.write_uint8(f, type_id)
+        if type_id == SLD_INSTRUCTION:
+            persistence.write_uint16(f, entry) # block offset
+        elif type_id == SLD_EQU_LOCATION_RELATIVE:
+            persistence.write_uint32(f, entry) # block offset
+        elif type_id in (SLD_COMMENT_TRAILING, SLD_COMMENT_FULL_LINE):
+            persistence.write_string(f, entry) # string
+        else:
+            logger.error("Trying to save a savefile, did not know how to handle entry of type_id: %d, entry value: %s", type_id, entry)
 
 def read_SegmentBlock(f):
     block = SegmentBlock()
@@ -77,20 +72,119 @@ def read_SegmentBlock(f):
 
     if line_data_count > 0:
         if get_block_data_type(block) == DATA_TYPE_CODE:
-            block.line_data = [ None ] * line_data_count
-            for i in xrange(line_data_count):
-                type_id = persistence.read_uint8(f)
-                if type_id == SLD_INSTRUCTION:
-                    block_offset = persistence.read_uint16(f)
-                    block.line_data[i] = (type_id, block_offset)
-                elif type_id == SLD_EQU_LOCATION_RELATIVE:
-                    block_offset = persistence.read_uint32(f)
-                    block.line_data[i] = (type_id, block_offset)
-                elif type_id in (SLD_COMMENT_TRAILING, SLD_COMMENT_FULL_LINE):
-                    text = persistence.read_string(f)
-                    block.line_data[i] = (type_id, text)
+            block.line_data = read_code_line_data(f, line_data_count)
     return block
 
+def read_code_line_data(f, line_data_count):
+    line_data = CodeLineData()
+    for i in xrange(line_data_count):
+        type_id = persistence.read_uint8(f)
+        if type_id == SLD_INSTRUCTION:
+            block_offset = persistence.read_uint16(f)
+            line_data.append(type_id, block_offset)
+        elif type_id == SLD_EQU_LOCATION_RELATIVE:
+            block_offset = persistence.read_uint32(f)
+            line_data.append(type_id, block_offset)
+        elif type_id in (SLD_COMMENT_TRAILING, SLD_COMMENT_FULL_LINE):
+            text = persistence.read_string(f)
+            line_data.append(type_id, text)
+    return line_data
+
+def write_code_line_data_columns(f, line_data):
+    """ Each column of the line data is written whole, so that instructions need not be decoded to lay out lines. """
+    line_data_count = len(line_data)
+    f.write(line_data.type_ids.tostring())
+    f.write(struct.pack("<%di" % line_data_count, *line_data.offsets))
+    f.write(line_data.lengths.tostring())
+    f.write(line_data.flags.tostring())
+    persistence.write_uint32(f, len(line_data.comments))
+    for idx in sorted(line_data.comments):
+        persistence.write_uint32(f, idx)
+        persistence.write_string(f, line_data.comments[idx])
+
+def read_code_line_data_columns(f, line_data_count):
+    line_data = CodeLineData()
+    line_data.type_ids.fromstring(f.read(line_data_count))
+    line_data.offsets.extend(struct.unpack("<%di" % line_data_count, f.read(line_data_count * 4)))
+    line_data.lengths.fromstring(f.read(line_data_count))
+    line_data.flags.fromstring(f.read(line_data_count))
+    for i in xrange(persistence.read_uint32(f)):
+        idx = persistence.read_uint32(f)
+        line_data.comments[idx] = persistence.read_string(f)
+    return line_data
+
+def get_SegmentBlock_header(block):
+    """ The persisted fields of the block, without reading in line data which is still deferred. """
+    if block.deferred_line_data is not None:
+        line_data_count = block.deferred_line_data[1][3]
+    else:
+        line_data_count = get_SegmentBlock_line_data_count(block)
+    return block.segment_id, block.segment_offset, block.address, block.length, block.flags, block.line_count, line_data_count
+
+def get_SegmentBlock_line_data_bytes(block, line_data_count):
+    if line_data_count == 0 or get_block_data_type(block) != DATA_TYPE_CODE:
+        return ""
+    if block.deferred_line_data is not None:
+        return get_deferred_line_data_bytes(block.deferred_line_data[1])
+    line_data_file = cStringIO.StringIO()
+    write_code_line_data_columns(line_data_file, block.line_data)
+    return line_data_file.getvalue()
+
+def get_deferred_line_data_bytes(location):
+    """ Line data still in the project file, is copied from it rather than read in to the block. """
+    project_data, line_data_offset, line_data_length, line_data_count, read_line_data_func = location
+    return project_data[line_data_offset:line_data_offset+line_data_length]
+
+def write_SegmentBlock_table(f, blocks, saved_blocks):
+    """ A fixed size entry for each block, then the line data of all the blocks, so that the line data can be read on first use. """
+    line_data_offset = 0
+    line_data_parts = []
+    persistence.write_uint32(f, len(blocks))
+    for block in blocks:
+        header = get_SegmentBlock_header(block)
+        line_data = get_SegmentBlock_line_data_bytes(block, header[-1])
+        f.write(struct.pack(SEGMENTBLOCK_TABLE_PACK_FORMAT, *(header + (line_data_offset, len(line_data)))))
+        line_data_offset += len(line_data)
+        line_data_parts.append(line_data)
+        saved_blocks[block.address] = header, line_data
+    persistence.write_uint32(f, line_data_offset)
+    for line_data in line_data_parts:
+        f.write(line_data)
+
+def read_SegmentBlock_table(f, program_data, project_data, read_line_data_func):
+    """ The line data of code blocks is left in the project file, to be read on first use. """
+    def read_line_data(block, location):
+        project_data, line_data_offset, line_data_length, line_data_count, read_line_data_func = location
+        block.line_data = read_line_data_func(cStringIO.StringIO(project_data[line_data_offset:line_data_offset+line_data_length]), line_data_count)
+        if program_data.deferred_line_data_func is not None:
+            program_data.deferred_line_data_func(program_data, block)
+        return block.line_data
+
+    unpack_from = struct.Struct(SEGMENTBLOCK_TABLE_PACK_FORMAT).unpack_from
+    entry_size = struct.calcsize(SEGMENTBLOCK_TABLE_PACK_FORMAT)
+    num_blocks = persistence.read_uint32(f)
+    table_data = f.read(num_blocks * entry_size)
+    line_data_section_length = persistence.read_uint32(f)
+    line_data_section_offset = f.tell()
+    f.seek(line_data_section_length, os.SEEK_CUR)
+
+    blocks = [ None ] * num_blocks
+    saved_blocks = program_data.saved_blocks
+    for i in xrange(num_blocks):
+        block = blocks[i] = SegmentBlock()
+        entry = unpack_from(table_data, i * entry_size)
+        block.segment_id, block.segment_offset, block.address, block.length, block.flags, block.line_count, line_data_count, line_data_offset, line_data_length = entry
+        line_data_offset += line_data_section_offset
+        if line_data_count > 0 and get_block_data_type(block) == DATA_TYPE_CODE:
+            if read_line_data_func is read_code_line_data_columns:
+                del block.line_data
+                block.deferred_line_data = read_line_data, (project_data, line_data_offset, line_data_length, line_data_count, read_line_data_func)
+            else:
+                # Line data saved without instruction lengths is read now, as its instructions are decoded on load.
+                block.line_data = read_line_data_func(cStringIO.StringIO(project_data[line_data_offset:line_data_offset+line_data_length]), line_data_count)
+        saved_blocks[block.address] = entry[:7], buffer(project_data, line_data_offset, line_data_length)
+    return blocks
+
 def read_segment_list(f):
     num_bytes = persistence.read_uint32(f)
     data_start_offset = f.tell()
@@ -100,15 +194,11 @@ def read_segment_list(f):
     return v
 
 def write_segment_list(f, v):
-    start_offset = f.tell()
-    persistence.write_uint32(f, 0)
-    data_start_offset = f.tell()
+    entries_file = cStringIO.StringIO()
     for entry in v:
-        write_segment_list_entry(f, entry)
-    end_offset = f.tell()
-    f.seek(start_offset, os.SEEK_SET)
-    persistence.write_uint32(f, end_offset - data_start_offset)
-    f.seek(end_offset, os.SEEK_SET)
+        write_segment_list_entry(entries_file, entry)
+    persistence.write_uint32(f, entries_file.tell())
+    f.write(entries_file.getvalue())
 
 def read_segment_list_entry(f):
     v = [ None ] * loaderlib.SIZEOF_SI
@@ -136,20 +226,37 @@ def write_segment_list_entry(f, v):
 SAVEFILE_ID = 0x5053504a
 SAVEFILE_VERSION = 3
 
+SAVEFILE_HUNK_TOC = 2000                   # Where each of the other hunks is in the file.
 SAVEFILE_HUNK_SOURCEDATA = 2001            # The entire source input file that the disassembly was created from.
 SAVEFILE_HUNK_SOURCEDATAINFO = 2002        # The metadata about the source input file.
 SAVEFILE_HUNK_LOADER = 2003                # Loader related data used by the disassembly logic.
 SAVEFILE_HUNK_LOADERINTERNAL = 2004        # Internal loader data.
 SAVEFILE_HUNK_DISASSEMBLY = 2005           # General disassembly state.
+SAVEFILE_HUNK_ANALYSIS = 2006              # The state of analysis still in progress, to be resumed.
+SAVEFILE_HUNK_JOURNAL = 2007               # What changed since the preceding hunks were saved.
+
+# Journals are folded back in by a full save, once they grow past this fraction of the file size.
+JOURNAL_COMPACTION_RATIO = 0.25
 
 CURRENT_HUNK_VERSIONS = {
+    SAVEFILE_HUNK_TOC: 1,
     SAVEFILE_HUNK_SOURCEDATA: 1,
     SAVEFILE_HUNK_SOURCEDATAINFO: 1,
-    SAVEFILE_HUNK_LOADER: 1,
-    SAVEFILE_HUNK_LOADERINTERNAL: 1,
-    SAVEFILE_HUNK_DISASSEMBLY: 1,
+    SAVEFILE_HUNK_LOADER: 3,            # 2: Sorted address sets are delta encoded.  3: Relocations.
+    SAVEFILE_HUNK_LOADERINTERNAL: 2,    # 2: Fields declared by the system, rather than pickled.
+    SAVEFILE_HUNK_DISASSEMBLY: 4,       # 2: Cross references are packed into arrays.  3: Sections are sized and blocks are tabled, to be read on first use.  4: Instruction lengths and flags.
+    SAVEFILE_HUNK_ANALYSIS: 2,          # 2: Sorted address sets are delta encoded.
+    SAVEFILE_HUNK_JOURNAL: 2,           # 2: Instruction lengths and flags.
 }
 
+# Set in the version of a hunk, when the hunk data that follows the version is zlib compressed.
+HUNK_VERSION_FLAG_COMPRESSED = 0x8000
+# How much of a compressed hunk is read in and decompressed at a time.
+COMPRESSED_CHUNK_SIZE = 256 * 1024
+
+# Hunk id, hunk data offset, hunk data length.
+TOC_ENTRY_PACK_FORMAT = "<HII"
+
 # 4: Save file ID.
 # 4: Save file version.
 # ...
@@ -163,7 +270,8 @@ def check_is_project_file(f):
     f.seek(0, os.SEEK_SET)
     return persistence.read_uint32(f) == SAVEFILE_ID
 
-def save_project(f, program_data, save_options):
+def save_project(f, program_data, save_options, work_state=None):
+    """ Returns False if the save was cancelled, leaving the file incomplete. """
     f.seek(0, os.SEEK_SET)
 
     persistence.write_uint32(f, SAVEFILE_ID)
@@ -172,61 +280,237 @@ def save_project(f, program_data, save_options):
     persistence.write_uint32(f, program_data.save_count)
 
     # The input file / source data is saved in the first hunk, so we can skip repersisting it in subsequent saves to the same file.
-    for hunk_id in (SAVEFILE_HUNK_SOURCEDATA, SAVEFILE_HUNK_SOURCEDATAINFO, SAVEFILE_HUNK_LOADER, SAVEFILE_HUNK_LOADERINTERNAL, SAVEFILE_HUNK_DISASSEMBLY):
+    hunk_ids = []
+    for hunk_id in (SAVEFILE_HUNK_SOURCEDATA, SAVEFILE_HUNK_SOURCEDATAINFO, SAVEFILE_HUNK_LOADER, SAVEFILE_HUNK_LOADERINTERNAL, SAVEFILE_HUNK_DISASSEMBLY, SAVEFILE_HUNK_ANALYSIS):
         if SAVEFILE_HUNK_SOURCEDATA == hunk_id and save_options.input_file is None:
             continue
-
-        persistence.write_uint16(f, hunk_id)
-        # Remember the hunk length offset and write a dummy value.
-        length_offset = f.tell()
-        persistence.write_uint32(f, 0)
-        hunk_data_offset = f.tell()
-        persistence.write_uint16(f, CURRENT_HUNK_VERSIONS[hunk_id])
+        if SAVEFILE_HUNK_ANALYSIS == hunk_id and program_data.code_analysis is None:
+            continue
+        hunk_ids.append(hunk_id)
+
+    # The table of contents precedes the hunks it locates, so is filled in after they are written.
+    persistence.write_uint16(f, SAVEFILE_HUNK_TOC)
+    toc_entry_size = struct.calcsize(TOC_ENTRY_PACK_FORMAT)
+    persistence.write_uint32(f, 2 + 4 + len(hunk_ids) * toc_entry_size)
+    persistence.write_uint16(f, CURRENT_HUNK_VERSIONS[SAVEFILE_HUNK_TOC])
+    persistence.write_uint32(f, len(hunk_ids))
+    toc_entries_offset = f.tell()
+    f.write("\0" * (len(hunk_ids) * toc_entry_size))
+
+    hunk_locations = []
+    compress = save_options.compress_hunks
+    for i, hunk_id in enumerate(hunk_ids):
+        if work_state is not None and work_state.check_exit_update(i / float(len(hunk_ids)), "TEXT_SAVE_WRITING_PROJECT_DATA"):
+            return False
         if SAVEFILE_HUNK_DISASSEMBLY == hunk_id:
-            save_disassembly_hunk(f, program_data)
+            hunk_location = write_hunk(f, hunk_id, compress, save_disassembly_hunk, program_data)
+        elif SAVEFILE_HUNK_ANALYSIS == hunk_id:
+            hunk_location = write_hunk(f, hunk_id, compress, save_analysis_hunk, program_data)
         elif SAVEFILE_HUNK_LOADER == hunk_id:
-            save_loader_hunk(f, program_data)
+            hunk_location = write_hunk(f, hunk_id, compress, save_loader_hunk, program_data)
         elif SAVEFILE_HUNK_LOADERINTERNAL == hunk_id:
-            save_loaderinternaldata_hunk(f, program_data)
+            hunk_location = write_hunk(f, hunk_id, compress, save_loaderinternaldata_hunk, program_data)
         elif SAVEFILE_HUNK_SOURCEDATAINFO == hunk_id:
-            save_sourcedatainfo_hunk(f, program_data)
+            hunk_location = write_hunk(f, hunk_id, compress, save_sourcedatainfo_hunk, program_data)
         elif SAVEFILE_HUNK_SOURCEDATA == hunk_id:
-            save_sourcedata_hunk(f, program_data, save_options.input_file)
+            hunk_location = write_hunk(f, hunk_id, compress, save_sourcedata_hunk, program_data, save_options.input_file)
         else:
             raise RuntimeError("Trying to save a hunk with no handling to do so")
-        hunk_length = f.tell() - hunk_data_offset
-        # Go back and fill in the hunk length field.
-        f.seek(length_offset, os.SEEK_SET)
-        persistence.write_uint32(f, hunk_length)
-        # Return to the end of the hunk to perhaps write the next.
-        f.seek(hunk_length, os.SEEK_CUR)
+        hunk_locations.append(hunk_location)
+
+    end_offset = f.tell()
+    f.seek(toc_entries_offset, os.SEEK_SET)
+    for hunk_location in hunk_locations:
+        f.write(struct.pack(TOC_ENTRY_PACK_FORMAT, *hunk_location))
+    f.seek(end_offset, os.SEEK_SET)
 
+    program_data.input_file_cached = save_options.input_file is not None
+    program_data.unsaved_symbol_addresses = set()
+    program_data.unsaved_branch_addresses = set()
+    program_data.unsaved_reference_addresses = set()
+    program_data.journal_length = 0
     logger.info("Saved project (%d bytes)", f.tell())
+    return True
+
+def write_hunk(f, hunk_id, compress, save_func, *args):
+    """ Returns the hunk id, and the offset and length of the hunk data. """
+    persistence.write_uint16(f, hunk_id)
+    # Remember the hunk length offset and write a dummy value.
+    length_offset = f.tell()
+    persistence.write_uint32(f, 0)
+    hunk_data_offset = f.tell()
+    with util.trace_span("save_hunk", hunk_id=hunk_id):
+        if compress:
+            persistence.write_uint16(f, CURRENT_HUNK_VERSIONS[hunk_id] | HUNK_VERSION_FLAG_COMPRESSED)
+            compressed_f = CompressedHunkWriter(f)
+            save_func(compressed_f, *args)
+            compressed_f.flush()
+        else:
+            persistence.write_uint16(f, CURRENT_HUNK_VERSIONS[hunk_id])
+            save_func(f, *args)
+    hunk_length = f.tell() - hunk_data_offset
+    # Go back and fill in the hunk length field.
+    f.seek(length_offset, os.SEEK_SET)
+    persistence.write_uint32(f, hunk_length)
+    # Return to the end of the hunk to perhaps write the next.
+    f.seek(hunk_length, os.SEEK_CUR)
+    return hunk_id, hunk_data_offset, hunk_length
+
+class CompressedHunkWriter(object):
+    """ Compresses the hunk data as it is written, so that hunk saving functions can only write. """
+    def __init__(self, f):
+        self.f = f
+        self.compressor = zlib.compressobj()
+
+    def write(self, data):
+        self.f.write(self.compressor.compress(data))
+
+    def flush(self):
+        self.f.write(self.compressor.flush())
+
+def read_compressed_hunk_data(f, length):
+    """ Decompresses the hunk data a chunk at a time, as it is read in. """
+    decompressor = zlib.decompressobj()
+    data_parts = []
+    while length > 0:
+        data = f.read(min(length, COMPRESSED_CHUNK_SIZE))
+        if not len(data):
+            break
+        length -= len(data)
+        data_parts.append(decompressor.decompress(data))
+    data_parts.append(decompressor.flush())
+    return "".join(data_parts)
+
+def save_project_journal(f, program_data):
+    """
+    Appends a journal hunk with what changed since the project file was last saved or loaded.  Returns
+    False if the file has since been saved by something else, or the journals have grown enough that
+    a full save should fold them back in.
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    f.seek(0, os.SEEK_SET)
+    if file_size < 10 or persistence.read_uint32(f) != SAVEFILE_ID or persistence.read_uint16(f) != SAVEFILE_VERSION:
+        return False
+    if persistence.read_uint32(f) != program_data.save_count:
+        return False
+    if program_data.journal_length > file_size * JOURNAL_COMPACTION_RATIO:
+        return False
+
+    f.seek(0, os.SEEK_END)
+    hunk_id, hunk_data_offset, hunk_length = write_hunk(f, SAVEFILE_HUNK_JOURNAL, False, save_journal_hunk, program_data)
+    program_data.journal_length += hunk_length
+    program_data.save_count += 1
+    f.seek(4 + 2, os.SEEK_SET)
+    persistence.write_uint32(f, program_data.save_count)
+    logger.info("Saved project journal (%d bytes)", hunk_length)
+    return True
 
 
 def save_disassembly_hunk(f, program_data):
-    persistence.write_dict_uint32_to_set_of_uint32s(f, program_data.branch_addresses)
-    persistence.write_dict_uint32_to_set_of_uint32s(f, program_data.reference_addresses)
-    persistence.write_dict_uint32_to_string(f, program_data.symbols_by_address)
+    write_sized_section(f, persistence.write_packed_dict_uint32_to_set_of_uint32s, program_data.branch_addresses)
+    write_sized_section(f, persistence.write_packed_dict_uint32_to_set_of_uint32s, program_data.reference_addresses)
+    write_sized_section(f, persistence.write_dict_uint32_to_string, program_data.symbols_by_address)
     persistence.write_dict_uint32_to_list_of_uint32s(f, program_data.post_segment_addresses)
     persistence.write_uint32(f, program_data.flags)
     persistence.write_string(f, program_data.dis_name)
 
-    persistence.write_uint32(f, len(program_data.blocks))
+    program_data.saved_blocks = {}
+    write_SegmentBlock_table(f, program_data.blocks, program_data.saved_blocks)
+
+def save_journal_hunk(f, program_data):
+    symbols_by_address = program_data.symbols_by_address
+    persistence.write_dict_uint32_to_string(f, dict((address, symbols_by_address[address]) for address in program_data.unsaved_symbol_addresses))
+    branch_addresses = program_data.branch_addresses
+    persistence.write_packed_dict_uint32_to_set_of_uint32s(f, dict((address, branch_addresses[address]) for address in program_data.unsaved_branch_addresses))
+    reference_addresses = program_data.reference_addresses
+    persistence.write_packed_dict_uint32_to_set_of_uint32s(f, dict((address, reference_addresses[address]) for address in program_data.unsaved_reference_addresses))
+    persistence.write_dict_uint32_to_list_of_uint32s(f, program_data.post_segment_addresses)
+    persistence.write_uint32(f, program_data.flags)
+
+    saved_blocks = program_data.saved_blocks
+    changed_blocks = []
     for block in program_data.blocks:
-        write_SegmentBlock(f, block)
+        saved_block = saved_blocks.get(block.address)
+        if saved_block is not None and saved_block[0] == get_SegmentBlock_header(block):
+            # Line data still in the project file is unchanged.
+            if block.deferred_line_data is not None:
+                continue
+            if get_SegmentBlock_line_data_bytes(block, saved_block[0][-1]) == str(saved_block[1]):
+                continue
+        changed_blocks.append(block)
+    block_addresses = set(program_data.block_addresses)
+    removed_block_addresses = [ address for address in saved_blocks if address not in block_addresses ]
+    for address in removed_block_addresses:
+        del saved_blocks[address]
+    persistence.write_sorted_uint32s(f, removed_block_addresses)
+    write_SegmentBlock_table(f, changed_blocks, saved_blocks)
+
+    program_data.unsaved_symbol_addresses.clear()
+    program_data.unsaved_branch_addresses.clear()
+    program_data.unsaved_reference_addresses.clear()
+
+def write_sized_section(f, write_func, value):
+    """ The section is preceded by its length, so that it can be skipped and read on first use. """
+    section_file = cStringIO.StringIO()
+    write_func(section_file, value)
+    persistence.write_uint32(f, section_file.tell())
+    f.write(section_file.getvalue())
+
+def defer_sized_section(f, program_data, attr_name, read_func, project_data):
+    section_length = persistence.read_uint32(f)
+    section_offset = f.tell()
+    f.seek(section_length, os.SEEK_CUR)
+    delattr(program_data, attr_name)
+    program_data.deferred_attributes[attr_name] = lambda: read_func(cStringIO.StringIO(project_data[section_offset:section_offset+section_length]))
+
+def save_analysis_hunk(f, program_data):
+    analysis = program_data.code_analysis
+    persistence.write_sorted_uint32s(f, analysis.disassembly_offsets)
+    persistence.write_sorted_uint32s(f, analysis.pending_symbol_addresses)
+    persistence.write_sorted_uint32s(f, analysis.debug_offsets)
+    persistence.write_array_of_uint32s(f, analysis.symbol_addresses)
 
 def save_loader_hunk(f, program_data):
     persistence.write_string(f, program_data.loader_system_name)
     write_segment_list(f, program_data.loader_segments)
-    persistence.write_set_of_uint32s(f, program_data.loader_relocated_addresses)
-    persistence.write_set_of_uint32s(f, program_data.loader_relocatable_addresses)
+    persistence.write_sorted_uint32s(f, program_data.loader_relocated_addresses)
+    persistence.write_sorted_uint32s(f, program_data.loader_relocatable_addresses)
     persistence.write_uint16(f, program_data.loader_entrypoint_segment_id)
     persistence.write_uint32(f, program_data.loader_entrypoint_offset)
+    write_relocations(f, program_data.loader_relocations)
+
+def write_relocations(f, relocations):
+    """ Projects saved before relocations were persisted, have none to save.
+        Offsets keep their table order, as overlapping longwords are relocated in that order. """
+    if relocations is None:
+        persistence.write_uint8(f, 0)
+        return
+    persistence.write_uint8(f, 1)
+    persistence.write_uint16(f, len(relocations))
+    for segment_relocations in relocations:
+        persistence.write_uint16(f, len(segment_relocations))
+        for target_segment_id, local_offsets in segment_relocations:
+            persistence.write_uint16(f, target_segment_id)
+            persistence.write_array_of_uint32s(f, local_offsets)
+
+def read_relocations(f):
+    if persistence.read_uint8(f) == 0:
+        return None
+    relocations = []
+    for i in xrange(persistence.read_uint16(f)):
+        segment_relocations = []
+        for j in xrange(persistence.read_uint16(f)):
+            target_segment_id = persistence.read_uint16(f)
+            segment_relocations.append((target_segment_id, list(persistence.read_array_of_uint32s(f))))
+        relocations.append(segment_relocations)
+    return relocations
 
 def save_loaderinternaldata_hunk(f, program_data):
+    # Systems declare the uint32 fields of each entry of the data they persist, if any.
     system = loaderlib.get_system(program_data.loader_system_name)
-    system.save_project_data(f, program_data.loader_internal_data)
+    if system.project_data_fields is not None:
+        persistence.write_array_of_uint32s(f, [ value for entry in program_data.loader_internal_data for value in entry ])
 
 def save_sourcedatainfo_hunk(f, program_data):
     persistence.write_uint32(f, program_data.file_size)
@@ -286,7 +570,7 @@ def convert_project_format_2_to_3(input_file):
         persistence.write_uint32(output_file, 0)
         output_data_offset = output_file.tell()
         # Modification.
-        persistence.write_uint16(output_file, CURRENT_HUNK_VERSIONS[hunk_id])
+        persistence.write_uint16(output_file, SNAPSHOT_HUNK_VERSIONS[hunk_id])
 
         input_data = input_file.read(input_hunk_length)
         output_file.write(input_data)
@@ -327,32 +611,52 @@ def load_project(f, work_state=None):
 
     program_data = ProgramData()
     program_data.save_count = persistence.read_uint32(f)
+    project_data = get_project_data(f)
 
-    sourcedata_offset = sourcedata_length = None
-    while f.tell() < file_size:
-        if work_state is not None and work_state.check_exit_update(0.1 + 0.8 * (file_size-f.tell()), "TEXT_LOAD_READING_PROJECT_DATA"):
+    sourcedata_file = sourcedata_offset = sourcedata_length = None
+    for hunk_id, offset0, hunk_length in read_hunk_locations(f, file_size):
+        if work_state is not None and work_state.check_exit_update(0.1 + 0.8 * (file_size-offset0), "TEXT_LOAD_READING_PROJECT_DATA"):
             return None
 
-        hunk_id = persistence.read_uint16(f)
-        hunk_length = persistence.read_uint32(f)
+        f.seek(offset0, os.SEEK_SET)
         expected_hunk_version = CURRENT_HUNK_VERSIONS[hunk_id]
-        offset0 = f.tell()
         actual_hunk_version = persistence.read_uint16(f)
-        if SAVEFILE_HUNK_DISASSEMBLY == hunk_id:
-            load_disassembly_hunk(f, program_data)
-        elif SAVEFILE_HUNK_LOADER == hunk_id:
-            load_loader_hunk(f, program_data)
-        elif SAVEFILE_HUNK_LOADERINTERNAL == hunk_id:
-            load_loaderinternaldata_hunk(f, program_data)
-        elif SAVEFILE_HUNK_SOURCEDATAINFO == hunk_id:
-            load_sourcedatainfo_hunk(f, program_data)
-        elif SAVEFILE_HUNK_SOURCEDATA == hunk_id:
-            skip_bytes = (f.tell() - offset0)
-            sourcedata_offset, sourcedata_length = offset0 + skip_bytes, hunk_length - skip_bytes 
-            f.seek(sourcedata_length, os.SEEK_CUR)
-        else:
-            logger.error("load_project encountered unknown hunk, with id: %d", hunk_id)
-            return None
+        with util.trace_span("load_hunk", hunk_id=hunk_id):
+            # Compressed hunks are read from their decompressed data, uncompressed hunks from the project file.
+            if actual_hunk_version & HUNK_VERSION_FLAG_COMPRESSED:
+                actual_hunk_version &= ~HUNK_VERSION_FLAG_COMPRESSED
+                hunk_data = read_compressed_hunk_data(f, hunk_length - 2)
+                hunk_f, hunk_project_data = cStringIO.StringIO(hunk_data), hunk_data
+            else:
+                hunk_f, hunk_project_data = f, project_data
+
+            if SAVEFILE_HUNK_DISASSEMBLY == hunk_id:
+                load_disassembly_hunk(hunk_f, program_data, actual_hunk_version, hunk_project_data)
+            elif SAVEFILE_HUNK_ANALYSIS == hunk_id:
+                load_analysis_hunk(hunk_f, program_data, actual_hunk_version)
+            elif SAVEFILE_HUNK_JOURNAL == hunk_id:
+                load_journal_hunk(hunk_f, program_data, actual_hunk_version, hunk_project_data)
+                program_data.journal_length += hunk_length
+            elif SAVEFILE_HUNK_LOADER == hunk_id:
+                load_loader_hunk(hunk_f, program_data, actual_hunk_version)
+            elif SAVEFILE_HUNK_LOADERINTERNAL == hunk_id:
+                load_loaderinternaldata_hunk(hunk_f, program_data, actual_hunk_version)
+            elif SAVEFILE_HUNK_SOURCEDATAINFO == hunk_id:
+                load_sourcedatainfo_hunk(hunk_f, program_data)
+            elif SAVEFILE_HUNK_SOURCEDATA == hunk_id:
+                sourcedata_file = hunk_f
+                if hunk_f is f:
+                    sourcedata_offset = f.tell()
+                    sourcedata_length = hunk_length - (sourcedata_offset - offset0)
+                    f.seek(sourcedata_length, os.SEEK_CUR)
+                    # Larger segments can then be read from the mapped project file, rather than copied.
+                    if type(project_data) is mmap.mmap:
+                        sourcedata_file = loaderlib.IngestedFile(project_data, None)
+                else:
+                    sourcedata_offset, sourcedata_length = 0, len(hunk_data)
+            else:
+                logger.error("load_project encountered unknown hunk, with id: %d", hunk_id)
+                return None
 
         offsetN = f.tell()
         if offsetN - offset0 != hunk_length:
@@ -366,53 +670,173 @@ def load_project(f, work_state=None):
         logger.info("Caching input file segments from embedded source file.")
         segments = program_data.loader_segments
         for i in range(len(segments)):
-            loaderlib.cache_segment_data(f, segments, i, sourcedata_offset)
+            with util.trace_span("loaderlib.cache_segment_data", segment_id=i):
+                loaderlib.cache_segment_data(sourcedata_file, segments, i, sourcedata_offset, map_data=True)
+        if program_data.loader_relocations is not None:
+            # The relocated and relocatable addresses were saved, only the segment data needs relocating.
+            with util.trace_span("loaderlib.relocate_segment_data"):
+                loaderlib.relocate_segment_data(segments, program_data.loader_data_types, program_data.loader_relocations, None, None)
         # Avoid doing relocations if there weren't any.   e.g. binary files.
-        if len(program_data.loader_relocatable_addresses):
+        elif len(program_data.loader_relocatable_addresses):
             logger.info("Re-extracting relocations from embedded source file.")
-            file_info, data_types = loaderlib.load_file(f, None, file_offset=sourcedata_offset, file_length=sourcedata_length)
-            loaderlib.relocate_segment_data(segments, data_types, file_info.relocations_by_segment_id, program_data.loader_relocatable_addresses, program_data.loader_relocated_addresses)
+            with util.trace_span("loaderlib.load_file"):
+                file_info, data_types = loaderlib.load_file(sourcedata_file, None, file_offset=sourcedata_offset, file_length=sourcedata_length)
+            with util.trace_span("loaderlib.relocate_segment_data"):
+                loaderlib.relocate_segment_data(segments, data_types, file_info.relocations_by_segment_id, program_data.loader_relocatable_addresses, program_data.loader_relocated_addresses)
+            program_data.loader_relocations = file_info.relocations_by_segment_id
         program_data.input_file_cached = True
 
     logger.info("Project loaded")
     return program_data
 
-def load_disassembly_hunk(f, program_data):
-    program_data.branch_addresses = persistence.read_dict_uint32_to_set_of_uint32s(f)
-    program_data.reference_addresses = persistence.read_dict_uint32_to_set_of_uint32s(f)
-    program_data.symbols_by_address = persistence.read_dict_uint32_to_string(f)
+def get_project_data(f):
+    """ The project file contents, mapped into memory if possible, for reading the parts read on first use. """
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError):
+        offset = f.tell()
+        f.seek(0, os.SEEK_SET)
+        data = f.read()
+        f.seek(offset, os.SEEK_SET)
+        return data
+
+def read_hunk_locations(f, file_size):
+    """
+    Returns (hunk id, data offset, data length) for each hunk, from the table of contents if there is one.
+    Journal hunks appended after the hunks listed in the table of contents are found by walking them.
+    """
+    hunk_locations = []
+    while f.tell() < file_size:
+        hunk_id = persistence.read_uint16(f)
+        hunk_length = persistence.read_uint32(f)
+        if SAVEFILE_HUNK_TOC == hunk_id:
+            hunk_version = persistence.read_uint16(f)
+            toc_entry_size = struct.calcsize(TOC_ENTRY_PACK_FORMAT)
+            for i in xrange(persistence.read_uint32(f)):
+                hunk_locations.append(struct.unpack(TOC_ENTRY_PACK_FORMAT, f.read(toc_entry_size)))
+            if hunk_locations:
+                f.seek(max(offset + length for (hunk_id, offset, length) in hunk_locations), os.SEEK_SET)
+            continue
+        hunk_locations.append((hunk_id, f.tell(), hunk_length))
+        f.seek(hunk_length, os.SEEK_CUR)
+    return hunk_locations
+
+def read_deferred_data(program_data):
+    """ Read in what is still left in the project file, so that the file can be overwritten. """
+    for attr_name in program_data.deferred_attributes.keys():
+        getattr(program_data, attr_name)
+    for block in program_data.blocks:
+        if block.deferred_line_data is not None:
+            getattr(block, "line_data")
+    loaderlib.copy_segment_data(program_data.loader_segments)
+    # What was saved is about to be overwritten.
+    program_data.saved_blocks = None
+
+def load_disassembly_hunk(f, program_data, hunk_version, project_data):
+    if hunk_version == 1:
+        program_data.branch_addresses = persistence.read_dict_uint32_to_set_of_uint32s(f)
+        program_data.reference_addresses = persistence.read_dict_uint32_to_set_of_uint32s(f)
+        program_data.symbols_by_address = persistence.read_dict_uint32_to_string(f)
+    elif hunk_version == 2:
+        program_data.branch_addresses = persistence.read_packed_dict_uint32_to_set_of_uint32s(f)
+        program_data.reference_addresses = persistence.read_packed_dict_uint32_to_set_of_uint32s(f)
+        program_data.symbols_by_address = persistence.read_dict_uint32_to_string(f)
+    else:
+        defer_sized_section(f, program_data, "branch_addresses", persistence.read_packed_dict_uint32_to_set_of_uint32s, project_data)
+        defer_sized_section(f, program_data, "reference_addresses", persistence.read_packed_dict_uint32_to_set_of_uint32s, project_data)
+        defer_sized_section(f, program_data, "symbols_by_address", persistence.read_dict_uint32_to_string, project_data)
     program_data.post_segment_addresses = persistence.read_dict_uint32_to_list_of_uint32s(f)
     program_data.flags = persistence.read_uint32(f)
     program_data.dis_name = persistence.read_string(f)
 
     # Reconstitute the segment block list.
-    num_blocks = persistence.read_uint32(f)
-    program_data.blocks = [ None ] * num_blocks
-    for i in xrange(num_blocks):
-        program_data.blocks[i] = read_SegmentBlock(f)
+    if hunk_version < 3:
+        num_blocks = persistence.read_uint32(f)
+        program_data.blocks = [ None ] * num_blocks
+        for i in xrange(num_blocks):
+            program_data.blocks[i] = read_SegmentBlock(f)
+    else:
+        program_data.saved_blocks = {}
+        read_line_data_func = read_code_line_data if hunk_version == 3 else read_code_line_data_columns
+        program_data.blocks = read_SegmentBlock_table(f, program_data, project_data, read_line_data_func)
 
     ## POST PROCESSING
-    # Rebuild the segment block list indexing lists.
-    program_data.block_addresses = [ 0 ] * num_blocks
+    rebuild_block_indexes(program_data)
+
+def rebuild_block_indexes(program_data):
+    """ Rebuild the segment block list indexing lists. """
+    program_data.block_addresses = array.array("l", (block.address for block in program_data.blocks))
     program_data.block_line0s_dirtyidx = 0
-    program_data.block_line0s = program_data.block_addresses[:]
-    for i in xrange(num_blocks):
-        program_data.block_addresses[i] = program_data.blocks[i].address
+    program_data.block_line0s = array.array("l", [ 0 ]) * len(program_data.blocks)
+
+def merge_deferred_attribute(program_data, attr_name, changes):
+    if attr_name in program_data.deferred_attributes:
+        read_func = program_data.deferred_attributes[attr_name]
+        def read_merged_func():
+            value = read_func()
+            value.update(changes)
+            return value
+        program_data.deferred_attributes[attr_name] = read_merged_func
+    else:
+        getattr(program_data, attr_name).update(changes)
 
-def load_loader_hunk(f, program_data):
+def load_journal_hunk(f, program_data, hunk_version, project_data):
+    merge_deferred_attribute(program_data, "symbols_by_address", persistence.read_dict_uint32_to_string(f))
+    merge_deferred_attribute(program_data, "branch_addresses", persistence.read_packed_dict_uint32_to_set_of_uint32s(f))
+    merge_deferred_attribute(program_data, "reference_addresses", persistence.read_packed_dict_uint32_to_set_of_uint32s(f))
+    program_data.post_segment_addresses = persistence.read_dict_uint32_to_list_of_uint32s(f)
+    program_data.flags = persistence.read_uint32(f)
+
+    removed_block_addresses = set(persistence.read_sorted_uint32s(f))
+    for address in removed_block_addresses:
+        del program_data.saved_blocks[address]
+    read_line_data_func = read_code_line_data if hunk_version == 1 else read_code_line_data_columns
+    changed_blocks = read_SegmentBlock_table(f, program_data, project_data, read_line_data_func)
+    removed_block_addresses.update(block.address for block in changed_blocks)
+    blocks = [ block for block in program_data.blocks if block.address not in removed_block_addresses ]
+    blocks.extend(changed_blocks)
+    blocks.sort(key=lambda block: block.address)
+    program_data.blocks = blocks
+    rebuild_block_indexes(program_data)
+
+def load_analysis_hunk(f, program_data, hunk_version):
+    analysis = program_data.code_analysis = CodeAnalysisState()
+    if hunk_version == 1:
+        analysis.disassembly_offsets = persistence.read_set_of_uint32s(f)
+        analysis.pending_symbol_addresses = persistence.read_set_of_uint32s(f)
+        analysis.debug_offsets = persistence.read_set_of_uint32s(f)
+        analysis.symbol_addresses = list(persistence.read_set_of_uint32s(f))
+    else:
+        analysis.disassembly_offsets = set(persistence.read_sorted_uint32s(f))
+        analysis.pending_symbol_addresses = set(persistence.read_sorted_uint32s(f))
+        analysis.debug_offsets = set(persistence.read_sorted_uint32s(f))
+        analysis.symbol_addresses = list(persistence.read_array_of_uint32s(f))
+
+def load_loader_hunk(f, program_data, hunk_version):
     program_data.loader_system_name = persistence.read_string(f)
     program_data.loader_segments = read_segment_list(f)
-    program_data.loader_relocated_addresses = persistence.read_set_of_uint32s(f)
-    program_data.loader_relocatable_addresses = persistence.read_set_of_uint32s(f)
+    if hunk_version == 1:
+        program_data.loader_relocated_addresses = persistence.read_set_of_uint32s(f)
+        program_data.loader_relocatable_addresses = persistence.read_set_of_uint32s(f)
+    else:
+        program_data.loader_relocated_addresses = set(persistence.read_sorted_uint32s(f))
+        program_data.loader_relocatable_addresses = set(persistence.read_sorted_uint32s(f))
     program_data.loader_entrypoint_segment_id = persistence.read_uint16(f)
     program_data.loader_entrypoint_offset = persistence.read_uint32(f)
+    if hunk_version >= 3:
+        program_data.loader_relocations = read_relocations(f)
 
     ## POST PROCESSING
     program_data.loader_data_types = loaderlib.get_system_data_types(program_data.loader_system_name)
 
-def load_loaderinternaldata_hunk(f, program_data):
+def load_loaderinternaldata_hunk(f, program_data, hunk_version):
     system = loaderlib.get_system(program_data.loader_system_name)
-    program_data.loader_internal_data = system.load_project_data(f)
+    if hunk_version == 1:
+        program_data.loader_internal_data = system.load_pickled_project_data(f)
+    elif system.project_data_fields is not None:
+        values = persistence.read_array_of_uint32s(f)
+        field_count = len(system.project_data_fields)
+        program_data.loader_internal_data = [ values[i:i+field_count] for i in xrange(0, len(values), field_count) ]
 
 def load_sourcedatainfo_hunk(f, program_data):
     program_data.file_size = persistence.read_uint32(f)
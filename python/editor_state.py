@@ -113,7 +113,8 @@ class ClientAPI(object):
     def event_tick(self, active_client):
         raise NotImplementedError
 
-    def event_prolonged_action(self, active_client, title_msg_id, description_msg_id, can_cancel, step_count, abort_callback):
+    def event_prolonged_action(self, active_client, title_msg_id, description_msg_id, can_cancel, step_count, abort_callback, is_modal=True):
+        """ Actions which are not modal, leave the user able to keep working while they are done. """
         raise NotImplementedError
 
     def event_prolonged_action_update(self, active_client, description_msg_id, step_number):
@@ -160,6 +161,8 @@ class EditorState(object):
     STATE_LOADING = 1
     STATE_LOADED = 2
 
+    in_prolonged_action = False
+
     def __init__(self):
         self.worker_thread = WorkerThread()
         self.clients = weakref.WeakSet()
@@ -198,24 +201,35 @@ class EditorState(object):
         # Remove keywork arguments meant to customise the call.
         step_count = kwargs.pop("step_count", 100)
         can_cancel = kwargs.pop("can_cancel", True)
+        is_modal = kwargs.pop("is_modal", True)
 
         work_state = kwargs["work_state"] = WorkState()
         def cancel_callback():
             work_state.cancel()
         # Notify clients the action is starting.
         for client in self.clients:
-            client.event_prolonged_action(client is acting_client, title_msg_id, description_msg_id, can_cancel, step_count, cancel_callback)
+            client.event_prolonged_action(client is acting_client, title_msg_id, description_msg_id, can_cancel, step_count, cancel_callback, is_modal)
         # Start the work and periodically check for it's completion, or cancellation.
-        completed_event = self.worker_thread.add_work(f, *args, **kwargs)
-        last_completeness, last_description = None, None
-        t0 = time.time()
-        while not completed_event.wait(0.1) and not work_state.is_cancelled():
-            work_completeness, work_description = work_state.get_completeness(), work_state.get_description()
-            for client in self.clients:
-                if work_completeness != last_completeness or work_description != last_description:
-                    client.event_prolonged_action_update(client is acting_client, work_description, step_count * work_completeness)
-                client.event_tick(client is acting_client)
-            last_completeness, last_description = work_completeness, work_description
+        # Actions which are not modal, may have others started within them.
+        was_in_prolonged_action = self.in_prolonged_action
+        self.in_prolonged_action = True
+        try:
+            completed_event = self.worker_thread.add_work(f, *args, **kwargs)
+            last_completeness, last_description = None, None
+            t0 = time.time()
+            while not completed_event.wait(0.1) and not work_state.is_cancelled():
+                work_completeness, work_description = work_state.get_completeness(), work_state.get_description()
+                for client in self.clients:
+                    if work_completeness != last_completeness or work_description != last_description:
+                        client.event_prolonged_action_update(client is acting_client, work_description, step_count * work_completeness)
+                    client.event_tick(client is acting_client)
+                last_completeness, last_description = work_completeness, work_description
+            # Work that is cancelled stops at a consistent point, and may return what it has done so far.
+            if work_state.is_cancelled():
+                while not completed_event.wait(0.1) and self.worker_thread.is_alive():
+                    pass
+        finally:
+            self.in_prolonged_action = was_in_prolonged_action
         # Notify clients the action is completed.
         for client in self.clients:
             client.event_prolonged_action_complete(client is acting_client)
@@ -408,11 +422,17 @@ class EditorState(object):
         for client in self.clients:
             client.event_uncertain_reference_modification(client is acting_client, data_type_from, data_type_to, address, length)
 
-    def get_uncertain_code_references(self, acting_client):
-        return disassembly.get_uncertain_code_references(self.disassembly_data)
+    def get_uncertain_code_references(self, acting_client, offset=0, limit=None):
+        return disassembly.get_uncertain_code_references(self.disassembly_data, offset, limit)
+
+    def get_uncertain_code_reference_count(self, acting_client):
+        return disassembly.get_uncertain_code_reference_count(self.disassembly_data)
+
+    def get_uncertain_data_references(self, acting_client, offset=0, limit=None):
+        return disassembly.get_uncertain_data_references(self.disassembly_data, offset, limit)
 
-    def get_uncertain_data_references(self, acting_client):
-        return disassembly.get_uncertain_data_references(self.disassembly_data)
+    def get_uncertain_data_reference_count(self, acting_client):
+        return disassembly.get_uncertain_data_reference_count(self.disassembly_data)
 
     def get_uncertain_references_by_address(self, acting_client, address):
         return disassembly.get_uncertain_references_by_address(self.disassembly_data, address)
@@ -483,6 +503,30 @@ class EditorState(object):
             return ERRMSG_BUG_UNKNOWN_ADDRESS
         self._set_data_type(acting_client, address, disassembly_data.DATA_TYPE_ASCII)
 
+    def find_ascii_strings(self, acting_client, segment_id=None):
+        if self.state_id != EditorState.STATE_LOADED:
+            return ERRMSG_TODO_BAD_STATE_FUNCTIONALITY
+
+        return disassembly.find_ascii_strings(self.disassembly_data, segment_id)
+
+    def set_datatype_ascii_for_strings(self, acting_client, strings):
+        if self.state_id != EditorState.STATE_LOADED:
+            return ERRMSG_TODO_BAD_STATE_FUNCTIONALITY
+
+        self._prolonged_action(acting_client, "TITLE_DATA_TYPE_CHANGE", "TEXT_GENERIC_PROCESSING", disassembly.set_data_type_ascii_for_strings, self.disassembly_data, strings)
+
+    def find_code_candidates(self, acting_client, process_count=1):
+        if self.state_id != EditorState.STATE_LOADED:
+            return ERRMSG_TODO_BAD_STATE_FUNCTIONALITY
+
+        return disassembly.find_code_candidates(self.disassembly_data, process_count)
+
+    def set_datatype_code_for_candidates(self, acting_client, candidates):
+        if self.state_id != EditorState.STATE_LOADED:
+            return ERRMSG_TODO_BAD_STATE_FUNCTIONALITY
+
+        self._prolonged_action(acting_client, "TITLE_DATA_TYPE_CHANGE", "TEXT_GENERIC_PROCESSING", disassembly.set_data_type_code_for_candidates, self.disassembly_data, candidates)
+
     def _set_data_type(self, acting_client, address, data_type):
         self._prolonged_action(acting_client, "TITLE_DATA_TYPE_CHANGE", "TEXT_GENERIC_PROCESSING", disassembly.set_data_type_at_address, self.disassembly_data, address, data_type, can_cancel=False)
 
@@ -509,6 +553,8 @@ class EditorState(object):
             result = self._prolonged_action(acting_client, "TITLE_LOADING_PROJECT", "TEXT_GENERIC_LOADING", disassembly.load_project_file, load_file, file_name)
         else:
             new_options = disassembly.get_new_project_options(self.disassembly_data)
+            # Read in once, for identification, loading and checksumming.
+            load_file = loaderlib.ingest_file(load_file)
             identify_result = loaderlib.identify_file(load_file)
             # Parameters passed in, to help the client make up it's mind.
             if identify_result is not None:
@@ -549,6 +595,7 @@ class EditorState(object):
 
         is_saved_project = disassembly_persistence.check_is_project_file(acting_client.get_load_file())
         if is_saved_project:
+            self.disassembly_data.savefile_path = file_path
             # User may have optionally chosen to not save the input file, as part of the project file.
             if not disassembly.is_segment_data_cached(self.disassembly_data):
                 load_options = disassembly.get_new_project_options(self.disassembly_data)
@@ -566,11 +613,11 @@ class EditorState(object):
 
                 # Verify that the given input file is valid, or error descriptively.
                 with open(load_options.loader_file_path, "rb") as input_data_file:
-                    input_data_file.seek(0, os.SEEK_END)
+                    input_data_file = loaderlib.ingest_file(input_data_file)
                     errmsg = None
-                    if input_data_file.tell() != self.disassembly_data.file_size:
+                    if input_data_file.size != self.disassembly_data.file_size:
                         errmsg = ERRMSG_INPUT_FILE_SIZE_DIFFERS
-                    elif util.calculate_file_checksum(input_data_file) != self.disassembly_data.file_checksum:
+                    elif input_data_file.checksum != self.disassembly_data.file_checksum:
                         errmsg = ERRMSG_INPUT_FILE_CHECKSUM_MISMATCH
                     if type(errmsg) in types.StringTypes:
                         self.reset_state(acting_client)
@@ -594,8 +641,31 @@ class EditorState(object):
             client.event_load_successful(client is acting_client)
         return result
 
-    def save_project(self, acting_client):
+    def is_analysis_pending(self, acting_client):
+        if self.state_id != EditorState.STATE_LOADED:
+            return False
+        return disassembly.is_code_analysis_pending(self.disassembly_data)
+
+    def step_analysis(self, acting_client, budget_ms):
+        """ Advance the analysis left in progress after loading.  Returns True when it is complete. """
         if self.state_id != EditorState.STATE_LOADED:
+            return True
+        # Prolonged actions modify the disassembly data on the worker thread, let them finish first.
+        if self.in_prolonged_action:
+            return False
+        return disassembly.step_code_analysis(self.disassembly_data, budget_ms)
+
+    def get_analysis_stats(self, acting_client):
+        if self.state_id != EditorState.STATE_LOADED:
+            return ERRMSG_TODO_BAD_STATE_FUNCTIONALITY
+        return disassembly.get_analysis_stats(self.disassembly_data)
+
+    def _complete_analysis(self, acting_client):
+        if disassembly.is_code_analysis_pending(self.disassembly_data):
+            self._prolonged_action(acting_client, "TITLE_COMPLETING_ANALYSIS", "TEXT_LOAD_DISASSEMBLY_PASS", disassembly.step_code_analysis, self.disassembly_data, can_cancel=False)
+
+    def save_project(self, acting_client):
+        if self.state_id != EditorState.STATE_LOADED or self.in_prolonged_action:
             return ERRMSG_TODO_BAD_STATE_FUNCTIONALITY
 
         save_options = disassembly.get_save_project_options(self.disassembly_data)
@@ -609,13 +679,31 @@ class EditorState(object):
         if save_options.cache_input_file:
             save_options.input_file = acting_client.get_load_file()
 
-        with open(save_options.save_file_path, "wb") as f:
-            disassembly.save_project_file(f, self.disassembly_data, save_options)
+        # Saving again to the same file only needs to append what changed.
+        if save_options.save_file_path == self.disassembly_data.savefile_path and os.path.isfile(save_options.save_file_path):
+            if bool(save_options.cache_input_file) == disassembly.is_project_inputfile_cached(self.disassembly_data):
+                with open(save_options.save_file_path, "r+b") as f:
+                    if disassembly.save_project_file_incrementally(f, self.disassembly_data):
+                        return
+
+        program_data = self.disassembly_data
+        # Windows will not replace the file the project is still being read from.
+        if os.name == "nt":
+            disassembly.read_deferred_project_data(program_data)
+        # A snapshot is saved on the worker thread, leaving the user to keep working meanwhile.
+        snapshot = disassembly.snapshot_project_data(program_data)
+        saved = self._prolonged_action(acting_client, "TITLE_SAVING_PROJECT", "TEXT_SAVE_WRITING_PROJECT_DATA", disassembly.save_project_snapshot, save_options.save_file_path, snapshot, save_options, is_modal=False)
+        disassembly.finish_project_snapshot(program_data, snapshot, saved)
+        if saved:
+            program_data.savefile_path = save_options.save_file_path
 
     def export_source_code(self, acting_client):
         if self.state_id != EditorState.STATE_LOADED:
             return ERRMSG_TODO_BAD_STATE_FUNCTIONALITY
 
+        # What gets exported should be complete.
+        self._complete_analysis(acting_client)
+
         line_count = disassembly.get_file_line_count(self.disassembly_data)
 
         # Prompt for save file name.
@@ -677,7 +765,8 @@ class WorkerThread(threading.Thread):
             completed_event = work_data[3]
             try:
                 try:
-                    completed_event.result = work_data[0](*work_data[1], **work_data[2])
+                    with util.trace_span("worker_job", callable=work_data[0].__name__):
+                        completed_event.result = work_data[0](*work_data[1], **work_data[2])
                     completed_event.set()
                 except Exception:
                     traceback.print_stack()
@@ -16,8 +16,12 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import array
+import bisect
+import hashlib
 import os
 import logging
+import mmap
 import struct
 
 import amiga
@@ -46,15 +50,107 @@ def get_system_data_types(system_name):
     system = systems_by_name[system_name]
     return DataTypes(system.big_endian)
  
-def load_file(input_file, loader_options=None, file_offset=0, file_length=None):
+# How much of the input file is checksummed at a time, as it is read in.
+INGEST_CHUNK_SIZE = 256 * 1024
+
+class IngestedFile(object):
+    """
+    An input file read in once, mapped into memory if possible, with its checksum.  It is read like a
+    file by the loaders, and remembers what it was identified as, so that loading need not parse it again.
+    """
+    def __init__(self, data, checksum):
+        self.data = data
+        self.size = len(data)
+        self.checksum = checksum
+        self.identify_result = None
+        self._offset = 0
+
+    def read(self, length=-1):
+        offset = self._offset
+        if length < 0:
+            length = self.size - offset
+        self._offset = min(offset + length, self.size)
+        return self.data[offset:self._offset]
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._offset
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._offset = offset
+
+    def tell(self):
+        return self._offset
+
+    def get_buffer(self, offset, length):
+        """ A view of part of the file data, which is not copied until it is used. """
+        return buffer(self.data, offset, length)
+
+def ingest_file(input_file):
+    """ Read in the input file, computing its checksum in the same pass. """
+    if isinstance(input_file, IngestedFile):
+        return input_file
+    hasher = hashlib.md5()
+    try:
+        data = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError):
+        data = None
+    if data is not None:
+        for offset in xrange(0, len(data), INGEST_CHUNK_SIZE):
+            hasher.update(buffer(data, offset, INGEST_CHUNK_SIZE))
+    else:
+        input_file.seek(0, os.SEEK_SET)
+        data_chunks = []
+        data_chunk = input_file.read(INGEST_CHUNK_SIZE)
+        while len(data_chunk):
+            hasher.update(data_chunk)
+            data_chunks.append(data_chunk)
+            data_chunk = input_file.read(INGEST_CHUNK_SIZE)
+        data = "".join(data_chunks)
+    return IngestedFile(data, hasher.digest())
+
+# How much of the start of a file each system is given to judge whether it handles it.
+SNIFF_HEADER_SIZE = 64
+
+def sniff_file(input_file, file_offset=0, file_length=None):
+    """
+    Read the start of the file once, and have each system rate how confident it is that it handles it.
+    Returns (confidence, system_name) for the systems that might, most confident first.
+    """
+    if file_length is None:
+        input_file.seek(0, os.SEEK_END)
+        file_length = input_file.tell() - file_offset
+    input_file.seek(file_offset, os.SEEK_SET)
+    header = input_file.read(min(SNIFF_HEADER_SIZE, file_length))
+    candidates = []
     for system_name, system in systems_by_name.iteritems():
+        confidence = system.sniff_input_file(header, file_length, get_system_data_types(system_name))
+        if confidence > 0:
+            candidates.append((confidence, system_name))
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+    return candidates
+
+def load_file(input_file, loader_options=None, file_offset=0, file_length=None):
+    # An identified executable was loaded in order to identify it.
+    if loader_options is None and isinstance(input_file, IngestedFile) and input_file.identify_result is not None and file_offset == 0 and file_length is None:
+        file_info = input_file.identify_result[0]
+        return file_info, get_system_data_types(file_info.system.system_name)
+    if loader_options is not None and loader_options.is_binary_file:
+        system_names = [ binary.__name__ ]
+    else:
+        system_names = [ system_name for (confidence, system_name) in sniff_file(input_file, file_offset, file_length) ]
+    for system_name in system_names:
+        system = systems_by_name[system_name]
         file_info = FileInfo(system, loader_options)
         data_types = get_system_data_types(system_name)
         if system.load_input_file(input_file, file_info, data_types, f_offset=file_offset, f_length=file_length):
             return file_info, data_types
 
 def identify_file(input_file, file_offset=0, file_length=None):
-    for system_name, system in systems_by_name.iteritems():
+    if isinstance(input_file, IngestedFile) and input_file.identify_result is not None and file_offset == 0 and file_length is None:
+        return input_file.identify_result
+    for confidence, system_name in sniff_file(input_file, file_offset, file_length):
+        system = systems_by_name[system_name]
         file_info = FileInfo(system)
         data_types = get_system_data_types(system_name)
         filetype_name = system.identify_input_file(input_file, file_info, data_types, f_offset=file_offset, f_length=file_length)
@@ -66,6 +162,8 @@ def identify_file(input_file, file_offset=0, file_length=None):
                 result["endian"] = "big"
             else:
                 result["endian"] = "little"
+            if isinstance(input_file, IngestedFile) and file_offset == 0 and file_length is None:
+                input_file.identify_result = file_info, result
             return file_info, result
 
 
@@ -109,9 +207,122 @@ def is_segment_type_data(segments, segment_id):
 def is_segment_type_bss(segments, segment_id):
     return segments[segment_id][SI_TYPE] == SEGMENT_TYPE_BSS
 
-def cache_segment_data(input_file, segments, segment_id, base_file_offset=0):
+# Segments of project files with at least this much data are read from the mapped file, rather than copied into memory.
+MAPPED_SEGMENT_DATA_SIZE = 64 * 1024
+# How much mapped segment data is copied at a time, for byte by byte reading.
+MAPPED_SEGMENT_PAGE_SIZE = 4096
+
+class MappedSegmentData(object):
+    """
+    The data of a segment, read from the mapped file it is located in rather than copied.  It is
+    indexed and sliced like the bytearray smaller segments are copied into.  Relocated longwords are
+    written to an overlay, which is read in place of the file data they replace.
+    """
+    def __init__(self, data, offset, length):
+        self.data = data
+        self.offset = offset
+        self.length = length
+        # The sorted offsets of the written longwords, and their values four bytes to each.
+        self.overlay_offsets = array.array("l")
+        self.overlay_values = bytearray()
+        self._page_offset = 0
+        self._page_length = 0
+        self._page = None
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        # Bytes are read from a copied page of the data, as decoders read a byte or word at a time.
+        try:
+            page_idx = idx - self._page_offset
+        except TypeError:
+            start, stop, step = idx.indices(self.length)
+            if step != 1:
+                raise ValueError("mapped segment data can only be sliced contiguously")
+            return self._read(start, max(start, stop))
+        if 0 <= page_idx < self._page_length:
+            return self._page[page_idx]
+        if idx < 0:
+            idx += self.length
+        if not 0 <= idx < self.length:
+            raise IndexError("mapped segment data index out of range")
+        self._page_offset = idx - idx % MAPPED_SEGMENT_PAGE_SIZE
+        self._page = self._read(self._page_offset, min(self._page_offset + MAPPED_SEGMENT_PAGE_SIZE, self.length))
+        self._page_length = len(self._page)
+        return self._page[idx - self._page_offset]
+
+    def __setitem__(self, idx, values):
+        """ Only relocated longwords are written. """
+        start, stop, step = idx.indices(self.length)
+        if stop - start != 4 or len(values) != 4:
+            raise ValueError("mapped segment data can only be written a longword at a time")
+        i = bisect.bisect_left(self.overlay_offsets, start)
+        if i < len(self.overlay_offsets) and self.overlay_offsets[i] == start:
+            self.overlay_values[i*4:i*4+4] = values
+        else:
+            self.overlay_offsets.insert(i, start)
+            self.overlay_values[i*4:i*4] = values
+        self._page_length = 0
+
+    def set_longwords(self, offsets, values):
+        """ Write longwords at each of the given sorted offsets, which do not overlap, their values four bytes to each. """
+        if not len(offsets):
+            return
+        if not len(self.overlay_offsets) or self.overlay_offsets[-1] < offsets[0]:
+            self.overlay_offsets.extend(offsets)
+            self.overlay_values.extend(values)
+        else:
+            # Merge them with the longwords already written, the later written replacing the earlier.
+            values_by_offset = {}
+            for i, offset in enumerate(self.overlay_offsets):
+                values_by_offset[offset] = self.overlay_values[i*4:i*4+4]
+            for i, offset in enumerate(offsets):
+                values_by_offset[offset] = values[i*4:i*4+4]
+            self.overlay_offsets = array.array("l", sorted(values_by_offset))
+            self.overlay_values = bytearray().join(values_by_offset[offset] for offset in self.overlay_offsets)
+        self._page_length = 0
+
+    def __eq__(self, other):
+        return other is not None and len(self) == len(other) and self[:] == other[:]
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        # Worker processes are given the data, not the mapping.
+        return bytearray, (self[:],)
+
+    def _read(self, start, stop):
+        values = bytearray(self.data[self.offset+start:self.offset+stop])
+        overlay_offsets = self.overlay_offsets
+        i = bisect.bisect_left(overlay_offsets, start - 3)
+        while i < len(overlay_offsets) and overlay_offsets[i] < stop:
+            offset = overlay_offsets[i]
+            start_idx = max(offset, start)
+            stop_idx = min(offset + 4, stop)
+            values[start_idx-start:stop_idx-start] = self.overlay_values[i*4+start_idx-offset:i*4+stop_idx-offset]
+            i += 1
+        return values
+
+    def find(self, sub, start=0, end=None):
+        if end is None:
+            end = self.length
+        idx = self[start:end].find(sub)
+        if idx == -1:
+            return -1
+        return start + idx
+
+def copy_segment_data(segments):
+    """ Copy mapped segment data into memory, so that the file it was mapped from is no longer in use. """
+    for segment in segments:
+        if isinstance(segment[SI_CACHED_DATA], MappedSegmentData):
+            segment[SI_CACHED_DATA] = segment[SI_CACHED_DATA][:]
+
+def cache_segment_data(input_file, segments, segment_id, base_file_offset=0, map_data=False):
     """
     base_file_offset: when the input file is located within a containing file.
+    map_data: larger segments are read from the mapped file, which must not change while they are in use.
     """
     data = None
     file_offset = get_segment_data_file_offset(segments, segment_id)
@@ -119,12 +330,17 @@ def cache_segment_data(input_file, segments, segment_id, base_file_offset=0):
     if file_offset != -1:
         file_length = get_segment_data_length(segments, segment_id)
 
-        input_file.seek(base_file_offset + file_offset, os.SEEK_SET)
-        file_data = input_file.read(file_length)
-        if len(file_data) == file_length:
-            data = bytearray(file_data)
+        if isinstance(input_file, IngestedFile):
+            file_data = input_file.get_buffer(base_file_offset + file_offset, file_length)
         else:
+            input_file.seek(base_file_offset + file_offset, os.SEEK_SET)
+            file_data = input_file.read(file_length)
+        if len(file_data) != file_length:
             logger.error("Unable to cache segment %d data, got %d bytes, wanted %d", segment_id, len(file_data), file_length)
+        elif map_data and isinstance(input_file, IngestedFile) and type(input_file.data) is mmap.mmap and file_length >= MAPPED_SEGMENT_DATA_SIZE:
+            data = MappedSegmentData(input_file.data, base_file_offset + file_offset, file_length)
+        else:
+            data = bytearray(file_data)
     segments[segment_id][SI_CACHED_DATA] = data
 
 def relocate_segment_data(segments, data_types, relocations, relocatable_addresses, relocated_addresses):
@@ -134,16 +350,26 @@ def relocate_segment_data(segments, data_types, relocations, relocatable_address
         local_address = get_segment_address(segments, segment_id)
         for target_segment_id, local_offsets in relocations[segment_id]:
             target_address = get_segment_address(segments, target_segment_id)
-            for local_offset in local_offsets:
-                value = data_types.uint32_value(data[local_offset:local_offset+4])
-                address = value + target_address
-                if relocated_addresses is not None:
-                    if address not in relocated_addresses:
-                        relocated_addresses.add(address)
-                if relocatable_addresses is not None:
-                    relocatable_addresses.add(local_address + local_offset)
-                data[local_offset:local_offset+4] = data_types.uint32_bytes(address)
-
+            # All the longwords relocated against the target segment are read, offset and written together.
+            sorted_offsets = sorted(local_offsets)
+            if all(sorted_offsets[i+1] - sorted_offsets[i] >= 4 for i in xrange(len(sorted_offsets)-1)):
+                addresses = [ value + target_address for value in data_types.uint32_values(data, sorted_offsets) ]
+                data_types.set_uint32_values(data, sorted_offsets, [ address & 0xFFFFFFFF for address in addresses ])
+            else:
+                # Overlapping longwords are relocated in turn, each reading what the last wrote.
+                addresses = _relocate_longwords_sequentially(data, data_types, local_offsets, target_address)
+            if relocated_addresses is not None:
+                relocated_addresses.update(addresses)
+            if relocatable_addresses is not None:
+                relocatable_addresses.update([ local_address + local_offset for local_offset in local_offsets ])
+
+def _relocate_longwords_sequentially(data, data_types, local_offsets, target_address):
+    addresses = []
+    for local_offset in local_offsets:
+        address = data_types.uint32_value(data[local_offset:local_offset+4]) + target_address
+        data[local_offset:local_offset+4] = data_types.uint32_bytes(address)
+        addresses.append(address)
+    return addresses
 
 def has_segment_headers(system_name):
     return get_system(system_name).has_segment_headers()
@@ -166,11 +392,84 @@ def get_entrypoint_address(file_info):
     return get_segment_address(file_info.segments, file_info.entrypoint_segment_id) + file_info.entrypoint_offset
 
 
+class BinaryReader(object):
+    """
+    Reads the values in a file from one buffer of its data, rather than with a file read for each.
+    Offsets are relative to the start of the file, which may be located within a containing file.
+    """
+    def __init__(self, data, data_offset, data_length, endian_char):
+        self.data = data
+        self.data_offset = data_offset
+        self.length = data_length
+        self.offset = 0
+        self._endian_char = endian_char
+        self._uint16_unpack_from = struct.Struct(endian_char +"H").unpack_from
+        self._uint32_unpack_from = struct.Struct(endian_char +"I").unpack_from
+
+    def _advance(self, length):
+        """ Returns the buffer offset of the data read. """
+        offset = self.offset
+        if offset + length > self.length:
+            raise struct.error("unable to read %d bytes at offset %d of %d" % (length, offset, self.length))
+        self.offset = offset + length
+        return self.data_offset + offset
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.offset
+        elif whence == os.SEEK_END:
+            offset += self.length
+        self.offset = offset
+
+    def read(self, length):
+        data_offset = self._advance(length)
+        return self.data[data_offset:data_offset+length]
+
+    def read_uint8(self):
+        return ord(self.data[self._advance(1)])
+
+    def read_uint16(self):
+        return self._uint16_unpack_from(self.data, self._advance(2))[0]
+
+    def read_uint32(self):
+        return self._uint32_unpack_from(self.data, self._advance(4))[0]
+
+    def read_uint16_array(self, count):
+        return struct.unpack_from(self._endian_char + str(count) +"H", self.data, self._advance(count * 2))
+
+    def read_uint32_array(self, count):
+        return struct.unpack_from(self._endian_char + str(count) +"I", self.data, self._advance(count * 4))
+
+    def read_cstring(self):
+        """ The string up to the next null byte, which is read but not returned. """
+        data_offset = self.data_offset + self.offset
+        idx = self.data.find("\0", data_offset, self.data_offset + self.length)
+        if idx == -1:
+            raise struct.error("unterminated string at offset %d of %d" % (self.offset, self.length))
+        self.offset += idx - data_offset + 1
+        return self.data[data_offset:idx]
+
+
 class DataTypes(object):
     def __init__(self, big_endian):
         self.big_endian = big_endian
         self._endian_char = [ "<", ">" ][big_endian]
 
+    def get_file_reader(self, f, file_offset=0, file_length=None):
+        """ A reader of the values in the file, from one buffer of its data. """
+        if isinstance(f, IngestedFile):
+            data = f.data
+            if file_length is None or file_offset + file_length > f.size:
+                file_length = f.size - file_offset
+        else:
+            f.seek(file_offset, os.SEEK_SET)
+            data = f.read(-1 if file_length is None else file_length)
+            file_offset, file_length = 0, len(data)
+        return BinaryReader(data, file_offset, file_length, self._endian_char)
+
     ## Data access related operations.
 
     def uint8_value(self, bytes, idx=None):
@@ -194,6 +493,29 @@ class DataTypes(object):
         else:
             return (bytes[3] << 24) + (bytes[2] << 16) + (bytes[1] << 8) + bytes[0]
 
+    def uint32_value_array(self, bytes, idx, count):
+        if isinstance(bytes, MappedSegmentData):
+            bytes, idx = bytes[idx:idx+count*4], 0
+        return struct.unpack_from(self._endian_char + str(count) +"I", bytes, idx)
+
+    def uint32_values(self, bytes, offsets):
+        """ The longwords at each of the given sorted offsets. """
+        base_offset = 0
+        if isinstance(bytes, MappedSegmentData) and len(offsets):
+            base_offset = offsets[0]
+            bytes = bytes[base_offset:offsets[-1]+4]
+        unpack_from = struct.Struct(self._endian_char +"I").unpack_from
+        return [ unpack_from(bytes, offset - base_offset)[0] for offset in offsets ]
+
+    def set_uint32_values(self, bytes, offsets, values):
+        """ Write longwords at each of the given sorted offsets, which do not overlap. """
+        if isinstance(bytes, MappedSegmentData):
+            bytes.set_longwords(offsets, struct.pack(self._endian_char + str(len(values)) +"I", *values))
+        else:
+            pack_into = struct.Struct(self._endian_char +"I").pack_into
+            for offset, value in zip(offsets, values):
+                pack_into(bytes, offset, value)
+
     def uint32_bytes(self, v):
         if self.big_endian:
             return [ (v >> 24) & 0xFF, (v >> 16) & 0xFF, (v >> 8) & 0xFF, v & 0xFF ]
@@ -95,6 +95,19 @@ def is_accepted_file_type(word1):
     return False
 """
 
+def sniff_header(header, file_length, data_types):
+    """ How confident we are, out of 100, that we handle a file given its start. """
+    if len(header) < 4 or data_types.uint32(header[0:4]) != HUNK_HEADER:
+        return 0
+    # Executables have no resident library names, and a slot per listed hunk.
+    if len(header) >= 20 and data_types.uint32(header[4:8]) == 0:
+        header_table_size = data_types.uint32(header[8:12])
+        first_hunk_slot = data_types.uint32(header[12:16])
+        last_hunk_slot = data_types.uint32(header[16:20])
+        if header_table_size > 0 and last_hunk_slot - first_hunk_slot + 1 == header_table_size:
+            return 100
+    return 50
+
 class HunkFile(object):
     _header_table_size = None
     _first_hunk_slot = None
@@ -114,47 +127,38 @@ def load_input_file(input_file, file_info, data_types, f_offset=0, f_length=None
 def load_hunk_file(file_info, data_types, f, file_offset, file_length):
     data = HunkFile()
 
-    f.seek(file_offset, os.SEEK_SET)
-    hunk_id = data_types.uint32(f.read(4))
+    reader = data_types.get_file_reader(f, file_offset, file_length)
+    hunk_id = reader.read_uint32()
     if hunk_id != HUNK_HEADER:
         logger.debug("amiga/hunkfile.py: _process_file: Unrecognised file.")
         return False
 
-    if file_length is None:
-        file_offset2 = f.tell()
-        f.seek(0, os.SEEK_END)
-        file_length = f.tell()
-        f.seek(file_offset2, os.SEEK_SET)
-
     # OS actually fails loading executables if this doesn't just read a NULL longword.
-    data._resident_library_names = _read_hunk_strings(file_info, data_types, f)
+    data._resident_library_names = _read_hunk_strings(reader)
 
-    data._header_table_size = data_types.uint32(f.read(4))
-    data._first_hunk_slot = data_types.uint32(f.read(4))
-    data._last_hunk_slot = data_types.uint32(f.read(4))
+    data._header_table_size = reader.read_uint32()
+    data._first_hunk_slot = reader.read_uint32()
+    data._last_hunk_slot = reader.read_uint32()
 
     l = []
-    segment_count = data._header_table_size
-    while segment_count:
-        slot_long = data_types.uint32(f.read(4))
+    for slot_long in reader.read_uint32_array(data._header_table_size):
         hunk_memory_flags = slot_long & 0xE0000000
         hunk_segment_length = (slot_long & 0x3FFFFFFF) * 4
         l.append((hunk_memory_flags, hunk_segment_length))
-        segment_count -= 1
     data._header_segments = l
 
     # Read in segments.
     l = []
-    while f.tell() - file_offset != file_length:
-        longword = data_types.uint32(f.read(4))
+    while reader.tell() != reader.length:
+        longword = reader.read_uint32()
         # This should be the same as the header segment slot.  The header slot is what is used for the allocations, in any case.
         segment_memory_flags = longword & 0xE0000000
         segment_hunk_id = longword & 0x3FFFFFFF
-        data_length = data_types.uint32(f.read(4)) * 4
+        data_length = reader.read_uint32() * 4
 
         if segment_hunk_id == HUNK_CODE or segment_hunk_id == HUNK_DATA:
-            data_offset = f.tell() - file_offset
-            f.seek(data_length, os.SEEK_CUR)
+            data_offset = reader.tell()
+            reader.seek(data_length, os.SEEK_CUR)
         elif segment_hunk_id == HUNK_BSS:
             data_offset = -1
         else:
@@ -163,49 +167,41 @@ def load_hunk_file(file_info, data_types, f, file_offset, file_length):
 
         relocations = []
         symbols = []
-        hunk_id = data_types.uint32(f.read(4))
+        hunk_id = reader.read_uint32()
         while hunk_id != HUNK_END:
             if hunk_id == HUNK_RELOC32:
-                offset_count = data_types.uint32(f.read(4))
+                offset_count = reader.read_uint32()
                 while offset_count > 0:
-                    target_hunk_id = data_types.uint32(f.read(4))
-                    offsets = []
-                    while offset_count > 0:
-                        local_offset = data_types.uint32(f.read(4))
-                        offsets.append(local_offset)
-                        offset_count -= 1
-                    offset_count = data_types.uint32(f.read(4))
+                    target_hunk_id = reader.read_uint32()
+                    offsets = list(reader.read_uint32_array(offset_count))
+                    offset_count = reader.read_uint32()
                     relocations.append((target_hunk_id, offsets))
             elif hunk_id in (HUNK_DREL32, HUNK_RELOC32SHORT, HUNK_ABSRELOC16):
-                offset_count = data_types.uint16(f.read(2))
+                offset_count = reader.read_uint16()
                 while offset_count > 0:
-                    target_hunk_id = data_types.uint16(f.read(2))
-                    offsets = []
-                    while offset_count > 0:
-                        local_offset = data_types.uint16(f.read(2))
-                        offsets.append(local_offset)
-                        offset_count -= 1
-                    offset_count = data_types.uint16(f.read(2))
+                    target_hunk_id = reader.read_uint16()
+                    offsets = list(reader.read_uint16_array(offset_count))
+                    offset_count = reader.read_uint16()
                     relocations.append((target_hunk_id, offsets))
-                if f.tell() - file_offset & 2:
-                    f.seek(2, os.SEEK_CUR)
+                if reader.tell() & 2:
+                    reader.seek(2, os.SEEK_CUR)
             elif hunk_id == HUNK_SYMBOL:
-                symbol_name = _read_hunk_string(file_info, data_types, f)
+                symbol_name = _read_hunk_string(reader)
                 while symbol_name:
-                    symbol_value = data_types.uint32(f.read(4))
+                    symbol_value = reader.read_uint32()
                     symbols.append((symbol_value, symbol_name, False))
-                    symbol_name = _read_hunk_string(file_info, data_types, f)
+                    symbol_name = _read_hunk_string(reader)
             elif hunk_id == HUNK_DEBUG:
                 # Skip this information.  Handling is lower in this file.
-                num_longwords = data_types.uint32(f.read(4))
-                f.seek(4 * num_longwords, os.SEEK_CUR)
+                num_longwords = reader.read_uint32()
+                reader.seek(4 * num_longwords, os.SEEK_CUR)
             elif hunk_id == HUNK_NAME:
                 # Optional.  Hunks with the same name are combined.
-                hunk_name = self._read_hunk_string(f)
+                hunk_name = _read_hunk_string(reader)
             else:
                 logger.debug("hunkfile.py: _process_file: Unexpected secondary segment type: %X %s", hunk_id, HUNK_NAMES.get(hunk_id, "?"))
                 return False
-            hunk_id = data_types.uint32(f.read(4))
+            hunk_id = reader.read_uint32()
 
         l.append((segment_hunk_id, data_offset, data_length, relocations, symbols))
 
@@ -247,14 +243,12 @@ def get_hunk_memory_flags(data, segment_id):
     return data[segment_id][1]
 
 
-SAVEFILE_VERSION = 1
+# The persisted data is an entry of these uint32 fields for each segment.
+PROJECT_DATA_FIELDS = ("hunk_type", "memory_flags")
 
-def save_project_data(f, data):
-    f.write(struct.pack("<H", SAVEFILE_VERSION))
-    cPickle.dump(data, f, -1)
-    return True
+SAVEFILE_VERSION = 1
 
-def load_project_data(f):
+def load_pickled_project_data(f):
     savefile_version = struct.unpack("<H", f.read(2))[0]
     if savefile_version != SAVEFILE_VERSION:
         logger.error("Unable to load old savefile data, got: %d, wanted: %d", savefile_version, SAVEFILE_VERSION)
@@ -263,20 +257,20 @@ def load_project_data(f):
     return data
 
 
-def _read_hunk_strings(file_info, data_types, f):
+def _read_hunk_strings(reader):
     l = []
-    s = _read_hunk_string(file_info, data_types, f)
+    s = _read_hunk_string(reader)
     while len(s):
         l.append(s)
-        s = _read_hunk_string(file_info, data_types, f)
+        s = _read_hunk_string(reader)
     return l
 
-def _read_hunk_string(file_info, data_types, f, num_longs=None):
+def _read_hunk_string(reader, num_longs=None):
     if num_longs is None:
-        num_longs = data_types.uint32(f.read(4))
+        num_longs = reader.read_uint32()
     s = ""
     if num_longs > 0:
-        s = f.read(num_longs * 4)
+        s = reader.read(num_longs * 4)
         idx = s.find('\0')
         if idx > -1:
             return s[:idx]
@@ -21,21 +21,22 @@ from . import prgfile
 
 class System(object):
     big_endian = True
+    project_data_fields = prgfile.PROJECT_DATA_FIELDS
 
     def get_arch_name(self):
         return "m68k"
 
+    def sniff_input_file(self, header, file_length, data_types):
+        return prgfile.sniff_header(header, file_length, data_types)
+
     def load_input_file(self, input_file, file_info, data_types, f_offset=0, f_length=None):
         return prgfile.load_input_file(input_file, file_info, data_types, f_offset, f_length)
 
     def identify_input_file(self, input_file, file_info, data_types, f_offset=0, f_length=None):
         return prgfile.identify_input_file(input_file, file_info, data_types, f_offset, f_length)
 
-    def load_project_data(self, f):
-        return prgfile.load_project_data(f)
-
-    def save_project_data(self, f, data):
-        return prgfile.save_project_data(f, data)
+    def load_pickled_project_data(self, f):
+        return prgfile.load_pickled_project_data(f)
 
     def print_summary(self, file_info):
         prgfile.print_summary(file_info)
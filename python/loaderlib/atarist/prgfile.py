@@ -62,6 +62,17 @@ def is_accepted_file_type(word1):
         return True
     return False
 
+def sniff_header(header, file_length, data_types):
+    """ How confident we are, out of 100, that we handle a file given its start. """
+    if len(header) < SIZEOF_HEADER or data_types.uint16(header[0:2]) != MAGIC_WORD:
+        return 0
+    text_size = data_types.uint32(header[2:6])
+    data_size = data_types.uint32(header[6:10])
+    symbol_table_size = data_types.uint32(header[14:18])
+    if SIZEOF_HEADER + text_size + data_size + symbol_table_size <= file_length:
+        return 100
+    return 50
+
 
 class PRGFile(object):
     # Executable file header field values.
@@ -87,8 +98,8 @@ def load_input_file(input_file, file_info, data_types, f_offset=0, f_length=None
     return load_prg_file(file_info, data_types, input_file, f_offset, f_length)
 
 def load_prg_file(file_info, data_types, f, f_offset, f_length):
-    f.seek(f_offset, os.SEEK_SET)
-    magic_word = data_types.uint16(f.read(2))
+    reader = data_types.get_file_reader(f, f_offset, f_length)
+    magic_word = reader.read_uint16()
     if magic_word != MAGIC_WORD:
         logger.debug("atarist/prgfile.py: _process_file: Unrecognised file.")
         return False
@@ -97,23 +108,23 @@ def load_prg_file(file_info, data_types, f, f_offset, f_length):
     prg_file._hunk_sizes = []
 
     # Read the PRG executable file header.
-    prg_file._text_segment_size = data_types.uint32(f.read(4))
-    prg_file._data_segment_size = data_types.uint32(f.read(4))
-    prg_file._bss_segment_size = data_types.uint32(f.read(4))
-    prg_file._symbol_table_size = data_types.uint32(f.read(4))
-    prg_file._reserved1 = data_types.uint32(f.read(4))
-    prg_file._reserved2 = data_types.uint32(f.read(4))
-    prg_file._reserved3 = data_types.uint16(f.read(2)) # GEMDOS reference manual says this should be a longword, but that does not work.
-
-    if f.tell() != SIZEOF_HEADER:
+    prg_file._text_segment_size = reader.read_uint32()
+    prg_file._data_segment_size = reader.read_uint32()
+    prg_file._bss_segment_size = reader.read_uint32()
+    prg_file._symbol_table_size = reader.read_uint32()
+    prg_file._reserved1 = reader.read_uint32()
+    prg_file._reserved2 = reader.read_uint32()
+    prg_file._reserved3 = reader.read_uint16() # GEMDOS reference manual says this should be a longword, but that does not work.
+
+    if reader.tell() != SIZEOF_HEADER:
         logger.debug("Header size mismatch")
         return False
 
     # Process the file meta-data.
-    if not _read_symbol_table(file_info, data_types, prg_file, f):
+    if not _read_symbol_table(file_info, data_types, prg_file, reader):
         return False
 
-    if not _read_fixup_information(file_info, data_types, prg_file, f):
+    if not _read_fixup_information(file_info, data_types, prg_file, reader):
         return False
 
     symbols = []
@@ -138,9 +149,9 @@ def load_prg_file(file_info, data_types, f, f_offset, f_length):
     return True
 
 
-def _read_symbol_table(file_info, data_types, prg_file, f):
+def _read_symbol_table(file_info, data_types, prg_file, reader):
     file_offset = SIZEOF_HEADER + prg_file._text_segment_size + prg_file._data_segment_size
-    f.seek(file_offset, os.SEEK_SET)
+    reader.seek(file_offset, os.SEEK_SET)
 
     entry_count = prg_file._symbol_table_size / SIZEOF_SYMBOL_ENTRY
     if entry_count * SIZEOF_SYMBOL_ENTRY != prg_file._symbol_table_size:
@@ -149,35 +160,33 @@ def _read_symbol_table(file_info, data_types, prg_file, f):
 
     l = []
     while len(l) != entry_count:
-        symbol_name = f.read(8)
+        symbol_name = reader.read(8)
         # Strip unused space (null termination).
         idx = symbol_name.find("\0")
         if idx != -1:
             symbol_name = symbol_name[:idx]
-        symbol_type = data_types.uint16(f.read(2))
-        symbol_value = data_types.uint32(f.read(4))
+        symbol_type = reader.read_uint16()
+        symbol_value = reader.read_uint32()
         l.append((symbol_name, symbol_type, symbol_value))
 
     prg_file._symbol_table_entries = l
     return True
 
 
-def _read_fixup_information(file_info, data_types, prg_file, f):
+def _read_fixup_information(file_info, data_types, prg_file, reader):
     file_offset = SIZEOF_HEADER + prg_file._text_segment_size + prg_file._data_segment_size + prg_file._symbol_table_size
-    f.seek(file_offset, os.SEEK_SET)
+    reader.seek(file_offset, os.SEEK_SET)
 
     # First longword is an offset.  If it is NULL, there are no fixups to make.
     l = []
-    offset = data_types.uint32(f.read(4))
+    offset = reader.read_uint32()
     if offset != 0:
         offsets = [ offset ]
 
         maximum_offset = prg_file._text_segment_size + prg_file._data_segment_size
-        while 1:
-            byte = data_types.uint8(f.read(1))
-            if byte == 0:
-                break
-            elif byte == 1:
+        # The byte deltas between fixups are terminated by a null byte.
+        for byte in bytearray(reader.read_cstring()):
+            if byte == 1:
                 offset += 254
             else:
                 offset += byte
@@ -191,14 +200,12 @@ def _read_fixup_information(file_info, data_types, prg_file, f):
     prg_file._fixup_offsets = l
     return True
 
-SAVEFILE_VERSION = 1
+# Nothing is persisted.
+PROJECT_DATA_FIELDS = None
 
-def save_project_data(f, data):
-    f.write(struct.pack("<H", SAVEFILE_VERSION))
-    cPickle.dump(data, f, -1)
-    return True
+SAVEFILE_VERSION = 1
 
-def load_project_data(f):
+def load_pickled_project_data(f):
     savefile_version = struct.unpack("<H", f.read(2))[0]
     if savefile_version != SAVEFILE_VERSION:
         logger.error("Unable to load old savefile data, got: %d, wanted: %d", savefile_version, SAVEFILE_VERSION)
@@ -21,6 +21,7 @@ import os
 
 class System(object):
     big_endian = True
+    project_data_fields = None
     
     arch_name = None
 
@@ -30,12 +31,19 @@ class System(object):
     def set_arch_name(self, arch_name):
         self.arch_name = arch_name
 
+    def sniff_input_file(self, header, file_length, data_types):
+        """ Any file can be binary, so only an explicit user choice selects it. """
+        return 0
+
     def load_input_file(self, input_file, file_info, data_types, f_offset=0, f_length=None):
         if file_info.loader_options is None or not file_info.loader_options.is_binary_file:
             return False
         self.set_arch_name(file_info.loader_options.dis_name)
 
         file_size = f_length
+        if file_size is None:
+            input_file.seek(0, os.SEEK_END)
+            file_size = input_file.tell() - f_offset
         relocations = []
         symbols = []
         file_info.add_code_segment(0, file_size, file_size, relocations, symbols)
@@ -45,10 +53,7 @@ class System(object):
         """ User selected files should not be identified as binary. """
         return None
 
-    def load_project_data(self, f):
-        return None
-
-    def save_project_data(self, f, data):
+    def load_pickled_project_data(self, f):
         return None
 
     def print_summary(self, file_info):
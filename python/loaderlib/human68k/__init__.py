@@ -21,6 +21,7 @@ from . import xfile
 
 class System(object):
     big_endian = True
+    project_data_fields = xfile.PROJECT_DATA_FIELDS
 
     def get_arch_name(self):
         return "m68k"
@@ -28,14 +29,14 @@ class System(object):
     def identify_input_file(self, input_file, file_info, data_types, f_offset=0, f_length=None):
         return xfile.identify_input_file(input_file, file_info, data_types, f_offset, f_length)
 
+    def sniff_input_file(self, header, file_length, data_types):
+        return xfile.sniff_header(header, file_length, data_types)
+
     def load_input_file(self, input_file, file_info, data_types, f_offset=0, f_length=None):
         return xfile.load_input_file(input_file, file_info, data_types, f_offset, f_length)
 
-    def load_project_data(self, f):
-        return xfile.load_project_data(f)
-
-    def save_project_data(self, f, data):
-        xfile.save_project_data(f, data)
+    def load_pickled_project_data(self, f):
+        return xfile.load_pickled_project_data(f)
 
     def print_summary(self, file_info):
         xfile.print_summary(file_info)
@@ -61,6 +61,18 @@ def is_accepted_file_type(word1):
         return True
     return False
 
+def sniff_header(header, file_length, data_types):
+    """ How confident we are, out of 100, that we handle a file given its start. """
+    if len(header) < SIZEOF_HEADER or data_types.uint16(header[0:2]) != MAGIC_WORD:
+        return 0
+    text_size = data_types.uint32(header[12:16])
+    data_size = data_types.uint32(header[16:20])
+    relocation_table_size = data_types.uint32(header[24:28])
+    symbol_table_size = data_types.uint32(header[28:32])
+    if SIZEOF_HEADER + text_size + data_size + relocation_table_size + symbol_table_size <= file_length:
+        return 100
+    return 50
+
 LOADMODE_NORMAL = 0
 LOADMODE_MINIMAL_MEMORY = 1
 LOADMODE_HIGH_ADDRESS = 2
@@ -97,39 +109,39 @@ def load_input_file(input_file, file_info, data_types, f_offset=0, f_length=None
     return load_x_file(file_info, data_types, input_file, f_offset, f_length)
 
 def load_x_file(file_info, data_types, f, f_offset=0, f_length=None):
-    f.seek(f_offset, os.SEEK_SET)
-    magic_word = data_types.uint16(f.read(2))
+    reader = data_types.get_file_reader(f, f_offset, f_length)
+    magic_word = reader.read_uint16()
     if magic_word != MAGIC_WORD:
         logger.debug("human68k/xfile.py: _process_file: Unrecognised file.")
         return False
 
     data = XFile()
-    data._reserved1 = data_types.uint8(f.read(1))
-    data._loadmode = data_types.uint8(f.read(1))
-    data._base_address = data_types.uint32(f.read(4))
-    data._entry_offset = data_types.uint32(f.read(4))
-    data._text_segment_size = data_types.uint32(f.read(4))
-    data._data_segment_size = data_types.uint32(f.read(4))
-    data._bss_segment_size = data_types.uint32(f.read(4))
-    data._relocation_table_size = data_types.uint32(f.read(4))
-    data._symbol_table_size = data_types.uint32(f.read(4))
-    data._debug_line_size = data_types.uint32(f.read(4))
-    data._debug_symbol_size = data_types.uint32(f.read(4))
-    data._debug_string_size = data_types.uint32(f.read(4))
-    data._reserved2 = data_types.uint32(f.read(4))
-    data._reserved3 = data_types.uint32(f.read(4))
-    data._reserved4 = data_types.uint32(f.read(4))
-    data._reserved5 = data_types.uint32(f.read(4))
-    data._bindlist_offset = data_types.uint32(f.read(4))
-
-    if f.tell() != SIZEOF_HEADER:
-        logger.debug("Header size mismatch, is %d, expected %d", f.tell(), SIZEOF_HEADER)
+    data._reserved1 = reader.read_uint8()
+    data._loadmode = reader.read_uint8()
+    data._base_address = reader.read_uint32()
+    data._entry_offset = reader.read_uint32()
+    data._text_segment_size = reader.read_uint32()
+    data._data_segment_size = reader.read_uint32()
+    data._bss_segment_size = reader.read_uint32()
+    data._relocation_table_size = reader.read_uint32()
+    data._symbol_table_size = reader.read_uint32()
+    data._debug_line_size = reader.read_uint32()
+    data._debug_symbol_size = reader.read_uint32()
+    data._debug_string_size = reader.read_uint32()
+    data._reserved2 = reader.read_uint32()
+    data._reserved3 = reader.read_uint32()
+    data._reserved4 = reader.read_uint32()
+    data._reserved5 = reader.read_uint32()
+    data._bindlist_offset = reader.read_uint32()
+
+    if reader.tell() != SIZEOF_HEADER:
+        logger.debug("Header size mismatch, is %d, expected %d", reader.tell(), SIZEOF_HEADER)
         return False
 
-    if not _read_relocation_table(file_info, data_types, data, f):
+    if not _read_relocation_table(file_info, data_types, data, reader):
         return False
 
-    if not _read_symbol_table(file_info, data_types, data, f):
+    if not _read_symbol_table(file_info, data_types, data, reader):
         return False
 
     symbols = []
@@ -153,23 +165,25 @@ def load_x_file(file_info, data_types, f, f_offset=0, f_length=None):
     return True
 
 
-def _read_relocation_table(file_info, data_types, data, f):
+def _read_relocation_table(file_info, data_types, data, reader):
     file_offset = SIZEOF_HEADER + data._text_segment_size + data._data_segment_size
-    f.seek(file_offset, os.SEEK_SET)
+    reader.seek(file_offset, os.SEEK_SET)
 
-    offset = data_types.uint16(f.read(2))
-    bytes_read = 2
+    # Word deltas between relocated offsets, where a delta of 1 is followed by a longword delta.
+    values = reader.read_uint16_array(data._relocation_table_size / 2)
 
     l = []
-    offsets = [ offset ]
+    offset = 0
+    offsets = []
 
     maximum_offset = data._text_segment_size + data._data_segment_size
-    while bytes_read < data._relocation_table_size:
-        value = data_types.uint16(f.read(2))
-        bytes_read += 2
+    i = 0
+    while i < len(values):
+        value = values[i]
+        i += 1
         if value == 1:
-            offset += data_types.uint32(f.read(4))
-            bytes_read += 2
+            offset += (values[i] << 16) + values[i+1]
+            i += 2
         else:
             offset += value
         if offset >= maximum_offset:
@@ -184,32 +198,24 @@ def _read_relocation_table(file_info, data_types, data, f):
 
 SIZEOF_SYMBOL_ENTRY = 1 + 1 + 4
 
-def _read_symbol_table(file_info, data_types, data, f):
+def _read_symbol_table(file_info, data_types, data, reader):
     file_offset = SIZEOF_HEADER + data._text_segment_size + data._data_segment_size + data._relocation_table_size
-    f.seek(file_offset, os.SEEK_SET)
+    reader.seek(file_offset, os.SEEK_SET)
     
     entry_count = data._symbol_table_size
 
     l = []
     if entry_count > 0:
-        bytes_read = 0
-        while bytes_read < data._symbol_table_size:
-            xdef_type = data_types.uint16(f.read(2))
-            offset = data_types.uint32(f.read(4))
-            bytes_read += SIZEOF_SYMBOL_ENTRY
-
-            name = ""
-            c = f.read(1)
-            bytes_read += 1
-            while c != "\0":
-                name += c
-                c = f.read(1)
-                bytes_read += 1
+        symbol_table_end = file_offset + data._symbol_table_size
+        while reader.tell() < symbol_table_end:
+            xdef_type = reader.read_uint16()
+            offset = reader.read_uint32()
+            name = reader.read_cstring()
             l.append((name, xdef_type, offset))
 
-            if bytes_read & 1:
-                f.read(1)
-                bytes_read += 1
+            # Entries are word aligned.
+            if (reader.tell() - file_offset) & 1:
+                reader.seek(1, os.SEEK_CUR)
             # logger.debug("_read_symbol_table %d %d %d \"%s\"", byte1, byte2, offset, name) 
     else:
         logger.debug("xfile.py: _read_symbol_table: no symbol table data to read")
@@ -218,14 +224,12 @@ def _read_symbol_table(file_info, data_types, data, f):
     return True
 
 
-SAVEFILE_VERSION = 1
+# Nothing is persisted.
+PROJECT_DATA_FIELDS = None
 
-def save_project_data(f, data):
-    f.write(struct.pack("<H", SAVEFILE_VERSION))
-    cPickle.dump(data, f, -1)
-    return True
+SAVEFILE_VERSION = 1
 
-def load_project_data(f):
+def load_pickled_project_data(f):
     savefile_version = struct.unpack("<H", f.read(2))[0]
     if savefile_version != SAVEFILE_VERSION:
         logger.error("Unable to load old savefile data, got: %d, wanted: %d", savefile_version, SAVEFILE_VERSION)
@@ -89,29 +89,66 @@ def write_string(f, value):
     f.write("\0")
 
 
+def _unpack_uint32s(data, count):
+    return struct.unpack("<%dI" % count, data)
+
+def _pack_uint32s(values):
+    return struct.pack("<%dI" % len(values), *values)
+
+
 def read_set_of_uint32s(f):
     chunk_size = read_uint32(f)
     set_entry_count = chunk_size / sizeof_uint32()
-    v = set()
-    while set_entry_count:
-        v.add(read_uint32(f))
-        set_entry_count -= 1
-    return v
+    return set(_unpack_uint32s(f.read(chunk_size), set_entry_count))
 
 def write_set_of_uint32s(f, v):
-    chunk_size_offset = f.tell()
-    write_uint32(f, 0)
-
-    data_offset = f.tell()
-    for k in v:
-        write_uint32(f, k)
+    data = _pack_uint32s(tuple(v))
+    write_uint32(f, len(data))
+    f.write(data)
+
+
+def read_array_of_uint32s(f):
+    """ Returns a tuple of the values, which were written with a count prefix. """
+    entry_count = read_uint32(f)
+    return _unpack_uint32s(f.read(entry_count * sizeof_uint32()), entry_count)
+
+def write_array_of_uint32s(f, v):
+    v = tuple(v)
+    write_uint32(f, len(v))
+    f.write(_pack_uint32s(v))
+
+
+def read_sorted_uint32s(f):
+    """ Returns a list of the values in ascending order. """
+    entry_count = read_uint32(f)
+    data = bytearray(f.read(read_uint32(f)))
+    v = [ 0 ] * entry_count
+    idx = value = delta = shift = 0
+    for byte in data:
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            value += delta
+            v[idx] = value
+            idx += 1
+            delta = shift = 0
+    return v
 
-    end_offset = f.tell()
-    # Write the chunk size at the beginning.
-    f.seek(chunk_size_offset, os.SEEK_SET)
-    write_uint32(f, end_offset - data_offset)
-    # Ensure the current file position is after our new data.
-    f.seek(end_offset, os.SEEK_SET)
+def write_sorted_uint32s(f, v):
+    """ The values are sorted, and each written as a varint of its difference from the previous one. """
+    data = bytearray()
+    previous_value = 0
+    for value in sorted(v):
+        delta = value - previous_value
+        previous_value = value
+        while delta > 0x7F:
+            data.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        data.append(delta)
+    write_uint32(f, len(v))
+    write_uint32(f, len(data))
+    f.write(str(data))
 
 def read_dict_uint32_to_set_of_uint32s(f):
     # Read number of dictionary entries.
@@ -123,11 +160,7 @@ def read_dict_uint32_to_set_of_uint32s(f):
         # Read number of set entries 'N'.
         set_entry_count = read_uint16(f)
         # Read N set entry uints.
-        v = set()
-        while set_entry_count:
-            v.add(read_uint32(f))
-            set_entry_count -= 1
-        d[k] = v
+        d[k] = set(_unpack_uint32s(f.read(4 * set_entry_count), set_entry_count))
         dict_entry_count -= 1
     return d
 
@@ -143,6 +176,28 @@ def write_dict_uint32_to_set_of_uint32s(f, d):
         for set_entry in v:
             write_uint32(f, set_entry)
 
+def read_packed_dict_uint32_to_set_of_uint32s(f):
+    keys = read_sorted_uint32s(f)
+    set_entry_counts = read_array_of_uint32s(f)
+    set_entries = read_array_of_uint32s(f)
+    d = {}
+    offset0 = 0
+    for k, set_entry_count in zip(keys, set_entry_counts):
+        offsetN = offset0 + set_entry_count
+        d[k] = set(set_entries[offset0:offsetN])
+        offset0 = offsetN
+    return d
+
+def write_packed_dict_uint32_to_set_of_uint32s(f, d):
+    """ The sorted keys, then the size of each key's set, then the entries of all the sets in one array. """
+    keys = sorted(d)
+    write_sorted_uint32s(f, keys)
+    write_array_of_uint32s(f, [ len(d[k]) for k in keys ])
+    set_entries = []
+    for k in keys:
+        set_entries.extend(d[k])
+    write_array_of_uint32s(f, set_entries)
+
 
 def read_dict_uint32_to_list_of_uint32s(f):
     # Read number of dictionary entries.
@@ -154,11 +209,7 @@ def read_dict_uint32_to_list_of_uint32s(f):
         # Read number of set entries 'N'.
         set_entry_count = read_uint16(f)
         # Read N set entry uints.
-        v = []
-        while set_entry_count:
-            v.append(read_uint32(f))
-            set_entry_count -= 1
-        d[k] = v
+        d[k] = list(_unpack_uint32s(f.read(4 * set_entry_count), set_entry_count))
         dict_entry_count -= 1
     return d
 
@@ -186,16 +237,11 @@ def read_dict_uint32_to_string(f):
     f.seek(4 * dict_entry_count, os.SEEK_CUR)
     strings_offset = f.tell()
     string_data = f.read(chunk_size - (strings_offset - chunk_size_offset))
-    string_file = cStringIO.StringIO(string_data)
     f.seek(values_offset, os.SEEK_SET)
-    d = {}
-    while dict_entry_count:
-        k = read_uint32(f)
-        v = read_string(string_file)
-        d[k] = v
-        dict_entry_count -= 1
+    keys = _unpack_uint32s(f.read(4 * dict_entry_count), dict_entry_count)
+    values = string_data.split("\0", dict_entry_count)[:dict_entry_count]
     f.seek(chunk_size_offset + chunk_size, os.SEEK_SET)
-    return d
+    return dict(zip(keys, values))
 
 def write_dict_uint32_to_string(f, d):
     # Write number of dictionary entries.
@@ -203,15 +249,9 @@ def write_dict_uint32_to_string(f, d):
     write_uint32(f, 0)
     write_uint32(f, len(d))
 
-    # Write keys, and collect values.
-    values = []
-    for k, v in d.iteritems():
-        values.append(v)
-        # Write key.
-        write_uint32(f, k)
-
-    # Write collected values.
-    for v in values:
+    # Write keys, then their values in the same order.
+    f.write(_pack_uint32s(d.keys()))
+    for v in d.itervalues():
         write_string(f, v)
 
     end_offset = f.tell()
@@ -284,6 +324,49 @@ if __name__ == "__main__":
 
             self.assertEqual(test_value, test_value2)
             self.assertEqual(write_offset, read_offset)
+
+        def test_array_of_uint32s(self):
+            test_value = tuple(random.randint(0, 0xFFFFFFFF) for v in range(random.randint(15, 30)))
+
+            f = cStringIO.StringIO()
+            write_array_of_uint32s(f, test_value)
+            write_offset = f.tell()
+
+            f.seek(0, os.SEEK_SET)
+            test_value2 = read_array_of_uint32s(f)
+            read_offset = f.tell()
+
+            self.assertEqual(test_value, test_value2)
+            self.assertEqual(write_offset, read_offset)
+
+        def test_sorted_uint32s(self):
+            test_value = set(random.randint(0, 0xFFFFFFFF) for v in range(random.randint(15, 30)))
+            test_value.update([ 0, 0x7F, 0x80, 0xFFFFFFFF ])
+
+            f = cStringIO.StringIO()
+            write_sorted_uint32s(f, test_value)
+            write_offset = f.tell()
+
+            f.seek(0, os.SEEK_SET)
+            test_value2 = read_sorted_uint32s(f)
+            read_offset = f.tell()
+
+            self.assertEqual(sorted(test_value), test_value2)
+            self.assertEqual(write_offset, read_offset)
+
+        def test_packed_dict_uint32_to_set_of_uint32s(self):
+            test_value = { 0xFFFFFFFF: set([ 0xFFFFFFFE, 1, 0xFFFFFFFF, 0 ]), 32: set([ 16, 8, 32, 64 ]), 33: set(), }
+
+            f = cStringIO.StringIO()
+            write_packed_dict_uint32_to_set_of_uint32s(f, test_value)
+            write_offset = f.tell()
+
+            f.seek(0, os.SEEK_SET)
+            test_value2 = read_packed_dict_uint32_to_set_of_uint32s(f)
+            read_offset = f.tell()
+
+            self.assertEqual(test_value, test_value2)
+            self.assertEqual(write_offset, read_offset)
     
     unittest.main()
 
@@ -60,6 +60,9 @@ SOURCE_CODE_FILTER = "Source code (*.s *.asm)"
 
 ERRMSG_BAD_NEW_PROJECT_OPTIONS = "ERRMSG_BAD_NEW_PROJECT_OPTIONS"
 
+# How long each slice of analysis continuing after loading may take, before the UI gets a turn.
+ANALYSIS_SLICE_MS = 20
+
 logger = logging.getLogger("UI")
 
 
@@ -188,6 +191,46 @@ class CustomItemModel(BaseItemModel):
         return len(self._row_data)
 
 
+class PagedItemModel(CustomItemModel):
+    """ Rows are obtained from the fetch function a page at a time, as the view scrolls to need them. """
+    page_size = 500
+
+    def __init__(self, columns, parent):
+        self._fetch_func = None
+        self._fetch_complete = True
+
+        super(PagedItemModel, self).__init__(columns, parent)
+
+    def _set_fetch_func(self, fetch_func):
+        # Any rows already fetched are replaced, rather than added to.
+        self.beginResetModel()
+        self._fetch_func = fetch_func
+        self._fetch_complete = False
+        self._row_data = []
+        self.endResetModel()
+        self.fetchMore(QtCore.QModelIndex())
+
+    def _clear_data(self):
+        self.beginResetModel()
+        self._fetch_func = None
+        self._fetch_complete = True
+        self._row_data = []
+        self.endResetModel()
+
+    def canFetchMore(self, parent):
+        return not self._fetch_complete
+
+    def fetchMore(self, parent):
+        if self._fetch_complete:
+            return
+        row_data = self._fetch_func(len(self._row_data), self.page_size)
+        if len(row_data) < self.page_size:
+            self._fetch_complete = True
+        if len(row_data):
+            row_count = len(self._row_data)
+            self._set_row_data(self._row_data + row_data, addition_rows=(row_count, row_count + len(row_data) - 1))
+
+
 def create_table_model(parent, columns, _class=None):
     if _class is None:
         _class = CustomItemModel
@@ -344,6 +387,10 @@ class QTUIEditorClient(editor_state.ClientAPI, QtCore.QObject):
         result = NewProjectDialog(options, self.file_path, self.owner_ref()).exec_()
         if result != QtGui.QDialog.Accepted:
             return ERRMSG_BAD_NEW_PROJECT_OPTIONS
+        # The loaded file can be viewed while the analysis continues in the background.
+        options.analysis_in_slices = True
+        # Opt-in, files analysed before are then loaded from where their analysed projects were stored.
+        options.analysis_cache_path = self.owner_ref()._get_setting("analysis-cache-path")
         return options
 
     def request_load_project_option_values(self, load_options):
@@ -411,13 +458,14 @@ class QTUIEditorClient(editor_state.ClientAPI, QtCore.QObject):
     ## Events related to prolonged actions (display of a progress dialog).
     # It is necessary to delegate these to the GUI thread via slots and signals.
 
-    def event_prolonged_action(self, active_client, title_msg_id, description_msg_id, can_cancel, step_count, abort_callback):
+    def event_prolonged_action(self, active_client, title_msg_id, description_msg_id, can_cancel, step_count, abort_callback, is_modal=True):
         args = (
             res.strings[title_msg_id],
             res.strings[description_msg_id],
             can_cancel,
             step_count,
-            abort_callback
+            abort_callback,
+            is_modal
         )
         self.prolonged_action_signal.emit(args)
 
@@ -517,6 +565,9 @@ class MainWindow(QtGui.QMainWindow):
 
         # State related to having something loaded.
         self.view_address_stack = []
+        # Analysis which continues after loading, gets a slice of time whenever the UI is idle.
+        self.analysis_timer = QtCore.QTimer(self)
+        self.analysis_timer.timeout.connect(self.on_analysis_timer)
 
     def closeEvent(self, event):
         """ Intercept the window close event and anything which needs to happen first. """
@@ -571,7 +622,7 @@ class MainWindow(QtGui.QMainWindow):
         # The "Uncertain Code References" list is currently hidden by default.
         dock = QtGui.QDockWidget("Uncertain Code References", self)
         dock.setAllowedAreas(QtCore.Qt.LeftDockWidgetArea | QtCore.Qt.RightDockWidgetArea)
-        self.uncertain_code_references_model = create_table_model(self, [ ("F", str), ("Address", hex), ("Value", hex), ("Source Code", str), ])
+        self.uncertain_code_references_model = create_table_model(self, [ ("F", str), ("Address", hex), ("Value", hex), ("Source Code", str), ], _class=PagedItemModel)
         self.uncertain_code_references_table = create_table_widget(dock, self.uncertain_code_references_model, multiselect=True)
         self.uncertain_code_references_table.setSortingEnabled(True) # Non-standard
         dock.setWidget(self.uncertain_code_references_table)
@@ -598,7 +649,7 @@ class MainWindow(QtGui.QMainWindow):
         # The "Uncertain Data References" list is currently hidden by default.
         dock = QtGui.QDockWidget("Uncertain Data References", self)
         dock.setAllowedAreas(QtCore.Qt.LeftDockWidgetArea | QtCore.Qt.RightDockWidgetArea)
-        self.uncertain_data_references_model = create_table_model(self, [ ("F", str), ("Address", hex), ("Value", hex), ("Source Code", str), ])
+        self.uncertain_data_references_model = create_table_model(self, [ ("F", str), ("Address", hex), ("Value", hex), ("Source Code", str), ], _class=PagedItemModel)
         self.uncertain_data_references_table = create_table_widget(dock, self.uncertain_data_references_model, multiselect=True)
         self.uncertain_data_references_table.setSortingEnabled(True) # Non-standard
         dock.setWidget(self.uncertain_data_references_table)
@@ -724,6 +775,7 @@ class MainWindow(QtGui.QMainWindow):
     def reset_state(self):
         """ Called to clear out all state related to loaded data. """
         self.setWindowTitle(APPLICATION_NAME)
+        self.analysis_timer.stop()
 
     def menu_file_open(self):
         if self.editor_state.in_loaded_state(self.editor_client):
@@ -955,27 +1007,44 @@ class MainWindow(QtGui.QMainWindow):
 
         ## UNCERTAIN REFERENCES
 
+        editor_state, editor_client = self.editor_state, self.editor_client
         def _lookup_cell_value(self, row, column):
             if column == 0:
                 return u"\u2713"
+            elif column == 3:
+                # Only render the source code for the rows which actually get displayed.
+                address = CustomItemModel._lookup_cell_value(self, row, 0)
+                return editor_state.get_source_code_for_address(editor_client, address)
             return CustomItemModel._lookup_cell_value(self, row, column-1)
 
-        results = self.editor_state.get_uncertain_code_references(self.editor_client)
+        def fetch_code_references(offset, limit):
+            return editor_state.get_uncertain_code_references(editor_client, offset, limit)
         self.uncertain_code_references_model._lookup_cell_value = new.instancemethod(_lookup_cell_value, self.uncertain_code_references_model, CustomItemModel)
-        self.uncertain_code_references_model._set_row_data(results, addition_rows=(0, len(results)-1))
+        self.uncertain_code_references_model._set_fetch_func(fetch_code_references)
         self.uncertain_code_references_table.resizeColumnsToContents()
         self.uncertain_code_references_table.horizontalHeader().setStretchLastSection(True)
 
-        results = self.editor_state.get_uncertain_data_references(self.editor_client)
+        def fetch_data_references(offset, limit):
+            return editor_state.get_uncertain_data_references(editor_client, offset, limit)
         self.uncertain_data_references_model._lookup_cell_value = new.instancemethod(_lookup_cell_value, self.uncertain_data_references_model, CustomItemModel)
-        self.uncertain_data_references_model._set_row_data(results, addition_rows=(0, len(results)-1))
+        self.uncertain_data_references_model._set_fetch_func(fetch_data_references)
         self.uncertain_data_references_table.resizeColumnsToContents()
         self.uncertain_data_references_table.horizontalHeader().setStretchLastSection(True)
 
         ## DONE LOADING ##
 
+        if self.editor_state.is_analysis_pending(self.editor_client):
+            self.analysis_timer.start(0)
+
         self.loaded_signal.emit(0)
 
+    def on_analysis_timer(self):
+        if self.editor_state.step_analysis(self.editor_client, ANALYSIS_SLICE_MS):
+            self.analysis_timer.stop()
+            # The uncertain references are only complete now.
+            for model in (self.uncertain_code_references_model, self.uncertain_data_references_model):
+                model._set_fetch_func(model._fetch_func)
+
     def on_pre_line_change(self, args):
         line0, line_count = args
         self.list_model._begin_row_change(line0, line_count)
@@ -1002,6 +1071,8 @@ class MainWindow(QtGui.QMainWindow):
         else:
             from_model = self.uncertain_data_references_model
         from_row_data = from_model._get_row_data()
+        # Only the rows fetched so far are removed.  Where the change extends past the last of them, the
+        # fetched rows from its address on are all removed, and the rest are paged in from there.
         removal_idx0 = None
         removal_idxN = len(from_row_data)
         for i, entry in enumerate(from_row_data):
@@ -1012,11 +1083,11 @@ class MainWindow(QtGui.QMainWindow):
                 break
             if removal_idx0 is None:
                 removal_idx0 = i
-        if removal_idx0 is None:
-            removal_idx0 = 0
-        from_row_data[removal_idx0:removal_idxN] = []
-        from_model._set_row_data(from_row_data, removal_rows=(removal_idx0, removal_idxN-1))
+        if removal_idx0 is not None:
+            from_row_data[removal_idx0:removal_idxN] = []
+            from_model._set_row_data(from_row_data, removal_rows=(removal_idx0, removal_idxN-1))
 
+        # Additions past the last fetched row are left for the paging to pick up, if there is more to page in.
         addition_rows = self.editor_state.get_uncertain_references_by_address(self.editor_client, address)
         if len(addition_rows):
             if data_type_to == "CODE":
@@ -1042,6 +1113,10 @@ class MainWindow(QtGui.QMainWindow):
                 to_idx += 1
             if len(insert_ranges):
                 to_model._set_row_data(to_row_data, addition_rows=(insert_ranges[-1][0], insert_ranges[-1][1]))
+            if from_idx < len(addition_rows) and to_model._fetch_complete:
+                row_count = len(to_row_data)
+                to_row_data.extend(addition_rows[from_idx:])
+                to_model._set_row_data(to_row_data, addition_rows=(row_count, len(to_row_data)-1))
 
     # TODO: FIX
     def _add_symbol_to_model(self, symbol_address, symbol_label, row_index=None):
@@ -1052,9 +1127,9 @@ class MainWindow(QtGui.QMainWindow):
         model.setData(model.index(row_index, 1, QtCore.QModelIndex()), "%X" % symbol_address)
 
     def show_progress_dialog(self, args):
-        title, description, can_cancel, step_count, abort_callback = args
+        title, description, can_cancel, step_count, abort_callback, is_modal = args
 
-        # Display a modal dialog.
+        # Display a modal dialog, unless the user can keep working during the action.
         d = self._progress_dialog = QtGui.QProgressDialog(self)
         self._progress_dialog_steps = step_count
         if can_cancel:
@@ -1064,7 +1139,7 @@ class MainWindow(QtGui.QMainWindow):
         d.setWindowTitle(title)
         d.setLabelText(description)
         d.setAutoClose(True)
-        d.setWindowModality(QtCore.Qt.WindowModal)
+        d.setWindowModality(QtCore.Qt.WindowModal if is_modal else QtCore.Qt.NonModal)
         d.setRange(0, step_count)
         d.setMinimumDuration(1000)
         d.setValue(0)
@@ -1307,6 +1382,8 @@ class SaveProjectDialog(QtGui.QDialog):
 
         ## File options layout.
         inputdata_groupbox = _make_inputdata_options(self, "File Options", save_options.cache_input_file)
+        self.compress_checkbox = QtGui.QCheckBox("Compress saved work, making it smaller but slower to load.")
+        self.compress_checkbox.setChecked(save_options.compress_hunks)
 
         ## Buttons layout.
         save_button = QtGui.QPushButton("Save")
@@ -1321,11 +1398,13 @@ class SaveProjectDialog(QtGui.QDialog):
         ## Outer layout.
         outer_vertical_layout = QtGui.QVBoxLayout()
         outer_vertical_layout.addWidget(inputdata_groupbox)
+        outer_vertical_layout.addWidget(self.compress_checkbox)
         outer_vertical_layout.addLayout(buttons_layout)
         self.setLayout(outer_vertical_layout)
 
     def accept(self):
         self.save_options.cache_input_file = self.inputdata_do_radio.isChecked()
+        self.save_options.compress_hunks = self.compress_checkbox.isChecked()
         return super(SaveProjectDialog, self).accept()
 
 
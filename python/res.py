@@ -14,10 +14,13 @@ class EnglishStrings(BaseResource):
     TEXT_LOAD_DISASSEMBLY_PASS = "Disassembly pass"
     TEXT_LOAD_POSTPROCESSING = "Postprocessing"
     TEXT_LOAD_READING_PROJECT_DATA = "Reading project data"
+    TEXT_SAVE_WRITING_PROJECT_DATA = "Writing project data"
 
+    TITLE_COMPLETING_ANALYSIS = "Completing analysis"
     TITLE_DATA_TYPE_CHANGE = "Data type change"
     TITLE_LOADING_FILE = "Loading file"
     TITLE_LOADING_PROJECT = "Loading project"
+    TITLE_SAVING_PROJECT = "Saving project"
 
 strings = EnglishStrings()
 
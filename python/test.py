@@ -20,17 +20,27 @@
 Unit testing.
 """
 
+import json
 import logging
 import os
+import pickle
 import random
+import shutil
+import StringIO
+import struct
 import sys
+import tempfile
 import types
 import unittest
 
 import disassembly
+import disassembly_data
+import disassembly_persistence
 import editor_state
+import loaderlib
 import qtui
 import toolapi
+import util
 
 
 LOGGING_SPAM = False
@@ -145,6 +155,945 @@ class TOOL_UncertainReferenceModification_TestCase(unittest.TestCase):
                 break
 
 
+    def test_paged_uncertain_references(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        # Break the hunk file magic, so that the loaded file is treated as a binary file.
+        INPUT_FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        with open(INPUT_FILE_NAME, "rb") as f:
+            file_data = f.read()
+        fd, FILE_NAME = tempfile.mkstemp()
+        try:
+            os.write(fd, "\x4e\x71\x4e\x71"+ file_data[4:])
+            os.close(fd)
+            result = self.toolapiob.load_binary_file(FILE_NAME, "m68k", 0, 0x30)
+        finally:
+            os.remove(FILE_NAME)
+        if type(result) in types.StringTypes:
+            self.fail("loading error ('%s')" % result)
+
+        # A page only has the blocks up to its end located.
+        program_data = self.toolapiob.editor_state.disassembly_data
+        first_page = self.toolapiob.get_uncertain_data_references(0, 10)
+        self.assertTrue(len(program_data.uncertain_reference_counts[False]) < len(program_data.blocks))
+
+        data_references = self.toolapiob.get_uncertain_data_references()
+        self.assertEqual(data_references[:10], first_page)
+        self.assertEqual(len(data_references), self.toolapiob.get_uncertain_data_reference_count())
+        self.assertEqual(data_references[30:100], self.toolapiob.get_uncertain_data_references(30, 70))
+        self.assertEqual(data_references[-5:], self.toolapiob.get_uncertain_data_references(len(data_references)-5, 70))
+        self.assertEqual([], self.toolapiob.get_uncertain_data_references(len(data_references), 70))
+
+        code_references = self.toolapiob.get_uncertain_code_references()
+        self.assertEqual(len(code_references), self.toolapiob.get_uncertain_code_reference_count())
+        self.assertEqual(code_references[:1], self.toolapiob.get_uncertain_code_references(0, 1))
+
+        # Pages reflect the blocks changed since they were counted.
+        self.toolapiob.set_datatype(data_references[40][0], "code")
+        data_references = self.toolapiob.get_uncertain_data_references()
+        self.assertEqual(len(data_references), self.toolapiob.get_uncertain_data_reference_count())
+        self.assertEqual(data_references[30:100], self.toolapiob.get_uncertain_data_references(30, 70))
+        code_references = self.toolapiob.get_uncertain_code_references()
+        self.assertEqual(len(code_references), self.toolapiob.get_uncertain_code_reference_count())
+        self.assertEqual(code_references[1:5], self.toolapiob.get_uncertain_code_references(1, 4))
+
+
+class TOOL_AsciiStrings_TestCase(unittest.TestCase):
+    def setUp(self):
+        self.toolapiob = toolapi.ToolAPI()
+
+    def tearDown(self):
+        self.toolapiob = None
+
+    def test_find_and_set_ascii_strings(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        result = self.toolapiob.load_file(FILE_NAME)
+        if type(result) in types.StringTypes:
+            self.fail("loading error ('%s')" % result)
+
+        strings = self.toolapiob.find_ascii_strings()
+        self.assertIn((0x788, len("Back from GDB breakpoint\n\x00")), strings)
+
+        self.toolapiob.set_datatype_ascii_for_strings(strings)
+        for address, length in strings:
+            self.assertEqual("ascii", self.toolapiob.get_data_type_for_address(address))
+            self.assertEqual("ascii", self.toolapiob.get_data_type_for_address(address + length - 1))
+        self.assertEqual([], self.toolapiob.find_ascii_strings())
+
+
+class TOOL_CodeCandidates_TestCase(unittest.TestCase):
+    def setUp(self):
+        self.toolapiob = toolapi.ToolAPI()
+
+    def tearDown(self):
+        self.toolapiob = None
+
+    def test_find_and_set_code_candidates(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        result = self.toolapiob.load_file(FILE_NAME)
+        if type(result) in types.StringTypes:
+            self.fail("loading error ('%s')" % result)
+
+        candidates = self.toolapiob.find_code_candidates()
+        self.assertNotEqual([], candidates)
+        self.assertEqual(sorted(candidates, key=lambda candidate: -candidate[2]), candidates)
+        self.assertEqual(candidates, self.toolapiob.find_code_candidates(process_count=2))
+        # The text of "Back from GDB breakpoint\n" is not code.
+        for address, length, score in candidates:
+            self.assertFalse(address <= 0x788 < address + length)
+
+        self.toolapiob.set_datatype_code_for_candidates(candidates)
+        self.assertEqual("code", self.toolapiob.get_data_type_for_address(candidates[0][0]))
+        self.assertLess(len(self.toolapiob.find_code_candidates()), len(candidates))
+
+    def test_undecodable_instructions_not_modelled(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        result = self.toolapiob.load_file(FILE_NAME)
+        if type(result) in types.StringTypes:
+            self.fail("loading error ('%s')" % result)
+        program_data = self.toolapiob.editor_state.disassembly_data
+        key_frequencies = disassembly._get_instruction_key_frequencies(program_data)
+
+        # Instructions which no longer decode are left out of the model.
+        program_data.instruction_cache.clear()
+        program_data.dis_disassemble_one_line_func = lambda data, data_offset, address: (None, data_offset)
+        self.assertEqual({}, disassembly._get_instruction_key_frequencies(program_data))
+        self.assertNotEqual({}, key_frequencies)
+
+
+class TOOL_SlicedAnalysis_TestCase(unittest.TestCase):
+    def test_sliced_analysis_matches_whole(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        whole_toolapiob = toolapi.ToolAPI()
+        result = whole_toolapiob.load_file(FILE_NAME)
+        if type(result) in types.StringTypes:
+            self.fail("loading error ('%s')" % result)
+        self.assertFalse(whole_toolapiob.is_analysis_pending())
+
+        sliced_toolapiob = toolapi.ToolAPI()
+        result = sliced_toolapiob.load_file(FILE_NAME, analysis_in_slices=True)
+        if type(result) in types.StringTypes:
+            self.fail("loading error ('%s')" % result)
+        self.assertTrue(sliced_toolapiob.is_analysis_pending())
+        # What there is so far can be looked at, in between slices.
+        entrypoint_address = disassembly.get_entrypoint_address(sliced_toolapiob.editor_state.disassembly_data)
+        while not sliced_toolapiob.step_analysis(0.1):
+            sliced_toolapiob.get_source_code_for_address(entrypoint_address)
+        self.assertFalse(sliced_toolapiob.is_analysis_pending())
+
+        whole_data = whole_toolapiob.editor_state.disassembly_data
+        sliced_data = sliced_toolapiob.editor_state.disassembly_data
+        line_count = disassembly.get_file_line_count(whole_data)
+        self.assertEqual(line_count, disassembly.get_file_line_count(sliced_data))
+        self.assertEqual(whole_data.symbols_by_address, sliced_data.symbols_by_address)
+        for line_idx in range(line_count):
+            self.assertEqual(whole_toolapiob.editor_state.get_row_for_line_number(None, line_idx), sliced_toolapiob.editor_state.get_row_for_line_number(None, line_idx))
+
+
+class ProjectFileTestCase(unittest.TestCase):
+    """ Loads the gdbstop test file, with a temporary directory to save projects of it in. """
+    def setUp(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+        self.input_file_path = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        self.temp_path = tempfile.mkdtemp()
+        self.toolapiob = toolapi.ToolAPI()
+
+    def tearDown(self):
+        self.toolapiob = None
+        shutil.rmtree(self.temp_path)
+
+    def load_input_file(self, toolapiob=None, **kwargs):
+        if toolapiob is None:
+            toolapiob = self.toolapiob
+        result = toolapiob.load_file(self.input_file_path, **kwargs)
+        if type(result) in types.StringTypes:
+            self.fail("loading error ('%s')" % result)
+        return toolapiob.editor_state.disassembly_data
+
+    def save_project(self, program_data, file_name="gdbstop.psproj", cache_input_file=True, compress_hunks=False):
+        project_file_path = os.path.join(self.temp_path, file_name)
+        save_options = disassembly.get_save_project_options(program_data)
+        save_options.compress_hunks = compress_hunks
+        with open(self.input_file_path, "rb") as input_file:
+            if cache_input_file:
+                save_options.input_file = input_file
+            with open(project_file_path, "wb") as f:
+                disassembly.save_project_file(f, program_data, save_options)
+        return project_file_path
+
+    def load_project(self, project_file_path, read_deferred_data=False):
+        with open(project_file_path, "rb") as f:
+            program_data, line_count = disassembly.load_project_file(f, "gdbstop")
+            if read_deferred_data:
+                disassembly.read_deferred_project_data(program_data)
+        return program_data, line_count
+
+    def save_and_load_project(self, program_data, **kwargs):
+        """ Returns the loaded program data and line count, and the project file path. """
+        read_deferred_data = kwargs.pop("read_deferred_data", False)
+        project_file_path = self.save_project(program_data, **kwargs)
+        program_data, line_count = self.load_project(project_file_path, read_deferred_data)
+        return program_data, line_count, project_file_path
+
+    def assertSameProject(self, program_data, other_program_data):
+        self.assertEqual(program_data.symbols_by_address, other_program_data.symbols_by_address)
+        self.assertEqual(program_data.branch_addresses, other_program_data.branch_addresses)
+        self.assertEqual(program_data.reference_addresses, other_program_data.reference_addresses)
+        line_count = disassembly.get_file_line_count(program_data)
+        self.assertEqual(line_count, disassembly.get_file_line_count(other_program_data))
+        for line_idx in range(line_count):
+            for column_idx in range(disassembly.LI_OPERANDS+1):
+                self.assertEqual(disassembly.get_file_line(program_data, line_idx, column_idx), disassembly.get_file_line(other_program_data, line_idx, column_idx))
+
+
+class TOOL_AnalysisCheckpoint_TestCase(ProjectFileTestCase):
+    def test_resume_saved_analysis(self):
+        whole_data = self.load_input_file()
+
+        partial_toolapiob = toolapi.ToolAPI()
+        program_data = self.load_input_file(partial_toolapiob, analysis_in_slices=True)
+        partial_toolapiob.step_analysis(0)
+        self.assertTrue(partial_toolapiob.is_analysis_pending())
+        project_file_path = self.save_project(program_data)
+
+        resumed_toolapiob = toolapi.ToolAPI()
+        result = resumed_toolapiob.load_file(project_file_path, analysis_in_slices=True)
+        if type(result) in types.StringTypes:
+            self.fail("loading error ('%s')" % result)
+        self.assertTrue(resumed_toolapiob.is_analysis_pending())
+        self.assertTrue(resumed_toolapiob.step_analysis())
+        self.assertSameProject(whole_data, resumed_toolapiob.editor_state.disassembly_data)
+
+
+class TOOL_DeferredProjectLoad_TestCase(ProjectFileTestCase):
+    def test_project_read_on_first_use(self):
+        program_data = self.load_input_file()
+        line_count = disassembly.get_file_line_count(program_data)
+
+        loaded_program_data, loaded_line_count, project_file_path = self.save_and_load_project(program_data)
+        self.assertEqual(line_count, loaded_line_count)
+        self.assertIn("symbols_by_address", loaded_program_data.deferred_attributes)
+        self.assertTrue(any(block.deferred_line_data is not None for block in loaded_program_data.blocks))
+        self.assertSameProject(program_data, loaded_program_data)
+
+        # Saving over the file being read from, needs what is left in it read first.
+        loaded_program_data, loaded_line_count, project_file_path = self.save_and_load_project(program_data)
+        disassembly.read_deferred_project_data(loaded_program_data)
+        resaved_program_data, resaved_line_count, project_file_path = self.save_and_load_project(loaded_program_data)
+        self.assertEqual(line_count, resaved_line_count)
+        self.assertSameProject(program_data, resaved_program_data)
+
+
+class TOOL_IncrementalSave_TestCase(ProjectFileTestCase):
+    def test_journal_appended_and_loaded(self):
+        program_data = self.load_input_file()
+        loaded_program_data, line_count, project_file_path = self.save_and_load_project(program_data)
+        file_size = os.path.getsize(project_file_path)
+
+        # Renaming a label only appends the symbol that changed.
+        address = sorted(program_data.symbols_by_address)[0]
+        disassembly.set_symbol_for_address(loaded_program_data, address, "renamed_label")
+        with open(project_file_path, "r+b") as f:
+            self.assertTrue(disassembly.save_project_file_incrementally(f, loaded_program_data))
+        self.assertLess(os.path.getsize(project_file_path) - file_size, 200)
+
+        # Changing a data type appends the blocks that changed.
+        disassembly.set_data_type_at_address(loaded_program_data, address, disassembly_data.DATA_TYPE_LONGWORD)
+        with open(project_file_path, "r+b") as f:
+            self.assertTrue(disassembly.save_project_file_incrementally(f, loaded_program_data))
+
+        resaved_program_data, resaved_line_count = self.load_project(project_file_path)
+        self.assertEqual(disassembly.get_file_line_count(loaded_program_data), resaved_line_count)
+        self.assertEqual("renamed_label", resaved_program_data.symbols_by_address[address])
+        self.assertSameProject(loaded_program_data, resaved_program_data)
+
+
+class TOOL_CompressedProject_TestCase(ProjectFileTestCase):
+    def test_compressed_project_matches_uncompressed(self):
+        program_data = self.load_input_file()
+
+        file_sizes = []
+        loaded_program_datas = []
+        for compress_hunks in (False, True):
+            file_name = "gdbstop-%d.psproj" % compress_hunks
+            loaded_program_data, line_count, project_file_path = self.save_and_load_project(program_data, file_name=file_name, compress_hunks=compress_hunks, read_deferred_data=True)
+            file_sizes.append(os.path.getsize(project_file_path))
+            loaded_program_datas.append(loaded_program_data)
+
+        self.assertLess(file_sizes[1], file_sizes[0])
+        uncompressed_data, compressed_data = loaded_program_datas
+        self.assertTrue(compressed_data.input_file_cached)
+        self.assertSameProject(uncompressed_data, compressed_data)
+
+
+class TOOL_PersistedRelocations_TestCase(ProjectFileTestCase):
+    def test_project_load_relocates_without_loader(self):
+        program_data = self.load_input_file()
+        segments = program_data.loader_segments
+
+        def fail_load_file(*args, **kwargs):
+            self.fail("loader was run on project load")
+
+        loaded_program_datas = []
+        for cache_input_file in (True, False):
+            project_file_path = self.save_project(program_data, cache_input_file=cache_input_file)
+            original_load_file = loaderlib.load_file
+            loaderlib.load_file = fail_load_file
+            try:
+                loaded_program_data, line_count = self.load_project(project_file_path)
+            finally:
+                loaderlib.load_file = original_load_file
+            if not cache_input_file:
+                with open(self.input_file_path, "rb") as input_file:
+                    disassembly.cache_segment_data(loaded_program_data, input_file)
+            loaded_program_datas.append(loaded_program_data)
+
+        for loaded_program_data in loaded_program_datas:
+            self.assertEqual(program_data.loader_relocatable_addresses, loaded_program_data.loader_relocatable_addresses)
+            for segment_id in range(len(segments)):
+                self.assertEqual(loaderlib.get_segment_data(segments, segment_id), loaderlib.get_segment_data(loaded_program_data.loader_segments, segment_id))
+
+    def test_overlapping_relocations_keep_their_order(self):
+        data_types = loaderlib.get_system_data_types(loaderlib.amiga.__name__)
+        # The carry from the first longword relocated, is lost if they are relocated in the other order.
+        relocations = [ [ (0, [ 2, 0 ]) ] ]
+        f = StringIO.StringIO()
+        disassembly_persistence.write_relocations(f, relocations)
+        f.seek(0)
+        loaded_relocations = disassembly_persistence.read_relocations(f)
+        self.assertEqual(relocations, loaded_relocations)
+
+        data = bytearray("\x00\x00\xFF\xFF\xFF\xFF\x00\x00")
+        loaderlib._relocate_longwords_sequentially(data, data_types, loaded_relocations[0][0][1], 1)
+        self.assertEqual(bytearray("\x00\x00\x00\x01\x00\x00\x00\x00"), data)
+
+
+class TOOL_LoaderInternalData_TestCase(ProjectFileTestCase):
+    def test_internal_data_persisted_without_pickling(self):
+        OLD_PROJECT_FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "project-compatibility", "gdbstop.psproj")
+        program_data = self.load_input_file()
+        self.assertTrue(len(program_data.loader_internal_data))
+
+        # Projects saved with pickled loader data are still read.
+        toolapiob = toolapi.ToolAPI()
+        result = toolapiob.load_file(OLD_PROJECT_FILE_NAME, self.input_file_path)
+        if type(result) in types.StringTypes:
+            self.fail("loading error ('%s')" % result)
+        self.assertEqual(program_data.loader_internal_data, toolapiob.editor_state.disassembly_data.loader_internal_data)
+
+        loaded_program_data, line_count, project_file_path = self.save_and_load_project(program_data, cache_input_file=False)
+        self.assertEqual(program_data.loader_internal_data, loaded_program_data.loader_internal_data)
+
+        # Systems that persist no data save nothing.
+        for system_name in (loaderlib.atarist.__name__, loaderlib.human68k.__name__, loaderlib.binary.__name__):
+            loaded_program_data.loader_system_name = system_name
+            f = StringIO.StringIO()
+            disassembly_persistence.save_loaderinternaldata_hunk(f, loaded_program_data)
+            self.assertEqual("", f.getvalue())
+
+
+class TOOL_AnalysisCache_TestCase(ProjectFileTestCase):
+    def test_repeat_load_from_cache(self):
+        cache_path = self.temp_path
+        program_data = self.load_input_file(analysis_cache_path=cache_path)
+        self.assertTrue("loader" in program_data.phase_times)
+        self.assertEqual(1, len(os.listdir(cache_path)))
+        # Storing the entry leaves the project to be saved by the user.
+        self.assertEqual(0, disassembly.get_project_save_count(program_data))
+
+        cached_program_data = self.load_input_file(toolapi.ToolAPI(), analysis_cache_path=cache_path)
+        self.assertFalse("loader" in cached_program_data.phase_times)
+        self.assertFalse(disassembly.is_code_analysis_pending(cached_program_data))
+        self.assertEqual(0, disassembly.get_project_save_count(cached_program_data))
+        self.assertSameProject(program_data, cached_program_data)
+
+        # Different options are a different entry.
+        with open(self.input_file_path, "rb") as f:
+            input_file = loaderlib.ingest_file(f)
+        new_options = disassembly.get_new_project_options(program_data)
+        new_options.is_binary_file = True
+        new_options.dis_name, new_options.loader_load_address, new_options.loader_entrypoint_offset = "m68k", 0, 0
+        cache_file_path = disassembly.get_analysis_cache_file_path(cache_path, input_file, new_options)
+        self.assertFalse(os.path.exists(cache_file_path))
+        new_options.loader_load_address = 0x1000
+        self.assertNotEqual(cache_file_path, disassembly.get_analysis_cache_file_path(cache_path, input_file, new_options))
+
+    def test_edits_during_analysis_not_cached(self):
+        cache_path = self.temp_path
+        program_data = self.load_input_file(analysis_in_slices=True, analysis_cache_path=cache_path)
+        address = disassembly.get_entrypoint_address(program_data)
+        disassembly.set_symbol_for_address(program_data, address, "renamed")
+        self.toolapiob.step_analysis()
+        self.assertFalse(disassembly.is_code_analysis_pending(program_data))
+        self.assertEqual([], os.listdir(cache_path))
+
+    def test_least_recently_used_evicted(self):
+        cache_path = self.temp_path
+        for i in range(4):
+            with open(os.path.join(cache_path, "%d%s" % (i, disassembly.ANALYSIS_CACHE_SUFFIX)), "wb") as f:
+                f.write("x" * 100)
+            os.utime(f.name, (1000 + i, 1000 + i))
+        # Other files are left alone.
+        with open(os.path.join(cache_path, "other"), "wb") as f:
+            f.write("x" * 1000)
+        # Kept entries are kept, even if older.
+        disassembly.evict_analysis_cache_entries(cache_path, 250, os.path.join(cache_path, "0"+ disassembly.ANALYSIS_CACHE_SUFFIX))
+        self.assertEqual([ "0.psproj", "3.psproj", "other" ], sorted(os.listdir(cache_path)))
+
+
+class TOOL_PersistedLineLayout_TestCase(ProjectFileTestCase):
+    def test_project_load_decodes_no_instructions(self):
+        program_data = self.load_input_file()
+        loaded_program_data, line_count, project_file_path = self.save_and_load_project(program_data, read_deferred_data=True)
+
+        self.assertEqual(0, loaded_program_data.stats["instructions_decoded"])
+        self.assertEqual(len(program_data.blocks), len(loaded_program_data.blocks))
+        for block, loaded_block in zip(program_data.blocks, loaded_program_data.blocks):
+            if disassembly_data.get_block_data_type(block) == disassembly_data.DATA_TYPE_CODE:
+                self.assertEqual(block.line_data.lengths, loaded_block.line_data.lengths)
+                self.assertEqual(block.line_data.flags, loaded_block.line_data.flags)
+                self.assertEqual(block.line_data.comments, loaded_block.line_data.comments)
+
+
+class TOOL_SnapshotSave_TestCase(ProjectFileTestCase):
+    def test_snapshot_saved_while_changes_continue(self):
+        program_data = self.load_input_file()
+        address = sorted(program_data.symbols_by_address)[0]
+        symbol_name = program_data.symbols_by_address[address]
+        project_file_path = os.path.join(self.temp_path, "gdbstop.psproj")
+
+        save_options = disassembly.get_save_project_options(program_data)
+        snapshot = disassembly.snapshot_project_data(program_data)
+        # Changes made after the snapshot is taken, are not saved with it.
+        disassembly.set_symbol_for_address(program_data, address, "renamed_label")
+        with open(self.input_file_path, "rb") as input_file:
+            save_options.input_file = input_file
+            self.assertTrue(disassembly.save_project_snapshot(project_file_path, snapshot, save_options))
+        disassembly.finish_project_snapshot(program_data, snapshot, True)
+        self.assertEqual(set([ address ]), program_data.unsaved_symbol_addresses)
+        loaded_program_data, line_count = self.load_project(project_file_path)
+        self.assertEqual(symbol_name, loaded_program_data.symbols_by_address[address])
+
+        # They are left to be appended to the saved project file.
+        with open(project_file_path, "r+b") as f:
+            self.assertTrue(disassembly.save_project_file_incrementally(f, program_data))
+        loaded_program_data, line_count = self.load_project(project_file_path)
+        self.assertEqual("renamed_label", loaded_program_data.symbols_by_address[address])
+
+        # A cancelled save leaves the project file as it was, and the changes still unsaved.
+        file_size = os.path.getsize(project_file_path)
+        disassembly.set_symbol_for_address(program_data, address, "renamed_label_again")
+        snapshot = disassembly.snapshot_project_data(program_data)
+        work_state = editor_state.WorkState()
+        work_state.cancel()
+        self.assertFalse(disassembly.save_project_snapshot(project_file_path, snapshot, disassembly.get_save_project_options(program_data), work_state=work_state))
+        disassembly.finish_project_snapshot(program_data, snapshot, False)
+        self.assertEqual(set([ address ]), program_data.unsaved_symbol_addresses)
+        self.assertEqual(file_size, os.path.getsize(project_file_path))
+        self.assertEqual([ "gdbstop.psproj" ], os.listdir(self.temp_path))
+
+
+class TOOL_IngestFile_TestCase(unittest.TestCase):
+    def test_input_file_read_once(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        with open(FILE_NAME, "rb") as input_file:
+            file_data = input_file.read()
+            checksum = util.calculate_file_checksum(input_file)
+            # Mapped into memory, or read from a file object that cannot be.
+            for ingested_file in (loaderlib.ingest_file(input_file), loaderlib.ingest_file(StringIO.StringIO(file_data))):
+                self.assertEqual(checksum, ingested_file.checksum)
+                self.assertEqual(len(file_data), ingested_file.size)
+                self.assertEqual(file_data, ingested_file.read())
+
+            ingested_file = loaderlib.ingest_file(input_file)
+            file_info, result = loaderlib.identify_file(ingested_file)
+            # Loading reuses what identification loaded.
+            self.assertIs(file_info, loaderlib.load_file(ingested_file)[0])
+            new_options = disassembly.get_new_project_options(None)
+            new_options.is_binary_file = False
+            program_data, line_count = disassembly.load_file(ingested_file, new_options, "gdbstop")
+            input_file.seek(0, os.SEEK_SET)
+            file_program_data, file_line_count = disassembly.load_file(input_file, new_options, "gdbstop")
+
+        self.assertEqual(checksum, program_data.file_checksum)
+        self.assertEqual(len(file_data), program_data.file_size)
+        self.assertEqual(file_line_count, line_count)
+        for line_idx in range(line_count):
+            for column_idx in range(5):
+                self.assertEqual(disassembly.get_file_line(file_program_data, line_idx, column_idx), disassembly.get_file_line(program_data, line_idx, column_idx))
+
+
+class TOOL_SniffFile_TestCase(unittest.TestCase):
+    def test_only_matching_systems_are_ranked(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        with open(FILE_NAME, "rb") as input_file:
+            file_data = input_file.read()
+        self.assertEqual([ (100, loaderlib.amiga.__name__) ], loaderlib.sniff_file(StringIO.StringIO(file_data)))
+        # A hunk header that cannot be an executable is less certain, but still tried.
+        self.assertEqual([ (50, loaderlib.amiga.__name__) ], loaderlib.sniff_file(StringIO.StringIO(file_data[:4] + "\xFF" * 60)))
+        # Data no system recognises is not parsed by any of them.
+        self.assertEqual([], loaderlib.sniff_file(StringIO.StringIO("\0" * 1024)))
+        self.assertEqual(None, loaderlib.identify_file(StringIO.StringIO("\0" * 1024)))
+        self.assertEqual(None, loaderlib.load_file(StringIO.StringIO("\0" * 1024)))
+        # The binary system is only used when chosen.
+        loader_options = loaderlib.BinaryFileOptions()
+        loader_options.dis_name = "m68k"
+        loader_options.load_address = 0
+        loader_options.entrypoint_offset = 0
+        file_info, data_types = loaderlib.load_file(StringIO.StringIO("\0" * 1024), loader_options)
+        self.assertEqual(loaderlib.binary.__name__, file_info.system.system_name)
+
+
+class TOOL_MappedSegmentData_TestCase(unittest.TestCase):
+    def test_mapped_data_reads_like_copied_data(self):
+        file_data = "".join(chr(random.randint(0, 255)) for i in xrange(loaderlib.MAPPED_SEGMENT_DATA_SIZE + 100))
+        loader_options = loaderlib.BinaryFileOptions()
+        loader_options.dis_name = "m68k"
+        loader_options.load_address = 0x10000
+        loader_options.entrypoint_offset = 0
+        # Overlapping longwords are relocated as well.
+        relocations = [ [ (0, [ 0, 8, 10, 5000, len(file_data) - 4 ]), (0, [ 2000, 100, 6000 ]) ] ]
+
+        with tempfile.TemporaryFile() as input_file:
+            input_file.write(file_data)
+            input_file.flush()
+            segment_datas = []
+            ingested_file = loaderlib.ingest_file(input_file)
+            # Input files other than project files are copied, as they may be rebuilt while in use.
+            file_info, data_types = loaderlib.load_file(ingested_file, loader_options)
+            loaderlib.cache_segment_data(ingested_file, file_info.segments, 0)
+            self.assertIsInstance(loaderlib.get_segment_data(file_info.segments, 0), bytearray)
+
+            for f in (ingested_file, StringIO.StringIO(file_data)):
+                file_info, data_types = loaderlib.load_file(f, loader_options)
+                loaderlib.cache_segment_data(f, file_info.segments, 0, map_data=True)
+                relocatable_addresses, relocated_addresses = set(), set()
+                loaderlib.relocate_segment_data(file_info.segments, data_types, relocations, relocatable_addresses, relocated_addresses)
+                segment_datas.append((loaderlib.get_segment_data(file_info.segments, 0), relocatable_addresses, relocated_addresses))
+
+        (mapped_data, mapped_relocatable, mapped_relocated), (data, relocatable, relocated) = segment_datas
+        self.assertIsInstance(mapped_data, loaderlib.MappedSegmentData)
+        self.assertIsInstance(data, bytearray)
+        self.assertEqual(relocatable, mapped_relocatable)
+        self.assertEqual(relocated, mapped_relocated)
+        self.assertEqual(data, mapped_data[:])
+        self.assertEqual(len(data), len(mapped_data))
+        for idx in range(0, 16) + range(4990, 5010) + [ len(data) - 1, -1 ]:
+            self.assertEqual(data[idx], mapped_data[idx])
+        self.assertEqual(data[6:13], mapped_data[6:13])
+        self.assertEqual(data.find(data[5002:5006], 100), mapped_data.find(data[5002:5006], 100))
+        self.assertEqual(data_types.uint32_value_array(data, 8, 3), data_types.uint32_value_array(mapped_data, 8, 3))
+        self.assertEqual(data, pickle.loads(pickle.dumps(mapped_data)))
+
+        segments = [ [ None ] * loaderlib.SIZEOF_SI ]
+        segments[0][loaderlib.SI_CACHED_DATA] = mapped_data
+        loaderlib.copy_segment_data(segments)
+        self.assertIsInstance(loaderlib.get_segment_data(segments, 0), bytearray)
+        self.assertEqual(data, loaderlib.get_segment_data(segments, 0))
+
+
+class TOOL_BulkRelocation_TestCase(unittest.TestCase):
+    def test_bulk_relocation_matches_sequential(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        with open(FILE_NAME, "rb") as input_file:
+            file_info, data_types = loaderlib.load_file(input_file)
+            segments = file_info.segments
+            for segment_id in range(len(segments)):
+                loaderlib.cache_segment_data(input_file, segments, segment_id)
+        relocations = file_info.relocations_by_segment_id
+        self.assertTrue(sum(len(local_offsets) for segment_relocations in relocations for target_segment_id, local_offsets in segment_relocations))
+
+        # Relocate copies of the segment data a longword at a time, as a reference.
+        expected_datas = [ None if segment[loaderlib.SI_CACHED_DATA] is None else bytearray(segment[loaderlib.SI_CACHED_DATA]) for segment in segments ]
+        expected_relocatable_addresses, expected_relocated_addresses = set(), set()
+        for segment_id, segment_relocations in enumerate(relocations):
+            data = expected_datas[segment_id]
+            for target_segment_id, local_offsets in segment_relocations:
+                for local_offset in local_offsets:
+                    address = data_types.uint32_value(data[local_offset:local_offset+4]) + loaderlib.get_segment_address(segments, target_segment_id)
+                    data[local_offset:local_offset+4] = data_types.uint32_bytes(address)
+                    expected_relocated_addresses.add(address)
+                    expected_relocatable_addresses.add(loaderlib.get_segment_address(segments, segment_id) + local_offset)
+
+        relocatable_addresses, relocated_addresses = set(), set()
+        loaderlib.relocate_segment_data(segments, data_types, relocations, relocatable_addresses, relocated_addresses)
+        self.assertEqual(expected_relocatable_addresses, relocatable_addresses)
+        self.assertEqual(expected_relocated_addresses, relocated_addresses)
+        for segment_id in range(len(segments)):
+            self.assertEqual(expected_datas[segment_id], loaderlib.get_segment_data(segments, segment_id))
+
+
+class TOOL_FileReader_TestCase(unittest.TestCase):
+    def test_reader_values(self):
+        data_types = loaderlib.DataTypes(True)
+        file_data = "PAD" + struct.pack(">HI3H2I", 0x601A, 0x12345678, 1, 2, 3, 4, 5) + "name\0rest"
+        for f in (StringIO.StringIO(file_data), loaderlib.ingest_file(StringIO.StringIO(file_data))):
+            reader = data_types.get_file_reader(f, 3, len(file_data) - 3 - 2)
+            self.assertEqual(0x601A, reader.read_uint16())
+            self.assertEqual(0x12345678, reader.read_uint32())
+            self.assertEqual((1, 2, 3), reader.read_uint16_array(3))
+            self.assertEqual((4, 5), reader.read_uint32_array(2))
+            self.assertEqual("name", reader.read_cstring())
+            self.assertEqual(25, reader.tell())
+            self.assertEqual("re", reader.read(2))
+            # Reads past the end of the file within its containing file fail.
+            self.assertRaises(struct.error, reader.read_uint8)
+            reader.seek(-2, os.SEEK_END)
+            self.assertRaises(struct.error, reader.read_cstring)
+
+    def test_contained_file_loads(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        with open(FILE_NAME, "rb") as input_file:
+            file_data = input_file.read()
+        file_info, data_types = loaderlib.load_file(StringIO.StringIO(file_data))
+        container_data = "\0" * 1000 + file_data + "\0" * 1000
+        for f in (StringIO.StringIO(container_data), loaderlib.ingest_file(StringIO.StringIO(container_data))):
+            contained_file_info, contained_data_types = loaderlib.load_file(f, file_offset=1000, file_length=len(file_data))
+            self.assertEqual(file_info.segments, contained_file_info.segments)
+            self.assertEqual(file_info.relocations_by_segment_id, contained_file_info.relocations_by_segment_id)
+            self.assertEqual(file_info.symbols_by_segment_id, contained_file_info.symbols_by_segment_id)
+
+
+class TOOL_ParallelAnalysis_TestCase(unittest.TestCase):
+    def assert_parallel_analysis_matches_serial(self, file_name):
+        program_datas = []
+        for analysis_processes in (1, 2):
+            toolapiob = toolapi.ToolAPI()
+            result = toolapiob.load_file(file_name, analysis_processes=analysis_processes)
+            if type(result) in types.StringTypes:
+                self.fail("loading error ('%s')" % result)
+            program_datas.append(toolapiob.editor_state.disassembly_data)
+
+        serial_data, parallel_data = program_datas
+        line_count = disassembly.get_file_line_count(serial_data)
+        self.assertEqual(line_count, disassembly.get_file_line_count(parallel_data))
+        self.assertEqual(serial_data.symbols_by_address, parallel_data.symbols_by_address)
+        self.assertEqual(serial_data.branch_addresses, parallel_data.branch_addresses)
+        self.assertEqual(serial_data.reference_addresses, parallel_data.reference_addresses)
+        self.assertEqual(serial_data.post_segment_addresses, parallel_data.post_segment_addresses)
+        self.assertEqual([ (block.address, block.length, block.flags) for block in serial_data.blocks ], [ (block.address, block.length, block.flags) for block in parallel_data.blocks ])
+        for line_idx in range(line_count):
+            for column_idx in range(disassembly.LI_OPERANDS+1):
+                self.assertEqual(disassembly.get_file_line(serial_data, line_idx, column_idx), disassembly.get_file_line(parallel_data, line_idx, column_idx))
+        return serial_data
+
+    def test_parallel_analysis_matches_serial(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        self.assert_parallel_analysis_matches_serial(FILE_NAME)
+
+    def test_code_followed_across_segments(self):
+        # Three code hunks, which reach each other's code through relocated absolute addresses.
+        hunks = [
+            ("\x4e\xb9\0\0\0\0" "\x41\xf9\0\0\0\x28" "\x4e\x75" + "\xff" * 26 + "\x70\x02\x4e\x75" + "\xff" * 20, { 1: [ 2, 8 ] }),
+            ("\x4e\xb9\0\0\0\x28" "\x4e\xf9\0\0\0\0" + "\xff" * 28 + "\x11\x22\x33\x44" * 4, { 0: [ 2 ], 2: [ 8 ] }),
+            ("\x70\x04\x61\x00\x00\x06\x4e\x75\xff\xff\x70\x05\x4e\x75" + "\xff" * 10, {}),
+        ]
+        file_data = struct.pack(">5I", 0x3F3, 0, len(hunks), 0, len(hunks)-1) + "".join(struct.pack(">I", len(data)/4) for (data, relocations) in hunks)
+        for data, relocations in hunks:
+            file_data += struct.pack(">2I", 0x3E9, len(data)/4) + data + struct.pack(">I", 0x3EC)
+            for target_hunk_id, offsets in sorted(relocations.items()):
+                file_data += struct.pack(">2I%dI" % len(offsets), len(offsets), target_hunk_id, *offsets)
+            file_data += struct.pack(">2I", 0, 0x3F2)
+        fd, FILE_NAME = tempfile.mkstemp()
+        try:
+            os.write(fd, file_data)
+            os.close(fd)
+            program_data = self.assert_parallel_analysis_matches_serial(FILE_NAME)
+        finally:
+            os.remove(FILE_NAME)
+
+        # The last round explores the second and third segments together.
+        segment_addresses = [ loaderlib.get_segment_address(program_data.loader_segments, segment_id) for segment_id in range(len(hunks)) ]
+        for address in (segment_addresses[0], segment_addresses[0] + 0x28, segment_addresses[1], segment_addresses[2], segment_addresses[2] + 0x0A):
+            block, block_idx = disassembly.lookup_block_by_address(program_data, address)
+            self.assertEqual(block.address, address)
+            self.assertEqual(disassembly_data.get_block_data_type(block), disassembly_data.DATA_TYPE_CODE)
+
+
+class TOOL_AnalysisStats_TestCase(unittest.TestCase):
+    def test_load_counts_analysis_work(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        toolapiob = toolapi.ToolAPI()
+        result = toolapiob.load_file(FILE_NAME)
+        if type(result) in types.StringTypes:
+            self.fail("loading error ('%s')" % result)
+
+        counters, phase_times = toolapiob.get_analysis_stats()
+        counters = dict(counters)
+        self.assertGreater(counters["instructions_decoded"], 0)
+        self.assertGreater(counters["split_block_calls"], 0)
+        self.assertGreater(counters["xrefs_inserted"], 0)
+        self.assertEqual(counters["blocks_created"], len(toolapiob.editor_state.disassembly_data.blocks))
+        self.assertEqual([ phase_name for phase_name, seconds in phase_times ], [ "loader", "relocation", "disassembly", "postprocessing" ])
+
+
+class TOOL_Tracing_TestCase(unittest.TestCase):
+    def test_load_is_traced(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        fd, trace_file_path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        util.start_tracing(trace_file_path)
+        try:
+            toolapiob = toolapi.ToolAPI()
+            result = toolapiob.load_file(FILE_NAME)
+            if type(result) in types.StringTypes:
+                self.fail("loading error ('%s')" % result)
+        finally:
+            util.stop_tracing()
+
+        try:
+            with open(trace_file_path, "r") as f:
+                events = json.load(f)["traceEvents"]
+        finally:
+            os.remove(trace_file_path)
+        span_names = set(event["name"] for event in events)
+        for span_name in ("loaderlib.load_file", "loaderlib.cache_segment_data", "loaderlib.relocate_segment_data", "code_analysis_step", "worker_job"):
+            self.assertIn(span_name, span_names)
+        self.assertEqual(len([ event for event in events if event["ph"] == "B" ]), len([ event for event in events if event["ph"] == "E" ]))
+
+
+class DATA_CodeLineData_TestCase(unittest.TestCase):
+    def setUp(self):
+        self.line_data = disassembly_data.CodeLineData()
+        self.line_data.append(disassembly_data.SLD_INSTRUCTION, 0, 2, disassembly_data.CLF_BRANCH)
+        self.line_data.append(disassembly_data.SLD_COMMENT_FULL_LINE, "comment")
+        self.line_data.append(disassembly_data.SLD_INSTRUCTION, 2, 4)
+        self.line_data.append(disassembly_data.SLD_EQU_LOCATION_RELATIVE, 4)
+        self.line_data.append(disassembly_data.SLD_INSTRUCTION, 6, 2, disassembly_data.CLF_FINAL)
+
+    def tearDown(self):
+        self.line_data = None
+
+    def test_iterates_as_entries(self):
+        self.assertEqual(5, len(self.line_data))
+        self.assertEqual([
+            (disassembly_data.SLD_INSTRUCTION, 0),
+            (disassembly_data.SLD_COMMENT_FULL_LINE, "comment"),
+            (disassembly_data.SLD_INSTRUCTION, 2),
+            (disassembly_data.SLD_EQU_LOCATION_RELATIVE, 4),
+            (disassembly_data.SLD_INSTRUCTION, 6),
+        ], list(self.line_data))
+        self.assertEqual((disassembly_data.SLD_INSTRUCTION, 6), self.line_data[-1])
+        self.assertEqual([ 2, 0, 4, 0, 2 ], list(self.line_data.lengths))
+        self.assertEqual([ disassembly_data.CLF_BRANCH, 0, 0, 0, disassembly_data.CLF_FINAL ], list(self.line_data.flags))
+
+    def test_insert_moves_comments(self):
+        self.line_data.insert(0, disassembly_data.SLD_COMMENT_FULL_LINE, "first")
+        self.line_data.insert(3, disassembly_data.SLD_EQU_LOCATION_RELATIVE, 1)
+        self.assertEqual({ 0: "first", 2: "comment" }, self.line_data.comments)
+        self.assertEqual((disassembly_data.SLD_COMMENT_FULL_LINE, "comment"), self.line_data[2])
+        self.assertEqual((disassembly_data.SLD_EQU_LOCATION_RELATIVE, 1), self.line_data[3])
+        self.assertEqual([ 0, 2, 0, 0, 4, 0, 2 ], list(self.line_data.lengths))
+
+    def test_slice_reindexes_comments(self):
+        leading_line_data = self.line_data[:2]
+        trailing_line_data = self.line_data[1:]
+        self.assertEqual([ (disassembly_data.SLD_INSTRUCTION, 0), (disassembly_data.SLD_COMMENT_FULL_LINE, "comment") ], list(leading_line_data))
+        self.assertEqual({ 0: "comment" }, trailing_line_data.comments)
+        self.assertEqual([ 0, 4, 0, 2 ], list(trailing_line_data.lengths))
+        self.assertEqual({}, self.line_data[2:].comments)
+        # Slices are copies.
+        trailing_line_data.lengths[1] = 6
+        self.assertEqual(4, self.line_data.lengths[2])
+
+    def test_rebase_only_moves_offsets(self):
+        trailing_line_data = self.line_data[2:]
+        trailing_line_data.rebase(2)
+        self.assertEqual([
+            (disassembly_data.SLD_INSTRUCTION, 0),
+            (disassembly_data.SLD_EQU_LOCATION_RELATIVE, 2),
+            (disassembly_data.SLD_INSTRUCTION, 4),
+        ], list(trailing_line_data))
+        line_data = self.line_data[:]
+        line_data.rebase(0)
+        self.assertEqual(list(self.line_data), list(line_data))
+
+    def test_undecodable_saved_instruction(self):
+        if "TESTDATA_PATH" not in os.environ:
+            self.fail("TESTDATA_PATH environment variable required")
+
+        FILE_NAME = os.path.join(os.environ["TESTDATA_PATH"], "amiga", "gdbstop")
+        toolapiob = toolapi.ToolAPI()
+        result = toolapiob.load_file(FILE_NAME)
+        if type(result) in types.StringTypes:
+            self.fail("loading error ('%s')" % result)
+        program_data = toolapiob.editor_state.disassembly_data
+        for block_idx, block in enumerate(program_data.blocks):
+            if disassembly_data.get_block_data_type(block) == disassembly_data.DATA_TYPE_CODE and list(block.line_data.type_ids[:3]) == [ disassembly_data.SLD_INSTRUCTION ] * 3:
+                break
+        else:
+            self.fail("no code block with three leading instructions")
+        block_address, block_length = block.address, block.length
+        instruction_offsets = block.line_data.offsets[:3]
+
+        # Lines loaded from older project files have their instructions decoded to get their lengths.
+        for i in range(len(block.line_data)):
+            block.line_data.lengths[i] = block.line_data.flags[i] = 0
+        program_data.instruction_cache.clear()
+        bad_data_offset = block.segment_offset + instruction_offsets[1]
+        disassemble_one_line_func = program_data.dis_disassemble_one_line_func
+        program_data.dis_disassemble_one_line_func = lambda data, data_offset, address: (None, data_offset) if data_offset == bad_data_offset else disassemble_one_line_func(data, data_offset, address)
+        disassembly._realise_code_line_data(program_data, block)
+
+        # The bytes up to the next instruction are split off into a data block.
+        blocks = program_data.blocks[block_idx:block_idx+3]
+        self.assertEqual([ block_address, block_address + instruction_offsets[1], block_address + instruction_offsets[2] ], [ block.address for block in blocks ])
+        self.assertEqual(block_address + block_length, blocks[2].address + blocks[2].length)
+        self.assertEqual([ disassembly_data.DATA_TYPE_CODE, disassembly_data.DATA_TYPE_LONGWORD, disassembly_data.DATA_TYPE_CODE ], [ disassembly_data.get_block_data_type(block) for block in blocks ])
+        for block in (blocks[0], blocks[2]):
+            self.assertNotIn(0, [ block.line_data.lengths[i] for i, type_id in enumerate(block.line_data.type_ids) if type_id == disassembly_data.SLD_INSTRUCTION ])
+
+        # Every line of the blocks can be shown.
+        line0 = disassembly.get_block_line_number(program_data, block_idx)
+        lineN = disassembly.get_block_line_number(program_data, block_idx+3)
+        self.assertLess(line0, lineN)
+        for line_idx in range(line0, lineN):
+            for column_idx in range(disassembly.LI_OPERANDS+1):
+                disassembly.get_file_line(program_data, line_idx, column_idx)
+        self.assertEqual("%08X" % (block_address + instruction_offsets[1]), disassembly.get_file_line(program_data, disassembly.get_block_line_number(program_data, block_idx+1), disassembly.LI_OFFSET))
+
+
+class QTUI_PagedItemModel_TestCase(unittest.TestCase):
+    def setUp(self):
+        class PagedItemModel(qtui.PagedItemModel):
+            page_size = 2
+
+            def beginResetModel(self):
+                self.signals.append(("reset", len(self._row_data)))
+
+            def endResetModel(self):
+                self.signals.append(("reset-end", len(self._row_data)))
+
+            def beginInsertRows(self, parent, row0, rowN):
+                self.signals.append(("insert", row0, rowN))
+
+            def beginRemoveRows(self, parent, row0, rowN):
+                self.signals.append(("remove", row0, rowN))
+
+        self.rows = [ [ address ] for address in (1, 2, 5, 9, 10) ]
+        self.model = PagedItemModel([ ("Address", hex) ], None)
+        self.model.signals = []
+        self.data_rows = [ [ address ] for address in (3, 7, 8, 11) ]
+        self.data_model = PagedItemModel([ ("Address", hex) ], None)
+        self.data_model.signals = []
+
+        class EditorState(object):
+            addition_rows = []
+
+            def get_uncertain_references_by_address(self, editor_client, address):
+                return self.addition_rows
+
+        class Window(object):
+            uncertain_code_references_model = self.model
+            uncertain_data_references_model = self.data_model
+            editor_state = EditorState()
+            editor_client = None
+        self.window = Window()
+
+    def tearDown(self):
+        self.model = self.data_model = self.window = None
+
+    def fetch_rows(self, offset, limit):
+        return self.rows[offset:offset+limit]
+
+    def test_refetch_replaces_rows(self):
+        self.model._set_fetch_func(self.fetch_rows)
+        self.model.fetchMore(None)
+        self.assertEqual(self.rows[:4], self.model._row_data)
+
+        # Refetching from the start resets the view, rather than adding to the rows it was told of.
+        del self.model.signals[:]
+        self.model._set_fetch_func(self.fetch_rows)
+        self.assertEqual([ ("reset", 4), ("reset-end", 0), ("insert", 0, 1) ], self.model.signals)
+        self.assertEqual(self.rows[:2], self.model._row_data)
+        self.assertTrue(self.model.canFetchMore(None))
+
+    def test_cleared_model_stops_fetching(self):
+        self.model._set_fetch_func(self.fetch_rows)
+        self.model._clear_data()
+        self.assertEqual([], self.model._row_data)
+        self.assertFalse(self.model.canFetchMore(None))
+        self.assertEqual(None, self.model._fetch_func)
+        self.model.fetchMore(None)
+        self.assertEqual([], self.model._row_data)
+
+    def modify_uncertain_references(self, address, length, addition_rows):
+        # The rows are moved in the underlying lists, before the models are told.
+        self.rows = [ row for row in self.rows if not address <= row[0] < address + length ]
+        self.data_rows = sorted(self.data_rows + addition_rows)
+        self.window.editor_state.addition_rows = addition_rows
+        qtui.MainWindow.on_uncertain_reference_modification.im_func(self.window, ("CODE", "DATA", address, length))
+
+    def fetch_all(self, model):
+        while model.canFetchMore(None):
+            model.fetchMore(None)
+        return model._row_data
+
+    def test_modification_past_fetched_rows(self):
+        self.model._set_fetch_func(self.fetch_rows)
+        self.data_model._set_fetch_func(lambda offset, limit: self.data_rows[offset:offset+limit])
+        self.fetch_all(self.data_model)
+        self.modify_uncertain_references(5, 5, [ [ 5 ], [ 9 ] ])
+        # None of the fetched rows were changed.
+        self.assertEqual([ [ 1 ], [ 2 ] ], self.model._row_data)
+        self.assertEqual(self.rows, self.fetch_all(self.model))
+        self.assertEqual(self.data_rows, self.data_model._row_data)
+
+    def test_modification_extending_past_fetched_rows(self):
+        self.model._set_fetch_func(self.fetch_rows)
+        self.model.fetchMore(None)
+        self.data_model._set_fetch_func(lambda offset, limit: self.data_rows[offset:offset+limit])
+        self.modify_uncertain_references(2, 10, [ [ 2 ], [ 5 ], [ 9 ], [ 10 ] ])
+        self.assertEqual([ [ 1 ] ], self.model._row_data)
+        self.assertEqual(self.rows, self.fetch_all(self.model))
+        # Rows after the last fetched one are left to be paged in.
+        self.assertEqual([ [ 2 ], [ 3 ], [ 5 ], [ 7 ] ], self.data_model._row_data)
+        self.assertEqual(self.data_rows, self.fetch_all(self.data_model))
+
+    def test_modification_appended_to_fetched_rows(self):
+        self.model._set_fetch_func(self.fetch_rows)
+        self.data_model._set_fetch_func(lambda offset, limit: self.data_rows[offset:offset+limit])
+        self.fetch_all(self.data_model)
+        self.modify_uncertain_references(10, 1, [ [ 10 ] ])
+        self.assertEqual([ [ 1 ], [ 2 ] ], self.model._row_data)
+        self.assertEqual(self.data_rows, self.data_model._row_data)
+
+
 class QTUI_UncertainReferenceModification_TestCase(unittest.TestCase):
     def setUp(self):
         class Model(object):
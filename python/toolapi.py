@@ -25,6 +25,7 @@ import os
 import types
 
 import editor_state
+import util
 
 
 ERRMSG_FILE_DOES_NOT_EXIST = "File does not exist."
@@ -35,6 +36,7 @@ class ToolEditorClient(editor_state.ClientAPI):
 
     # External responsibility.
     _binary_parameters = None
+    _analysis_parameters = None
     _goto_address_value = None
 
     def reset_state(self):
@@ -56,6 +58,8 @@ class ToolEditorClient(editor_state.ClientAPI):
     def request_new_project_option_values(self, new_options):
         if self._binary_parameters is not None:
             new_options.dis_name, new_options.loader_load_address, new_options.loader_entrypoint_offset = self._binary_parameters
+        if self._analysis_parameters is not None:
+            new_options.analysis_processes, new_options.analysis_in_slices, new_options.analysis_cache_path = self._analysis_parameters
         return new_options
 
     def request_load_project_option_values(self, load_options):
@@ -67,7 +71,7 @@ class ToolEditorClient(editor_state.ClientAPI):
 
     # These can be ignored, as we have no GUI.
     def event_tick(self, active_client): pass
-    def event_prolonged_action(self, active_client, title_msg_id, description_msg_id, can_cancel, step_count, abort_callback): pass
+    def event_prolonged_action(self, active_client, title_msg_id, description_msg_id, can_cancel, step_count, abort_callback, is_modal=True): pass
     def event_prolonged_action_update(self, active_client, description_msg_id, step_number): pass
     def event_prolonged_action_complete(self, active_client): pass
     def event_load_start(self, active_client, file_path): pass
@@ -85,6 +89,7 @@ class ToolAPI(object):
     input_file_path = None
 
     def __init__(self, editor_state_ob=None):
+        util.start_tracing_if_requested()
         self.editor_client = ToolEditorClient(self)
         if editor_state_ob is None:
             editor_state_ob = editor_state.EditorState()
@@ -107,22 +112,38 @@ class ToolAPI(object):
         """ Called by the editor client. """
         return self.input_file_path
 
-    def load_binary_file(self, file_path, dis_name, load_address, entrypoint_offset):
+    def load_binary_file(self, file_path, dis_name, load_address, entrypoint_offset, analysis_processes=1, analysis_in_slices=False, analysis_cache_path=None):
         # Not ideal, but works for now.
         self.editor_client._binary_parameters = dis_name, load_address, entrypoint_offset
         try:
-            return self.load_file(file_path)
+            return self.load_file(file_path, analysis_processes=analysis_processes, analysis_in_slices=analysis_in_slices, analysis_cache_path=analysis_cache_path)
         finally:
             self.editor_client._binary_parameters = None
 
-    def load_file(self, file_path, input_file_path=None):
+    def load_file(self, file_path, input_file_path=None, analysis_processes=1, analysis_in_slices=False, analysis_cache_path=None):
         self.file_path = file_path
         self.input_file_path = input_file_path
-        result = self.editor_state.load_file(self.editor_client)
+        self.editor_client._analysis_parameters = analysis_processes, analysis_in_slices, analysis_cache_path
+        try:
+            result = self.editor_state.load_file(self.editor_client)
+        finally:
+            self.editor_client._analysis_parameters = None
         if result is None or type(result) in types.StringTypes:
             self.editor_state.reset_state(self.editor_client)
+        elif not analysis_in_slices:
+            # A loaded project may have been saved with analysis still in progress.
+            self.step_analysis()
         return result
 
+    def is_analysis_pending(self):
+        return self.editor_state.is_analysis_pending(self.editor_client)
+
+    def step_analysis(self, budget_ms=None):
+        return self.editor_state.step_analysis(self.editor_client, budget_ms)
+
+    def get_analysis_stats(self):
+        return self.editor_state.get_analysis_stats(self.editor_client)
+
     def _get_address(self):
         return self.editor_state.get_address(self.editor_client)
 
@@ -149,11 +170,29 @@ class ToolAPI(object):
         elif type_name == "ascii":
             return self.editor_state.set_datatype_ascii(self.editor_client)
 
-    def get_uncertain_code_references(self):
-        return self.editor_state.get_uncertain_code_references(self.editor_client)
+    def find_ascii_strings(self, segment_id=None):
+        return self.editor_state.find_ascii_strings(self.editor_client, segment_id)
+
+    def set_datatype_ascii_for_strings(self, strings):
+        return self.editor_state.set_datatype_ascii_for_strings(self.editor_client, strings)
+
+    def find_code_candidates(self, process_count=1):
+        return self.editor_state.find_code_candidates(self.editor_client, process_count)
+
+    def set_datatype_code_for_candidates(self, candidates):
+        return self.editor_state.set_datatype_code_for_candidates(self.editor_client, candidates)
+
+    def get_uncertain_code_references(self, offset=0, limit=None):
+        return self.editor_state.get_uncertain_code_references(self.editor_client, offset, limit)
+
+    def get_uncertain_code_reference_count(self):
+        return self.editor_state.get_uncertain_code_reference_count(self.editor_client)
+
+    def get_uncertain_data_references(self, offset=0, limit=None):
+        return self.editor_state.get_uncertain_data_references(self.editor_client, offset, limit)
 
-    def get_uncertain_data_references(self):
-        return self.editor_state.get_uncertain_data_references(self.editor_client)
+    def get_uncertain_data_reference_count(self):
+        return self.editor_state.get_uncertain_data_reference_count(self.editor_client)
 
     def get_source_code_for_address(self, address):
         return self.editor_state.get_source_code_for_address(self.editor_client, address)
@@ -16,8 +16,19 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import atexit
+import contextlib
 import hashlib
+import json
 import os
+import threading
+import time
+
+
+TRACE_FILE_ENV_VAR = "PEASAUCE_TRACE_FILE"
+
+_trace_file_path = None
+_trace_events = []
 
 
 def calculate_file_checksum(input_file):
@@ -28,3 +39,51 @@ def calculate_file_checksum(input_file):
         hasher.update(data)
         data = input_file.read(256 * 1024)
     return hasher.digest()
+
+def replace_file(source_path, destination_path):
+    """ Windows will not rename over an existing file. """
+    if os.name == "nt" and os.path.exists(destination_path):
+        os.remove(destination_path)
+    os.rename(source_path, destination_path)
+
+
+def start_tracing(file_path):
+    """ Record traced spans from now on, to be written to the given file in Chrome trace event format. """
+    global _trace_file_path
+    _trace_file_path = file_path
+    del _trace_events[:]
+
+def start_tracing_if_requested():
+    file_path = os.environ.get(TRACE_FILE_ENV_VAR)
+    if file_path and _trace_file_path is None:
+        start_tracing(file_path)
+
+def stop_tracing():
+    """ Write out the spans recorded so far, and stop recording. """
+    global _trace_file_path
+    if _trace_file_path is None:
+        return
+    with open(_trace_file_path, "w") as f:
+        json.dump({ "traceEvents": _trace_events, "displayTimeUnit": "ms" }, f)
+    _trace_file_path = None
+    del _trace_events[:]
+
+atexit.register(stop_tracing)
+
+def _add_trace_event(name, phase, args):
+    event = { "name": name, "ph": phase, "ts": time.time() * 1000000.0, "pid": os.getpid(), "tid": threading.current_thread().ident }
+    if args:
+        event["args"] = args
+    _trace_events.append(event)
+
+@contextlib.contextmanager
+def trace_span(name, **args):
+    """ Record the time spent within the with statement, if tracing. """
+    if _trace_file_path is None:
+        yield
+        return
+    _add_trace_event(name, "B", args)
+    try:
+        yield
+    finally:
+        _add_trace_event(name, "E", None)